@@ -11,5 +11,11 @@ python manage.py collectstatic --no-input
 # Apply any outstanding database migrations
 python manage.py migrate
 
+# Create the cache table (no-op unless CACHE_URL points to the database)
+python manage.py createcachetable
+
+# Load the ticker index used by search and autocomplete
+python manage.py load_tickers
+
 # Create superuser from environment variables if it doesn't exist
 python create_superuser.py
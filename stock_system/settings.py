@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 from pathlib import Path
+from urllib.parse import urlparse
 import os
 import dj_database_url
 from dotenv import load_dotenv
@@ -53,7 +54,9 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'stocks.middleware.TimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'stocks.middleware.PrivateCacheMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -96,6 +99,47 @@ db_url = os.environ.get('DATABASE_URL')
 if db_url:
     DATABASES['default'] = dj_database_url.config(default=db_url, conn_max_age=600)
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Quotes, bars and dividends are written from several threads at once: take the write lock when
+    # a transaction starts and wait for it, instead of failing with "database is locked"
+    DATABASES['default'].setdefault('OPTIONS', {}).update(transaction_mode='IMMEDIATE', timeout=30)
+
+# SQLite test databases in a private temporary file, see stocks/testing.py
+TEST_RUNNER = 'stocks.testing.TestRunner'
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+# CACHE_URL picks a backend shared by every worker (locmem is per process):
+#   redis://host:6379/0 (needs the redis package), db://table_name, file:///path/to/dir, locmem://
+# With DATABASE_URL set it defaults to the database table, created by `manage.py createcachetable`.
+CACHE_BACKENDS = {
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'rediss': 'django.core.cache.backends.redis.RedisCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+}
+cache_url = urlparse(os.environ.get('CACHE_URL', 'db://stocks_cache' if db_url else 'locmem://'))
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[cache_url.scheme],
+        'LOCATION': {
+            'redis': cache_url.geturl(),
+            'rediss': cache_url.geturl(),
+            'file': cache_url.path,
+        }.get(cache_url.scheme, cache_url.netloc),
+        # Bump CACHE_VERSION when a deploy changes the format of cached values
+        'KEY_PREFIX': os.environ.get('CACHE_KEY_PREFIX', 'stocks'),
+        'VERSION': int(os.environ.get('CACHE_VERSION', '1')),
+    }
+}
+if cache_url.scheme not in ('redis', 'rediss'):
+    # The default of 300 entries is far below one quote and a few history periods per ticker
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -136,9 +180,22 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 # Simplified static file serving.
 # https://whitenoise.readthedocs.io/en/latest/django.html
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# (STORAGES replaced STATICFILES_STORAGE, which Django no longer reads.) The manifest also feeds
+# the service worker's precache list, see stocks.views.service_worker.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
 
 # Authentication Custom Redirects
 LOGIN_REDIRECT_URL = 'stocks:dashboard'
 LOGOUT_REDIRECT_URL = 'login'
 LOGIN_URL = 'login'
+
+# Prometheus scrapes /metrics with "Authorization: Bearer <METRICS_TOKEN>". Without a token only
+# staff users can read it.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.apps import apps
-from .models import Favorite, PortfolioItem
+from .models import Favorite, PortfolioItem, PortfolioTransaction
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
@@ -13,6 +13,32 @@ class PortfolioItemAdmin(admin.ModelAdmin):
     list_display = ('user', 'ticker', 'name', 'quantity', 'added_at')
     search_fields = ('user__username', 'ticker', 'name')
     list_filter = ('added_at', 'updated_at')
+    # Quantities change only through the ledger (stocks/ledger.py), whose callers revalue the snapshot
+    readonly_fields = ('user', 'ticker', 'quantity')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(PortfolioTransaction)
+class PortfolioTransactionAdmin(admin.ModelAdmin):
+    """
+    The ledger is append-only: listed for inspection, never edited.
+    """
+    list_display = ('user', 'ticker', 'quantity', 'source', 'created_at')
+    search_fields = ('user__username', 'ticker')
+    list_filter = ('source', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 # Automatiza o registro de todas as tabelas (models) no admin
 models = apps.get_models()
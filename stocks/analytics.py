@@ -0,0 +1,131 @@
+"""
+Portfolio risk/return analytics. The close series of all holdings are loaded in one batched pass
+(services.get_close_matrix) into a (bars x assets) matrix and every metric is computed on it
+with NumPy, for all assets at once.
+"""
+import hashlib
+import numpy as np
+from django.core.cache import cache
+from .services import get_close_matrix, default_interval, FAILURE_TTL, HIST_TTL
+
+# Bars per year, to annualize returns and volatility. B3 trades ~7h a day, 28 bars of 15 minutes
+BARS_PER_YEAR = {'15m': 252 * 28, '1d': 252, '1wk': 52}
+
+
+def get_portfolio_analytics(user_id, holdings, period='1y'):
+    """
+    Cached portfolio_analytics, per user, set of holdings and period.
+    holdings: list of {'ticker', 'quantity', 'dividend_yield'}.
+    """
+    holdings_hash = hashlib.md5(
+        '|'.join(f"{h['ticker']}:{h['quantity']}:{h['dividend_yield']}" for h in sorted(holdings, key=lambda h: h['ticker'])).encode()
+    ).hexdigest()
+    cache_key = f"portfolio_analytics_{user_id}_{holdings_hash}_{period}"
+
+    result = cache.get(cache_key)
+    if result is None:
+        result = portfolio_analytics(holdings, period)
+        # Missing assets are usually a transient upstream failure, retried once it has expired
+        cache.set(cache_key, result, timeout=FAILURE_TTL if result['missing'] else HIST_TTL)
+    return result
+
+
+def portfolio_analytics(holdings, period='1y'):
+    """
+    Returns, volatility, covariance/correlation, drawdowns and income projection of a buy-and-hold
+    portfolio with the current quantities over the period.
+    """
+    tickers = [h['ticker'] for h in holdings]
+    df, payloads = get_close_matrix(tickers, period)
+    result = {
+        'period': period,
+        'interval': default_interval(period),
+        'missing': [t for t, p in payloads.items() if p is None],
+    }
+    if df is None:
+        return {**result, 'tickers': [], 'observations': 0}
+
+    # Fill gaps (holidays of one exchange) with the last close, and start when every asset has a price
+    df = df.ffill().dropna()
+    tickers = [t for t in tickers if t in df.columns]
+    holdings = {h['ticker']: h for h in holdings}
+    prices = df[tickers].to_numpy(dtype='float64')  # (bars, assets)
+    quantities = np.array([holdings[t]['quantity'] for t in tickers], dtype='float64')
+    dividend_yields = np.array([holdings[t]['dividend_yield'] for t in tickers], dtype='float64')
+
+    result.update({
+        'tickers': tickers,
+        'observations': len(prices),
+        'start': df.index[0] if len(prices) else None,
+        'end': df.index[-1] if len(prices) else None,
+    })
+    if len(prices) < 2:
+        return result
+
+    bars_per_year = BARS_PER_YEAR.get(result['interval'], 252)
+    values = prices * quantities  # Value of each position over time
+    portfolio = values.sum(axis=1)
+
+    asset_returns = prices[1:] / prices[:-1] - 1
+    portfolio_returns = portfolio[1:] / portfolio[:-1] - 1
+
+    covariance = np.cov(asset_returns, rowvar=False, ddof=1).reshape(len(tickers), len(tickers)) * bars_per_year
+    with np.errstate(invalid='ignore', divide='ignore'):
+        volatility = np.sqrt(np.diag(covariance))
+        correlation = covariance / np.outer(volatility, volatility)
+
+    weights = values[-1] / portfolio[-1]
+    annual_income = values[-1] * dividend_yields
+    years = len(asset_returns) / bars_per_year
+
+    assets_total_return = prices[-1] / prices[0] - 1
+    portfolio_total_return = portfolio[-1] / portfolio[0] - 1
+
+    result.update({
+        'portfolio': {
+            'value': _clean(portfolio[-1]),
+            'total_return': _clean(portfolio_total_return),
+            # Compounding a few weeks of returns to a year says nothing, only longer windows get it
+            'annualized_return': _clean((1 + portfolio_total_return) ** (1 / years) - 1) if years >= 1 else None,
+            'annualized_volatility': _clean(portfolio_returns.std(ddof=1) * np.sqrt(bars_per_year)),
+            'max_drawdown': _clean(_max_drawdown(portfolio)),
+        },
+        'assets': {
+            ticker: {
+                'weight': weight,
+                'total_return': total_return,
+                'annualized_volatility': vol,
+                'max_drawdown': drawdown,
+                'annual_income': income,
+            }
+            for ticker, weight, total_return, vol, drawdown, income in zip(
+                tickers, _clean(weights), _clean(assets_total_return), _clean(volatility),
+                _clean(_max_drawdown(prices)), _clean(annual_income)
+            )
+        },
+        'covariance': _clean(covariance),
+        'correlation': _clean(correlation),
+        'income': {
+            'annual': _clean(annual_income.sum()),
+            'semiannual': _clean(annual_income.sum() / 2.0),
+            'quarterly': _clean(annual_income.sum() / 4.0),
+            'monthly': _clean(annual_income.sum() / 12.0),
+            'yield': _clean(annual_income.sum() / portfolio[-1]),
+        },
+    })
+    return result
+
+
+def _max_drawdown(values):
+    # Largest drop from a running peak, per column for 2-d input
+    peaks = np.maximum.accumulate(values, axis=0)
+    return (values / peaks - 1).min(axis=0)
+
+
+def _clean(values):
+    # Rounded plain Python numbers for JSON, NaN/inf (e.g. correlation of a flat series) as None
+    values = np.asarray(values, dtype='float64')
+    if values.ndim == 0:
+        return round(float(values), 6) if np.isfinite(values) else None
+    rounded = np.round(values, 6)
+    return np.where(np.isfinite(rounded), rounded, None).tolist()
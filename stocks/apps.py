@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class StocksConfig(AppConfig):
     name = 'stocks'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .metrics import install_query_hook
+        connection_created.connect(install_query_hook)
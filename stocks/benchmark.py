@@ -0,0 +1,470 @@
+"""
+Benchmark harness for the stock views (see `manage.py benchmark`).
+
+Requests go through the Django test client, so middleware, sessions, templates and the ORM are all
+measured, while Yahoo is replaced by FakeYahoo: an in-process upstream with configurable latency
+and failure rate that serves chart, quote and dividend payloads for a fixed set of symbols.
+Every phase reports latency percentiles, upstream calls, cache hit ratio and queries per request.
+"""
+import asyncio
+import math
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db.backends import utils as db_utils
+from django.test import Client, override_settings
+from . import services, upstream
+from .models import (
+    DividendSeries, Favorite, PortfolioItem, PortfolioSnapshot, PriceSeries, StockProfile, TickerSymbol,
+)
+
+# Seconds covered by each chart range and interval, close enough to what Yahoo returns
+RANGE_DAYS = {'1d': 3, '5d': 8, '1mo': 31, '3mo': 92, '6mo': 183, '1y': 366, '5y': 1827, 'max': 3650}
+INTERVAL_SECONDS = {'15m': 900, '1d': 86400, '1wk': 604800, '1mo': 2592000}
+
+SCENARIOS = ['cold', 'warm', 'herd_expired', 'herd_stale']
+VIEWS = ['dashboard', 'portfolio', 'history']
+HISTORY_PERIODS = ['1mo', '1y']
+
+# Cache keys holding data (as opposed to leases, failures and bookkeeping)
+DATA_KEY_PREFIXES = ('quote_', 'hist_')
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+class FakeYahoo:
+    """
+    Fake upstream. Only `symbols` exist, anything else answers like Yahoo does for unknown symbols.
+    Each call sleeps `latency` seconds and fails with a 503 with probability `failure_rate`.
+    """
+    def __init__(self, symbols, latency=0.05, failure_rate=0.0, seed=0):
+        self.symbols = set(symbols)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.inflight = 0
+        self.last_call = 0.0
+
+    # Transports
+
+    def session(self):
+        fake = self
+
+        class Session:
+            def get(self, url, params=None, timeout=None):
+                with fake.request('chart'):
+                    time.sleep(fake.latency)
+                    return fake.chart(url, params or {})
+
+            def close(self):
+                pass
+        return Session()
+
+    def async_session(self):
+        fake = self
+
+        class AsyncSession:
+            async def get(self, url, params=None, timeout=None):
+                with fake.request('chart'):
+                    await asyncio.sleep(fake.latency)
+                    return fake.chart(url, params or {})
+        return AsyncSession()
+
+    def ticker_class(self):
+        fake = self
+
+        class Ticker:
+            def __init__(self, symbol, session=None):
+                self.symbol = symbol
+
+            @property
+            def info(self):
+                with fake.request('info'):
+                    time.sleep(fake.latency)
+                    if fake.failed():
+                        raise upstream.UpstreamHTTPError(503)
+                    return fake.info(self.symbol)
+        return Ticker
+
+    @contextmanager
+    def request(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] += 1
+            self.inflight += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.inflight -= 1
+                self.last_call = time.monotonic()
+
+    def take_calls(self):
+        with self.lock:
+            calls, self.calls = self.calls, Counter()
+        return calls
+
+    def failed(self):
+        with self.lock:
+            return self.random.random() < self.failure_rate
+
+    def wait_idle(self, settle=0.2, timeout=30):
+        """
+        Wait for background revalidations to finish: nothing in flight and no call for `settle` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                idle = self.inflight == 0 and time.monotonic() - self.last_call >= settle
+            if idle:
+                return
+            time.sleep(settle / 4)
+
+    # Payloads
+
+    def chart(self, url, params):
+        if self.failed():
+            return FakeResponse(503, {})
+        symbol = url.rsplit('/', 1)[1]
+        if symbol not in self.symbols:
+            return FakeResponse(404, {'chart': {'result': None, 'error': {'code': 'Not Found'}}})
+
+        now = int(time.time())
+        step = INTERVAL_SECONDS.get(params.get('interval'), 86400)
+        if 'period1' in params:
+            start = int(params['period1'])
+        else:
+            start = now - RANGE_DAYS.get(params.get('range'), 3650) * 86400
+        timestamps = np.arange(start - start % step, now, step)
+        closes = self.price(symbol, timestamps)
+
+        result = {
+            'meta': {
+                'symbol': symbol,
+                'currency': 'BRL' if symbol.endswith('.SA') else 'USD',
+                'longName': f"{symbol} Fake Corp",
+                'exchangeTimezoneName': 'America/Sao_Paulo' if symbol.endswith('.SA') else 'America/New_York',
+                'regularMarketPrice': float(self.price(symbol, now)),
+                'previousClose': float(self.price(symbol, now - 86400)),
+            },
+            'timestamp': timestamps.tolist(),
+            'indicators': {'quote': [{
+                'open': closes.tolist(), 'high': (closes * 1.01).tolist(), 'low': (closes * 0.99).tolist(),
+                'close': closes.tolist(), 'volume': [100000] * len(timestamps),
+            }]},
+        }
+        if 'div' in params.get('events', ''):
+            # Quarterly dividends of 1% of the price
+            quarter = 91 * 86400
+            dates = np.arange(start - start % quarter + quarter, now, quarter)
+            result['events'] = {'dividends': {
+                str(date): {'date': int(date), 'amount': round(float(self.price(symbol, date)) * 0.01, 4)}
+                for date in dates
+            }}
+        return FakeResponse(200, {'chart': {'result': [result], 'error': None}})
+
+    def price(self, symbol, timestamps):
+        # Deterministic per symbol and timestamp, so delta downloads agree with earlier ones
+        seed = zlib.crc32(symbol.encode())
+        base = 10 + seed % 90
+        return np.round(base * (1 + 0.2 * np.sin(np.asarray(timestamps) / 2e6 + seed)), 2)
+
+    def info(self, symbol):
+        if symbol not in self.symbols:
+            return {}
+        price = float(self.price(symbol, time.time()))
+        return {
+            'longName': f"{symbol} Fake Corp", 'longBusinessSummary': 'Benchmark company.',
+            'sector': 'Benchmark', 'industry': 'Benchmark', 'trailingPE': 10.0, 'priceToBook': 1.5,
+            'trailingEps': price / 10, 'bookValue': price / 1.5, 'marketCap': 1e10,
+            'fiftyTwoWeekHigh': price * 1.2, 'fiftyTwoWeekLow': price * 0.8,
+            'averageVolume': 1e6, 'dividendYield': 0.04,
+        }
+
+
+class Probe:
+    """
+    Counts cache lookups (L1 and shared cache, data keys only) and SQL queries of every thread.
+    Queries against the database cache table are counted apart from the application's.
+    """
+    def __init__(self, cache_table=None):
+        self.cache_table = cache_table
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def add(self, **counts):
+        with self.lock:
+            self.counts.update(counts)
+
+    def reset(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+    @contextmanager
+    def installed(self):
+        probe = self
+        backend = type(caches['default'])
+        backend_get, backend_get_many = backend.get, backend.get_many
+        local_get = services.LocalCache.get
+        execute, executemany = db_utils.CursorWrapper.execute, db_utils.CursorWrapper.executemany
+
+        def get(self, key, default=None, version=None):
+            value = backend_get(self, key, default, version)
+            if _is_data_key(key):
+                probe.add(**{'l2_hits' if value is not default else 'misses': 1})
+            return value
+
+        def get_many(self, keys, version=None):
+            keys = list(keys)
+            found = backend_get_many(self, keys, version)
+            data_keys = [key for key in keys if _is_data_key(key)]
+            hits = sum(1 for key in data_keys if key in found)
+            probe.add(l2_hits=hits, misses=len(data_keys) - hits)
+            return found
+
+        def l1_get(self, key):
+            entry = local_get(self, key)
+            if self is services._quotes_l1 and entry is not None:
+                # Only hits: an L1 miss is followed by a shared cache lookup, counted there
+                probe.add(l1_hits=1)
+            return entry
+
+        def count_query(sql):
+            table = probe.cache_table
+            probe.add(**{'cache_queries' if table and table in sql else 'queries': 1})
+
+        def cursor_execute(self, sql, params=None):
+            count_query(sql)
+            return execute(self, sql, params)
+
+        def cursor_executemany(self, sql, param_list):
+            count_query(sql)
+            return executemany(self, sql, param_list)
+
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.object(backend, 'get', get))
+            stack.enter_context(mock.patch.object(backend, 'get_many', get_many))
+            stack.enter_context(mock.patch.object(services.LocalCache, 'get', l1_get))
+            stack.enter_context(mock.patch.object(db_utils.CursorWrapper, 'execute', cursor_execute))
+            stack.enter_context(mock.patch.object(db_utils.CursorWrapper, 'executemany', cursor_executemany))
+            yield self
+
+
+def _is_data_key(key):
+    return key.startswith(DATA_KEY_PREFIXES) and not key.endswith('_failed')
+
+
+@contextmanager
+def fake_upstream(fake, upstream_rate):
+    """
+    Route every upstream call of the services to `fake`.
+    """
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.object(upstream, 'pool', upstream.SessionPool(factory=fake.session)))
+        stack.enter_context(mock.patch.object(upstream, 'get_async_session', fake.async_session))
+        stack.enter_context(mock.patch.object(services.yf, 'Ticker', fake.ticker_class()))
+        stack.enter_context(mock.patch.object(upstream, 'UPSTREAM_RATE', upstream_rate))
+        yield fake
+
+
+@contextmanager
+def fresh_cache():
+    """
+    Empty shared cache (a new key prefix on the configured backend, so nothing else is touched)
+    and empty in-process caches.
+    """
+    config = {alias: dict(options) for alias, options in caches.settings.items()}
+    default = config['default']
+    namespace = f"bench-{uuid.uuid4().hex[:8]}"
+    default['KEY_PREFIX'] = f"{default.get('KEY_PREFIX', '')}{namespace}"
+    if default['BACKEND'].endswith('LocMemCache'):
+        default['LOCATION'] = namespace
+    with override_settings(CACHES=config):
+        services._quotes_l1.clear()
+        services._aliases_l1.clear()
+        yield
+
+
+@contextmanager
+def everything_stale():
+    """
+    Every cached entry counts as stale, so each hit is served while it is revalidated.
+    """
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.object(services, 'QUOTE_TTL', 0))
+        stack.enter_context(mock.patch.object(services, 'HIST_TTL', 0))
+        services._quotes_l1.clear()
+        yield
+
+
+def run_requests(requests, concurrency=1):
+    """
+    Issue the (client, url) requests and return [(seconds, status)]. With concurrency > 1 they go
+    in waves of `concurrency` threads released together, like a herd on the same entries.
+    """
+    def issue(client, url):
+        started = time.perf_counter()
+        response = client.get(url)
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+        return time.perf_counter() - started, response.status_code
+
+    if concurrency <= 1:
+        return [issue(client, url) for client, url in requests]
+
+    results = []
+    for start in range(0, len(requests), concurrency):
+        wave = requests[start:start + concurrency]
+        barrier = threading.Barrier(len(wave))
+        wave_results = [None] * len(wave)
+
+        def worker(position, client, url):
+            barrier.wait()
+            wave_results[position] = issue(client, url)
+
+        threads = [threading.Thread(target=worker, args=(i, client, url)) for i, (client, url) in enumerate(wave)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results.extend(wave_results)
+    return results
+
+
+def summarize(view, scenario, results, fake_calls, counts, concurrency):
+    latencies = np.array([seconds for seconds, _ in results]) * 1000
+    requests = len(results)
+    lookups = counts['l1_hits'] + counts['l2_hits'] + counts['misses']
+    upstream_total = sum(fake_calls.values())
+    return {
+        'view': view,
+        'scenario': scenario,
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': sum(1 for _, status in results if status >= 400),
+        'latency_ms': {
+            'p50': _round(np.percentile(latencies, 50)),
+            'p99': _round(np.percentile(latencies, 99)),
+            'mean': _round(latencies.mean()),
+            'max': _round(latencies.max()),
+        },
+        'upstream_calls': {
+            'total': upstream_total,
+            'per_request': _round(upstream_total / requests),
+            'by_endpoint': dict(sorted(fake_calls.items())),
+        },
+        'cache': {
+            'l1_hits': counts['l1_hits'],
+            'l2_hits': counts['l2_hits'],
+            'misses': counts['misses'],
+            'hit_ratio': _round((counts['l1_hits'] + counts['l2_hits']) / lookups) if lookups else None,
+        },
+        'queries_per_request': _round(counts['queries'] / requests),
+        'cache_queries_per_request': _round(counts['cache_queries'] / requests),
+    }
+
+
+def _round(value):
+    return None if value is None or math.isnan(value) else round(float(value), 3)
+
+
+def seed(users, holdings, tickers, rng):
+    """
+    Create `users` users, each favoriting and holding `holdings` tickers drawn from the first
+    `tickers` symbols of the index (so popular tickers are shared). Returns (users, symbols).
+    """
+    symbols = list(TickerSymbol.objects.values_list('symbol', flat=True)[:max(tickers, holdings)])
+    created = []
+    for number in range(users):
+        user = User.objects.create_user(f"bench{number}")
+        picks = rng.choice(symbols, size=min(holdings, len(symbols)), replace=False).tolist()
+        Favorite.objects.bulk_create([Favorite(user=user, ticker=ticker, name=ticker) for ticker in picks])
+        PortfolioItem.objects.bulk_create([
+            PortfolioItem(user=user, ticker=ticker, name=ticker, quantity=int(rng.integers(1, 500)))
+            for ticker in picks
+        ])
+        created.append(user)
+    return created, symbols
+
+
+def build_requests(view, users, symbols, count):
+    """
+    `count` (client, url) requests for a view, spread round-robin over the users or tickers.
+    """
+    if view == 'history':
+        targets = [(Client(), f"/api/stock/{ticker}/history/?period={period}")
+                   for period in HISTORY_PERIODS for ticker in symbols]
+    else:
+        url = '/' if view == 'dashboard' else '/portfolio/'
+        targets = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            targets.append((client, url))
+    return [targets[i % len(targets)] for i in range(count)]
+
+
+def reset_stores():
+    """
+    Empty the database-backed stores (bars, dividends, fundamentals, snapshots), for a cold start.
+    """
+    for model in (PriceSeries, DividendSeries, StockProfile, PortfolioSnapshot):
+        model.objects.all().delete()
+
+
+def run_benchmark(fake, probe, users, symbols, views=VIEWS, scenarios=SCENARIOS, requests=50, concurrency=10):
+    """
+    Run every scenario of every view and return the list of summaries:
+    - cold: empty caches and stores, sequential requests.
+    - warm: the same requests again.
+    - herd_expired: the shared cache is emptied (stores stay warm) and requests come in waves of
+      `concurrency` identical ones, measuring request coalescing.
+    - herd_stale: every entry is stale, waves again, measuring stale-while-revalidate.
+    """
+    results = []
+    for view in views:
+        plan = build_requests(view, users, symbols, requests)
+        herd_plan = [request for request in plan[:max(1, requests // concurrency)] for _ in range(concurrency)]
+        with ExitStack() as phase_cache:
+            phase_cache.enter_context(fresh_cache())
+            for scenario in scenarios:
+                if scenario == 'cold':
+                    phase_cache.close()
+                    phase_cache.enter_context(fresh_cache())
+                    reset_stores()
+                elif scenario == 'herd_expired':
+                    phase_cache.close()
+                    phase_cache.enter_context(fresh_cache())
+
+                fake.take_calls()
+                probe.reset()
+                if scenario == 'herd_stale':
+                    with everything_stale():
+                        timings = run_requests(herd_plan, concurrency)
+                        fake.wait_idle()
+                elif scenario.startswith('herd'):
+                    timings = run_requests(herd_plan, concurrency)
+                else:
+                    timings = run_requests(plan)
+                fake.wait_idle()
+                results.append(summarize(
+                    view, scenario, timings, fake.take_calls(), probe.reset(),
+                    concurrency if scenario.startswith('herd') else 1
+                ))
+    return results
@@ -0,0 +1,24 @@
+"""
+Database access from async code.
+"""
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+
+def db_sync_to_async(fn, executor=None):
+    """
+    sync_to_async(fn, thread_sensitive=False) for functions that use the database. Django only
+    recycles connections around requests, on the request thread, so here the executor thread's
+    connection is checked before and after each call: one past CONN_MAX_AGE or broken by the
+    server is closed instead of failing every later call run by that thread.
+    Calls run in the event loop's default executor unless another one is given.
+    """
+    @wraps(fn)
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False, executor=executor)
@@ -0,0 +1,96 @@
+"""
+Per-user cache of rendered page fragments: the favorite cards of the dashboard and the holding
+cards of the portfolio page. A fragment is stored with the user's version stamp and served as long
+as the stamp is unchanged and the fragment is younger than FRAGMENT_TTL (a quote's lifetime, so
+without the refresher a page never shows older prices than an uncached render would).
+
+The stamp changes with the user's favorites or holdings (toggle_favorite, add_to_portfolio,
+import_portfolio) and whenever a quote of any of their tickers is stored with another price or
+change than before, by a web worker (services._store_quote) or by the refresher
+(services.refresh_quotes).
+"""
+import time
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
+from . import metrics
+from .models import Favorite, PortfolioItem
+from .services import QUOTE_TTL
+
+FRAGMENT_TTL = QUOTE_TTL
+
+
+def _version_key(user_id):
+    return f"frag_version_{user_id}"
+
+
+def _fragment_key(kind, user_id):
+    return f"frag_{kind}_{user_id}"
+
+
+def get(kind, user_id, tag=None):
+    """
+    Returns (html, version): the cached fragment, or None, plus the version to store a freshly
+    rendered one with. tag is anything else the fragment depends on (e.g. the snapshot's age).
+    """
+    key, version_key = _fragment_key(kind, user_id), _version_key(user_id)
+    found = cache.get_many([key, version_key])
+    version = found.get(version_key)
+    if version is None:
+        # First fragment of this user, or the stamp was evicted: start one
+        version = time.time_ns()
+        if not cache.add(version_key, version, timeout=None):
+            version = cache.get(version_key)
+    return _check(key, found.get(key), version, tag), version
+
+
+async def aget(kind, user_id, tag=None):
+    """
+    Async version of get.
+    """
+    key, version_key = _fragment_key(kind, user_id), _version_key(user_id)
+    found = await cache.aget_many([key, version_key])
+    version = found.get(version_key)
+    if version is None:
+        version = time.time_ns()
+        if not await cache.aadd(version_key, version, timeout=None):
+            version = await cache.aget(version_key)
+    return _check(key, found.get(key), version, tag), version
+
+
+def _check(key, entry, version, tag):
+    if entry is not None and entry['version'] == version and entry['tag'] == tag:
+        metrics.cache_lookup(key, 'hit')
+        return mark_safe(entry['html'])
+    metrics.cache_lookup(key, 'miss')
+    return None
+
+
+def store(kind, user_id, version, html, tag=None):
+    cache.set(_fragment_key(kind, user_id), {'version': version, 'tag': tag, 'html': str(html)}, timeout=FRAGMENT_TTL)
+
+
+async def astore(kind, user_id, version, html, tag=None):
+    await cache.aset(_fragment_key(kind, user_id), {'version': version, 'tag': tag, 'html': str(html)}, timeout=FRAGMENT_TTL)
+
+
+def invalidate(user_ids):
+    """
+    Give the users a new version stamp, dropping all their fragments.
+    """
+    version = time.time_ns()
+    cache.set_many({_version_key(user_id): version for user_id in user_ids}, timeout=None)
+
+
+def invalidate_tickers(tickers):
+    """
+    Drop the fragments of every user with any of the tickers in their favorites or holdings.
+    Canonical B3 symbols (PETR4.SA) also match the bare spelling users may have saved (PETR4).
+    """
+    tickers = set(tickers)
+    if not tickers:
+        return
+    tickers.update(ticker[:-3] for ticker in list(tickers) if ticker.endswith('.SA'))
+    tickers = list(tickers)
+    user_ids = set(Favorite.objects.filter(ticker__in=tickers).values_list('user_id', flat=True))
+    user_ids.update(PortfolioItem.objects.filter(ticker__in=tickers).values_list('user_id', flat=True))
+    invalidate(user_ids)
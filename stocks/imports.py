@@ -0,0 +1,156 @@
+"""
+Parsing of portfolio imports. Accepts CSV (ticker,quantity, comma or semicolon separated, header
+optional), NDJSON (one {"ticker", "quantity"} object per line) or JSON (an array of those objects,
+or {"transactions": [...]}). CSV and NDJSON are read line by line from the request or the
+uploaded file, so a large import never sits in memory whole.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from .ledger import MAX_QUANTITY
+
+MAX_IMPORT_ROWS = 1000
+MAX_IMPORT_TICKERS = 100  # Every distinct ticker is validated against a quote
+MAX_JSON_BYTES = 1024 * 1024  # A plain JSON document has to be parsed whole
+MAX_ERRORS = 50
+
+QUANTITY_STEP = Decimal('0.0001')  # PortfolioItem.quantity has 4 decimal places
+TICKER_MAX_LENGTH = 20
+
+CSV_TYPES = ('text/csv', 'application/csv', 'text/plain')
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+def detect_format(content_type, filename=''):
+    filename = (filename or '').lower()
+    if filename.endswith(('.ndjson', '.jsonl')) or content_type in NDJSON_TYPES:
+        return 'ndjson'
+    if filename.endswith('.json') or content_type == 'application/json':
+        return 'json'
+    if filename.endswith('.csv') or content_type in CSV_TYPES:
+        return 'csv'
+    return None
+
+
+def parse(stream, content_type, filename=''):
+    """
+    Read transactions from a binary stream (a request or an uploaded file).
+    Returns (rows, errors): rows are (line, ticker, quantity) in file order, errors are
+    {'line', 'error'} dicts. Any error means the import should be rejected as a whole.
+    """
+    fmt = detect_format(content_type, filename)
+    if fmt is None:
+        return [], [{'line': 0, 'error': 'Formato não suportado, envie CSV, NDJSON ou JSON.'}]
+
+    reader = {'csv': _read_csv, 'ndjson': _read_ndjson, 'json': _read_json}[fmt]
+    rows, errors = [], []
+    for line, ticker, quantity in reader(stream, errors):
+        if len(rows) == MAX_IMPORT_ROWS:
+            errors.append({'line': line, 'error': f'Limite de {MAX_IMPORT_ROWS} transações por importação.'})
+            break
+        row = _clean_row(line, ticker, quantity, errors)
+        if row:
+            rows.append(row)
+        if len(errors) >= MAX_ERRORS:
+            break
+
+    if not errors:
+        if not rows:
+            errors.append({'line': 0, 'error': 'Nenhuma transação encontrada.'})
+        elif len({ticker for _, ticker, _ in rows}) > MAX_IMPORT_TICKERS:
+            errors.append({'line': 0, 'error': f'Limite de {MAX_IMPORT_TICKERS} ativos por importação.'})
+    return rows, errors
+
+
+def _clean_row(line, ticker, quantity, errors):
+    ticker = str(ticker or '').upper().strip()
+    if not ticker or len(ticker) > TICKER_MAX_LENGTH:
+        errors.append({'line': line, 'error': 'Ticker inválido.'})
+        return None
+    try:
+        # Floats go through str so 0.1 stays 0.1
+        quantity = Decimal(str(quantity).strip())
+        if not quantity.is_finite():
+            raise InvalidOperation
+        quantity = quantity.quantize(QUANTITY_STEP)
+    except (InvalidOperation, ValueError, TypeError):
+        errors.append({'line': line, 'error': f'Quantidade inválida para {ticker}.'})
+        return None
+    if quantity == 0:
+        errors.append({'line': line, 'error': f'A quantidade de {ticker} deve ser diferente de zero.'})
+        return None
+    if abs(quantity) > MAX_QUANTITY:
+        errors.append({'line': line, 'error': f'Quantidade de {ticker} acima do limite.'})
+        return None
+    return line, ticker, quantity
+
+
+def _lines(stream):
+    # Requests and uploaded files both iterate over their lines as bytes
+    for number, line in enumerate(stream, start=1):
+        yield number, line.decode('utf-8-sig' if number == 1 else 'utf-8', errors='replace')
+
+
+def _read_csv(stream, errors):
+    delimiter = None
+    columns = (0, 1)
+    for number, text in _lines(stream):
+        if not text.strip():
+            continue
+        if delimiter is None:
+            # Spreadsheets in pt-BR export with ; and decimal commas
+            delimiter = ';' if text.count(';') > text.count(',') else ','
+            cells = next(csv.reader([text], delimiter=delimiter))
+            header = [cell.strip().lower() for cell in cells]
+            if 'ticker' in header:
+                if 'quantity' not in header:
+                    errors.append({'line': number, 'error': 'Colunas esperadas: ticker, quantity.'})
+                    return
+                columns = (header.index('ticker'), header.index('quantity'))
+                continue
+        cells = next(csv.reader([text], delimiter=delimiter))
+        if len(cells) <= max(columns):
+            errors.append({'line': number, 'error': 'Linha incompleta.'})
+            continue
+        quantity = cells[columns[1]].strip()
+        if delimiter == ';' and ',' in quantity:
+            quantity = quantity.replace('.', '').replace(',', '.')
+        yield number, cells[columns[0]], quantity
+
+
+def _read_ndjson(stream, errors):
+    for number, text in _lines(stream):
+        if not text.strip():
+            continue
+        try:
+            item = json.loads(text)
+        except ValueError:
+            errors.append({'line': number, 'error': 'JSON inválido.'})
+            continue
+        if not isinstance(item, dict):
+            errors.append({'line': number, 'error': 'Cada linha deve ser um objeto com ticker e quantity.'})
+            continue
+        yield number, item.get('ticker'), item.get('quantity')
+
+
+def _read_json(stream, errors):
+    body = stream.read(MAX_JSON_BYTES + 1)
+    if len(body) > MAX_JSON_BYTES:
+        errors.append({'line': 0, 'error': 'Arquivo JSON muito grande, use NDJSON ou CSV.'})
+        return
+    try:
+        data = json.loads(body)
+    except ValueError:
+        errors.append({'line': 0, 'error': 'JSON inválido.'})
+        return
+    if isinstance(data, dict):
+        data = data.get('transactions')
+    if not isinstance(data, list):
+        errors.append({'line': 0, 'error': 'Esperada uma lista de transações.'})
+        return
+    # "line" is the position in the list here
+    for number, item in enumerate(data, start=1):
+        if not isinstance(item, dict):
+            errors.append({'line': number, 'error': 'Cada transação deve ser um objeto com ticker e quantity.'})
+            continue
+        yield number, item.get('ticker'), item.get('quantity')
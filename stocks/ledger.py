@@ -0,0 +1,75 @@
+"""
+Portfolio transaction ledger. Every quantity change is appended to PortfolioTransaction and
+PortfolioItem.quantity is kept equal to the running sum of its ticker's transactions:
+apply_transactions() writes both in one database transaction, with F() updates so concurrent
+changes (two tabs, a double click) add up instead of overwriting each other.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+from .models import PortfolioItem, PortfolioTransaction
+
+# Largest quantity PortfolioItem.quantity (10 digits, 4 decimal places) can hold
+MAX_QUANTITY = Decimal('999999.9999')
+
+
+def apply_transactions(user, rows, names=None, source='manual'):
+    """
+    Apply rows of (ticker, signed quantity) in order. A holding never goes below zero: a sale of
+    more than is held sells what is held, and holdings that reach zero are removed (as
+    add_to_portfolio always did). Returns {ticker: resulting quantity}, 0 for removed holdings.
+    Raises ValueError, with nothing written, if a holding would exceed MAX_QUANTITY.
+    """
+    names = names or {}
+    net = defaultdict(Decimal)
+    for ticker, quantity in rows:
+        net[ticker] += quantity
+    if not net:
+        return {}
+
+    with transaction.atomic():
+        # Make sure every row exists, then move all of them with a single relative update
+        PortfolioItem.objects.bulk_create(
+            [PortfolioItem(user=user, ticker=ticker, name=names.get(ticker, ''), quantity=0) for ticker in net],
+            ignore_conflicts=True,
+        )
+        items = PortfolioItem.objects.filter(user=user, ticker__in=list(net))
+        items.update(
+            quantity=F('quantity') + Case(
+                *[When(ticker=ticker, then=Value(delta)) for ticker, delta in net.items()],
+                output_field=DecimalField(max_digits=10, decimal_places=4),
+            ),
+            updated_at=timezone.now(),
+        )
+        # Compared in SQL, an overflowing value can't be read back as a Decimal
+        if items.filter(quantity__gt=MAX_QUANTITY).exists():
+            raise ValueError('Holding above MAX_QUANTITY')
+        # The updated rows stay locked until commit, so these are the quantities we produced
+        updated = dict(items.values_list('ticker', 'quantity'))
+
+        # Replay the rows from the quantities held before them, clamping at zero, and record what
+        # actually changed
+        held = {ticker: updated[ticker] - delta for ticker, delta in net.items()}
+        entries = []
+        for ticker, quantity in rows:
+            quantity = max(quantity, -held[ticker])
+            held[ticker] += quantity
+            if quantity:
+                entries.append(PortfolioTransaction(user=user, ticker=ticker, quantity=quantity, source=source))
+        PortfolioTransaction.objects.bulk_create(entries)
+
+        for ticker, quantity in held.items():
+            if quantity != updated[ticker]:
+                items.filter(ticker=ticker).update(quantity=quantity)
+        items.filter(quantity__lte=0).delete()
+
+        if names:
+            # Fill in the names of holdings created by a concurrent request without one
+            items.filter(name='', ticker__in=list(names)).update(
+                name=Case(*[When(ticker=ticker, then=Value(name)) for ticker, name in names.items()])
+            )
+
+    return {ticker: max(quantity, Decimal('0')) for ticker, quantity in held.items()}
+
@@ -0,0 +1,106 @@
+import io
+import json
+import os
+import tempfile
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from stocks import benchmark
+from stocks.models import TickerSymbol
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the dashboard, portfolio and history views against a fake Yahoo backend, "
+        "on a throwaway test database and a private cache namespace, and prints the results "
+        "as JSON (latency p50/p99, upstream calls, cache hit ratio and queries per request "
+        "for the cold, warm, herd_expired and herd_stale scenarios)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help='Users to seed.')
+        parser.add_argument('--holdings', type=int, default=10, help='Favorites and holdings per user.')
+        parser.add_argument('--tickers', type=int, default=40, help='Size of the ticker universe users draw from.')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per view and scenario.')
+        parser.add_argument('--concurrency', type=int, default=10, help='Simultaneous requests in the herd scenarios.')
+        parser.add_argument('--latency', type=float, default=50, help='Fake upstream latency, in milliseconds.')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of fake upstream calls answering 503.')
+        parser.add_argument(
+            '--upstream-rate', type=int, default=1000,
+            help='Upstream requests per second allowed by the rate limiter (high by default, so the '
+                 'views are measured rather than the limiter).'
+        )
+        parser.add_argument('--views', nargs='+', choices=benchmark.VIEWS, default=benchmark.VIEWS)
+        parser.add_argument('--scenarios', nargs='+', choices=benchmark.SCENARIOS, default=benchmark.SCENARIOS)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the seeded data and failures.')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name, test_file = self.create_test_db()
+        # Pages are rendered without a collectstatic run, so no manifest to hash static URLs with
+        storages = {
+            **settings.STORAGES,
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }
+        try:
+            with override_settings(STORAGES=storages):
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if test_file and os.path.exists(test_file):
+                os.remove(test_file)
+            teardown_test_environment()
+
+        report = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+            self.stderr.write(f"Results written to {options['output']}")
+        else:
+            self.stdout.write(report)
+
+    def create_test_db(self):
+        # SQLite test databases live in memory by default, which threads can't write concurrently.
+        # A file, with writers waiting for the lock (see settings.DATABASES), holds up under the herds.
+        test_file = None
+        if connection.vendor == 'sqlite':
+            test_file = os.path.join(tempfile.gettempdir(), f"stocks_benchmark_{os.getpid()}.sqlite3")
+            connection.settings_dict['TEST']['NAME'] = test_file
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        return old_name, test_file
+
+    def run(self, options):
+        rng = np.random.default_rng(options['seed'])
+        call_command('load_tickers', stdout=io.StringIO())
+        users, symbols = benchmark.seed(options['users'], options['holdings'], options['tickers'], rng)
+        yahoo_symbols = TickerSymbol.objects.filter(symbol__in=symbols).values_list('yahoo_symbol', flat=True)
+
+        fake = benchmark.FakeYahoo(
+            yahoo_symbols, latency=options['latency'] / 1000, failure_rate=options['failure_rate'], seed=options['seed']
+        )
+        cache_config = settings.CACHES['default']
+        probe = benchmark.Probe(
+            cache_table=cache_config.get('LOCATION') if cache_config['BACKEND'].endswith('DatabaseCache') else None
+        )
+        with benchmark.fake_upstream(fake, options['upstream_rate']), probe.installed():
+            results = benchmark.run_benchmark(
+                fake, probe, users, symbols,
+                views=options['views'], scenarios=options['scenarios'],
+                requests=options['requests'], concurrency=max(1, options['concurrency']),
+            )
+
+        return {
+            'config': {
+                key: options[key] for key in (
+                    'users', 'holdings', 'tickers', 'requests', 'concurrency', 'latency',
+                    'failure_rate', 'upstream_rate', 'seed',
+                )
+            },
+            'cache_backend': cache_config['BACKEND'],
+            'database': connection.vendor,
+            'results': results,
+        }
@@ -0,0 +1,68 @@
+import csv
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from stocks.models import TickerSymbol
+from stocks.tickers import invalidate_index, normalize
+
+DEFAULT_CSV = Path(__file__).resolve().parents[2] / 'data' / 'tickers.csv'
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Loads the local ticker index used by search and autocomplete from a CSV file with the "
+        "columns symbol, yahoo_symbol, name and exchange. Defaults to the bundled seed list."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=str(DEFAULT_CSV), help='CSV file to load.')
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='Delete the indexed symbols that are not in the file (e.g. delisted tickers).'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], newline='', encoding='utf-8') as csv_file:
+                with transaction.atomic():
+                    symbols = self.load(csv.DictReader(csv_file))
+                    pruned = self.prune(symbols) if options['prune'] else 0
+        except (OSError, KeyError) as e:
+            raise CommandError(f"Could not load {options['path']}: {e}")
+
+        invalidate_index()
+        self.stdout.write(f"Loaded {len(symbols)} tickers, pruned {pruned}.")
+
+    def load(self, rows):
+        symbols, batch = set(), []
+        for row in rows:
+            symbol = normalize(row['symbol'])
+            if not symbol or symbol in symbols:
+                continue
+            symbols.add(symbol)
+            batch.append(TickerSymbol(
+                symbol=symbol,
+                yahoo_symbol=normalize(row.get('yahoo_symbol')) or symbol,
+                name=(row.get('name') or symbol).strip(),
+                exchange=(row.get('exchange') or '').strip(),
+            ))
+            if len(batch) >= BATCH_SIZE:
+                self.save(batch)
+                batch = []
+        self.save(batch)
+        return symbols
+
+    def prune(self, symbols):
+        stale = list(set(TickerSymbol.objects.values_list('symbol', flat=True)) - symbols)
+        for start in range(0, len(stale), BATCH_SIZE):
+            TickerSymbol.objects.filter(symbol__in=stale[start:start + BATCH_SIZE]).delete()
+        return len(stale)
+
+    def save(self, batch):
+        TickerSymbol.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=['symbol'],
+            update_fields=['yahoo_symbol', 'name', 'exchange'],
+        )
@@ -0,0 +1,67 @@
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from stocks import metrics
+from stocks.models import Favorite, PortfolioItem
+from stocks.services import refresh_quotes, QUOTE_TTL
+from stocks.valuation import apply_quotes
+
+
+class Command(BaseCommand):
+    help = (
+        "Keeps the quotes of every ticker held in favorites or portfolios warm in the cache, "
+        "refreshing them before they expire, and reprices the portfolio snapshots holding them. "
+        "Needs a cache backend shared with the web process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=int, default=QUOTE_TTL - 15,
+            help='Seconds between refresh cycles (should be shorter than the quote TTL).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=20,
+            help='How many tickers are fetched in parallel per batch.'
+        )
+        parser.add_argument('--once', action='store_true', help='Run a single cycle and exit.')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        batch_size = max(1, options['batch_size'])
+
+        while True:
+            started = time.monotonic()
+            close_old_connections()
+            try:
+                self.refresh_cycle(batch_size)
+            except Exception as e:
+                # Keep the worker alive, the next cycle will try again
+                self.stderr.write(f"Refresh cycle failed: {e}")
+            # Upstream calls of the refresher show up in /metrics next to the web workers'
+            metrics.publish(force=options['once'])
+
+            if options['once']:
+                break
+            time.sleep(max(0, interval - (time.monotonic() - started)))
+
+    def refresh_cycle(self, batch_size):
+        tickers = get_hot_tickers()
+        refreshed = repriced = 0
+        # Most held tickers go first so they are the last ones to ever go cold
+        for start in range(0, len(tickers), batch_size):
+            infos = refresh_quotes(tickers[start:start + batch_size])
+            refreshed += len(infos)
+            # refresh_quotes also drops the rendered cards of the tickers whose price moved
+            repriced += apply_quotes(infos)
+        self.stdout.write(f"Refreshed {refreshed}/{len(tickers)} tickers, repriced {repriced} portfolios.")
+
+
+def get_hot_tickers():
+    """
+    Returns every ticker held in Favorite or PortfolioItem, ordered by how many users hold it.
+    """
+    holders = set(Favorite.objects.values_list('user_id', 'ticker'))
+    holders.update(PortfolioItem.objects.values_list('user_id', 'ticker'))
+    counts = Counter(ticker.upper().strip() for _, ticker in holders)
+    return [ticker for ticker, _ in counts.most_common()]
@@ -0,0 +1,326 @@
+"""
+Performance instrumentation.
+
+- Per request: stocks.middleware.TimingMiddleware puts a RequestStats in a context variable for
+  the duration of the request. The hooks below (upstream calls, cache lookups and every database
+  query) add to it, and it ends up in the response's Server-Timing header.
+- Per process: the same hooks feed a Registry of counters and latency histograms, published to
+  the cache at most every PUBLISH_INTERVAL seconds. /metrics sums the totals of every process
+  (gunicorn workers, the refresher) and renders them in the Prometheus text format.
+
+Work submitted to a thread pool doesn't inherit the context variable, wrap it with bind() to
+count it towards the request.
+"""
+import contextvars
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from django.core.cache import cache
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PUBLISH_INTERVAL = 10
+# A process that stopped publishing (a recycled worker) drops out of the totals after this long,
+# which Prometheus sees as a counter reset
+PROCESS_TTL = 60 * 60
+PROCESSES_KEY = 'metrics_processes'
+
+# Upstream calls per request listed one by one in Server-Timing, the slowest first. Symbols only
+# appear there, per request: as Prometheus labels any typed ticker would be a new series forever
+SERVER_TIMING_MAX_SYMBOLS = 5
+SERVER_TIMING_MAX_DESC = 40
+
+METRICS = {
+    'stocks_request_duration_seconds': ('histogram', 'Time spent in each view, streaming responses excluded.'),
+    'stocks_requests_total': ('counter', 'Requests per view and status code.'),
+    'stocks_db_queries_total': ('counter', 'Database queries run by requests, per view.'),
+    'stocks_db_query_seconds_total': ('counter', 'Time spent in database queries by requests, per view.'),
+    'stocks_upstream_duration_seconds': ('histogram', 'Latency of Yahoo calls per operation, retries included.'),
+    'stocks_upstream_calls_total': ('counter', 'Yahoo calls per operation and outcome.'),
+    'stocks_cache_lookups_total': ('counter', 'Cache reads per key kind and result (hit, stale, failed, miss).'),
+}
+
+
+class Registry:
+    """
+    Counters and histograms of this process, keyed by (metric name, sorted label pairs).
+    Histograms are lists of per-bucket counts (the last bucket is +Inf) followed by the sum.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, tuple(sorted(labels.items())))
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            histogram[bucket] += 1
+            histogram[-1] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {key: list(histogram) for key, histogram in self.histograms.items()},
+            }
+
+
+class RequestStats:
+    """
+    What one request spent, collected by the hooks while it runs.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()  # Hooks may run in several threads of the same request
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.upstream_calls = 0
+        self.upstream_time = 0.0
+        self.upstream_symbols = {}  # symbol -> seconds
+        self.cache = {}  # result -> count
+
+    def server_timing(self):
+        """
+        Server-Timing header value, durations in milliseconds.
+        """
+        with self.lock:
+            metrics = [
+                f'db;dur={self.db_time * 1000:.1f};desc="{self.db_queries} queries"',
+                f'upstream;dur={self.upstream_time * 1000:.1f};desc="{self.upstream_calls} calls"',
+            ]
+            slowest = sorted(self.upstream_symbols.items(), key=lambda item: -item[1])
+            # Symbols come from the URL: only in the quoted description, never in the metric name
+            metrics += [
+                f'upstream-{number};dur={seconds * 1000:.1f};desc="{_header_text(symbol)}"'
+                for number, (symbol, seconds) in enumerate(slowest[:SERVER_TIMING_MAX_SYMBOLS], 1)
+            ]
+            if self.cache:
+                counts = ', '.join(f'{count} {result}' for result, count in sorted(self.cache.items()))
+                metrics.append(f'cache;desc="{counts}"')
+        metrics.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+registry = Registry()
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def begin_request():
+    """
+    Start collecting for the current request. Returns the stats and the token for end_request().
+    """
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def bind(fn):
+    """
+    Wrap fn so that, run from a pool thread, it counts towards the current request.
+    """
+    stats = _current.get()
+    if stats is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _current.set(stats)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+# Hooks
+
+@contextmanager
+def upstream_call(operation, symbol):
+    """
+    Time one Yahoo call (operation is quote, history, dividends or fundamentals). An exception
+    escaping the block counts it as an error.
+    """
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe('stocks_upstream_duration_seconds', {'operation': operation}, elapsed)
+        registry.inc('stocks_upstream_calls_total', {'operation': operation, 'outcome': outcome})
+        stats = _current.get()
+        if stats is not None:
+            with stats.lock:
+                stats.upstream_calls += 1
+                stats.upstream_time += elapsed
+                stats.upstream_symbols[symbol] = stats.upstream_symbols.get(symbol, 0.0) + elapsed
+
+
+def cache_lookup(cache_key, result):
+    """
+    Count one cache read: hit, stale (served while revalidated), failed (cached failure) or miss.
+    """
+    registry.inc('stocks_cache_lookups_total', {'kind': cache_key.split('_', 1)[0], 'result': result})
+    stats = _current.get()
+    if stats is not None:
+        with stats.lock:
+            stats.cache[result] = stats.cache.get(result, 0) + 1
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper (installed on every connection by StocksConfig.ready).
+    """
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        with stats.lock:
+            stats.db_queries += 1
+            stats.db_time += elapsed
+
+
+def install_query_hook(sender, connection, **kwargs):
+    # connection_created fires again on every reconnect of the same wrapper
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_request(view, method, status, stats, streaming=False):
+    registry.inc('stocks_requests_total', {'view': view, 'status': str(status)})
+    registry.inc('stocks_db_queries_total', {'view': view}, stats.db_queries)
+    registry.inc('stocks_db_query_seconds_total', {'view': view}, stats.db_time)
+    if not streaming:
+        elapsed = time.perf_counter() - stats.started
+        registry.observe('stocks_request_duration_seconds', {'view': view, 'method': method}, elapsed)
+
+
+# Publishing and rendering
+
+_process_id = f"{socket.gethostname()}:{os.getpid()}"
+_next_publish = 0.0
+
+
+def publish(force=False):
+    """
+    Store this process's totals in the cache, at most every PUBLISH_INTERVAL seconds unless forced.
+    """
+    if not _publish_due(force):
+        return
+    try:
+        cache.set(f"metrics_{_process_id}", registry.snapshot(), timeout=PROCESS_TTL)
+        processes = cache.get(PROCESSES_KEY) or []
+        if _process_id not in processes:
+            cache.set(PROCESSES_KEY, processes + [_process_id], timeout=None)
+    except Exception as e:
+        print(f"Error publishing metrics: {e}")
+
+
+async def apublish(force=False):
+    # Cache backends that use the database can't be called synchronously from the event loop
+    if not _publish_due(force):
+        return
+    try:
+        await cache.aset(f"metrics_{_process_id}", registry.snapshot(), timeout=PROCESS_TTL)
+        processes = await cache.aget(PROCESSES_KEY) or []
+        if _process_id not in processes:
+            await cache.aset(PROCESSES_KEY, processes + [_process_id], timeout=None)
+    except Exception as e:
+        print(f"Error publishing metrics: {e}")
+
+
+def _publish_due(force):
+    global _next_publish
+    now = time.monotonic()
+    if not force and now < _next_publish:
+        return False
+    _next_publish = now + PUBLISH_INTERVAL
+    return True
+
+
+def collect():
+    """
+    Totals of every process that published recently, as one snapshot.
+    """
+    publish(force=True)
+    processes = cache.get(PROCESSES_KEY) or []
+    found = cache.get_many([f"metrics_{process}" for process in processes])
+    alive = [process for process in processes if f"metrics_{process}" in found]
+    if len(alive) != len(processes):
+        cache.set(PROCESSES_KEY, alive, timeout=None)
+
+    merged = {'counters': {}, 'histograms': {}}
+    for snapshot in found.values():
+        for key, value in snapshot['counters'].items():
+            merged['counters'][key] = merged['counters'].get(key, 0) + value
+        for key, histogram in snapshot['histograms'].items():
+            total = merged['histograms'].get(key)
+            merged['histograms'][key] = histogram if total is None else [a + b for a, b in zip(total, histogram)]
+    return merged
+
+
+def render(snapshot):
+    """
+    Prometheus text exposition format (version 0.0.4).
+    """
+    by_name = {}
+    for (name, labels), value in snapshot['counters'].items():
+        by_name.setdefault(name, []).append((labels, value))
+    for (name, labels), histogram in snapshot['histograms'].items():
+        by_name.setdefault(name, []).append((labels, histogram))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(by_name[name]):
+            if kind != 'histogram':
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), value[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _header_text(value):
+    # Printable ASCII only (no CR/LF, which Django rejects in headers), as a quoted-string
+    text = ''.join(char for char in str(value) if ' ' <= char <= '~')[:SERVER_TIMING_MAX_DESC]
+    return text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
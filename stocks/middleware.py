@@ -0,0 +1,76 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.cache import patch_cache_control
+from . import metrics
+
+
+class TimingMiddleware:
+    """
+    Collects what each request spends in the database, upstream and the cache (see stocks.metrics),
+    reports it in a Server-Timing header and records it in the per-view metrics.
+    Runs natively in both modes, so the async views don't pay for a sync middleware in between.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token = metrics.begin_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        self.finish(request, response, stats)
+        metrics.publish()
+        return response
+
+    async def __acall__(self, request):
+        stats, token = metrics.begin_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        self.finish(request, response, stats)
+        await metrics.apublish()
+        return response
+
+    def finish(self, request, response, stats):
+        match = request.resolver_match
+        # Unresolved paths are lumped together, the path itself would be an unbounded label
+        view = match.view_name if match is not None else 'unresolved'
+        metrics.record_request(view, request.method, response.status_code, stats, response.streaming)
+        response['Server-Timing'] = stats.server_timing()
+
+
+class PrivateCacheMiddleware:
+    """
+    Marks responses that depend on the session (anything that read it, e.g. to get the user) as
+    private, so a reverse proxy or CDN never serves one user's page to another. Responses that set
+    their own Cache-Control, like the public market data APIs, are left alone.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        if session is not None and session.accessed and not response.has_header('Cache-Control'):
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,47 @@
+# Generated by Django 6.0.2 on 2026-10-17 15:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0002_portfolioitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=20)),
+                ('interval', models.CharField(max_length=5)),
+                ('symbol', models.CharField(max_length=20)),
+                ('timezone', models.CharField(blank=True, max_length=50)),
+                ('covered_from', models.DateTimeField(blank=True, null=True)),
+                ('full_history', models.BooleanField(default=False)),
+                ('synced_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('ticker', 'interval')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceBar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('open', models.FloatField(null=True)),
+                ('high', models.FloatField(null=True)),
+                ('low', models.FloatField(null=True)),
+                ('close', models.FloatField()),
+                ('volume', models.BigIntegerField(null=True)),
+                ('series', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bars', to='stocks.priceseries')),
+            ],
+            options={
+                'ordering': ['timestamp'],
+                'unique_together': {('series', 'timestamp')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.2 on 2026-10-17 15:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0004_portfoliosnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DividendSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=20, unique=True)),
+                ('ttm_total', models.FloatField(default=0.0)),
+                ('synced_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DividendEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField()),
+                ('amount', models.FloatField()),
+                ('series', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='stocks.dividendseries')),
+            ],
+            options={
+                'ordering': ['date'],
+                'unique_together': {('series', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.2 on 2026-10-17 15:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0005_dividendevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=20, unique=True)),
+                ('name', models.CharField(blank=True, max_length=200)),
+                ('description', models.TextField(blank=True)),
+                ('sector', models.CharField(blank=True, max_length=100)),
+                ('industry', models.CharField(blank=True, max_length=100)),
+                ('pe_ratio', models.FloatField(null=True)),
+                ('price_to_book', models.FloatField(null=True)),
+                ('eps', models.FloatField(null=True)),
+                ('book_value', models.FloatField(null=True)),
+                ('market_cap', models.FloatField(null=True)),
+                ('fifty_two_week_high', models.FloatField(null=True)),
+                ('fifty_two_week_low', models.FloatField(null=True)),
+                ('average_volume', models.FloatField(null=True)),
+                ('dividend_yield', models.FloatField(null=True)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0.2 on 2026-10-17 15:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0006_stockprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TickerSymbol',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=20, unique=True)),
+                ('yahoo_symbol', models.CharField(db_index=True, max_length=20)),
+                ('name', models.CharField(max_length=200)),
+                ('exchange', models.CharField(blank=True, max_length=20)),
+            ],
+            options={
+                'ordering': ['symbol'],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+from django.db.models import F
+
+
+def canonicalize_series(apps, schema_editor):
+    # Series used to be stored under the ticker as typed (PETR4), they are now keyed by the
+    # Yahoo symbol they are fetched with (PETR4.SA)
+    PriceSeries = apps.get_model('stocks', 'PriceSeries')
+    for series in PriceSeries.objects.exclude(ticker=F('symbol')):
+        if PriceSeries.objects.filter(ticker=series.symbol, interval=series.interval).exists():
+            series.delete()
+        else:
+            series.ticker = series.symbol
+            series.save(update_fields=['ticker'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0007_tickersymbol'),
+    ]
+
+    operations = [
+        migrations.RunPython(canonicalize_series, migrations.RunPython.noop),
+    ]
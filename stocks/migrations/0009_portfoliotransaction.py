@@ -0,0 +1,45 @@
+# Generated by Django 6.0.2 on 2026-10-17 15:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def open_ledger(apps, schema_editor):
+    # Current holdings become opening entries, so every quantity is the sum of its ledger
+    PortfolioItem = apps.get_model('stocks', 'PortfolioItem')
+    PortfolioTransaction = apps.get_model('stocks', 'PortfolioTransaction')
+    PortfolioTransaction.objects.bulk_create(
+        [
+            PortfolioTransaction(user_id=item.user_id, ticker=item.ticker, quantity=item.quantity, source='opening')
+            for item in PortfolioItem.objects.filter(quantity__gt=0).iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0008_canonical_price_series'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=20)),
+                ('quantity', models.DecimalField(decimal_places=4, max_digits=10)),
+                ('source', models.CharField(choices=[('manual', 'Manual'), ('import', 'Importação'), ('opening', 'Saldo inicial')], default='manual', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='portfolio_transactions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['user', 'ticker'], name='stocks_port_user_id_8869f5_idx')],
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
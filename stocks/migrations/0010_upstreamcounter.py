@@ -0,0 +1,22 @@
+# Generated by Django 6.0.2 on 2026-10-17 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0009_portfoliotransaction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpstreamCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=200, unique=True)),
+                ('window', models.BigIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-17 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0010_upstreamcounter'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='favorite',
+            name='ticker',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='portfolioitem',
+            name='ticker',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+    ]
@@ -3,7 +3,7 @@ from django.contrib.auth.models import User
 
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorites')
-    ticker = models.CharField(max_length=20)
+    ticker = models.CharField(max_length=20, db_index=True)  # Looked up by ticker when quotes change
     name = models.CharField(max_length=100, blank=True)
     added_at = models.DateTimeField(auto_now_add=True)
 
@@ -15,7 +15,7 @@ class Favorite(models.Model):
 
 class PortfolioItem(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='portfolio')
-    ticker = models.CharField(max_length=20)
+    ticker = models.CharField(max_length=20, db_index=True)
     name = models.CharField(max_length=100, blank=True)
     quantity = models.DecimalField(max_digits=10, decimal_places=4, default=0.0)
     added_at = models.DateTimeField(auto_now_add=True)
@@ -27,3 +27,166 @@ class PortfolioItem(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.ticker} ({self.quantity} shares)"
+
+class PortfolioTransaction(models.Model):
+    """
+    Append-only ledger of quantity changes. PortfolioItem.quantity is the running sum of a user's
+    transactions of that ticker (see stocks/ledger.py).
+    """
+    SOURCES = [
+        ('manual', 'Manual'),
+        ('import', 'Importação'),
+        ('opening', 'Saldo inicial'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='portfolio_transactions')
+    ticker = models.CharField(max_length=20)
+    quantity = models.DecimalField(max_digits=10, decimal_places=4)  # Signed, negative for sales
+    source = models.CharField(max_length=10, choices=SOURCES, default='manual')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [models.Index(fields=['user', 'ticker'])]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.ticker} {self.quantity:+}"
+
+class PriceSeries(models.Model):
+    """
+    Sync state of the stored bars of one ticker at one interval.
+    """
+    ticker = models.CharField(max_length=20)
+    interval = models.CharField(max_length=5)
+    symbol = models.CharField(max_length=20)  # Yahoo symbol the bars are fetched with (e.g. PETR4.SA)
+    timezone = models.CharField(max_length=50, blank=True)
+    covered_from = models.DateTimeField(null=True, blank=True)  # Bars are complete from here on
+    full_history = models.BooleanField(default=False)
+    synced_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('ticker', 'interval')
+
+    def __str__(self):
+        return f"{self.ticker} ({self.interval})"
+
+class PriceBar(models.Model):
+    series = models.ForeignKey(PriceSeries, on_delete=models.CASCADE, related_name='bars')
+    timestamp = models.DateTimeField()
+    open = models.FloatField(null=True)
+    high = models.FloatField(null=True)
+    low = models.FloatField(null=True)
+    close = models.FloatField()
+    volume = models.BigIntegerField(null=True)
+
+    class Meta:
+        unique_together = ('series', 'timestamp')
+        ordering = ['timestamp']
+
+    def __str__(self):
+        return f"{self.series} {self.timestamp:%Y-%m-%d %H:%M} {self.close}"
+
+class PortfolioSnapshot(models.Model):
+    """
+    Materialized valuation of a user's portfolio, kept up to date by stocks/valuation.py.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='portfolio_snapshot')
+    total_value = models.FloatField(default=0.0)
+    annual_income = models.FloatField(default=0.0)
+    items = models.JSONField(default=list)  # Per-item breakdown, see valuation.value_item
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user.username} - {self.total_value:.2f}"
+
+class PortfolioDailyValue(models.Model):
+    """
+    Last known portfolio value of each day, a by-product of the snapshots.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='portfolio_values')
+    date = models.DateField()
+    total_value = models.FloatField()
+    annual_income = models.FloatField()
+
+    class Meta:
+        unique_together = ('user', 'date')
+        ordering = ['date']
+
+    def __str__(self):
+        return f"{self.user.username} {self.date} {self.total_value:.2f}"
+
+class DividendSeries(models.Model):
+    """
+    Sync state of the stored dividends of one Yahoo symbol, with their precomputed
+    trailing-12-month sum.
+    """
+    symbol = models.CharField(max_length=20, unique=True)
+    ttm_total = models.FloatField(default=0.0)  # Dividends per share paid in the 12 months before synced_at
+    synced_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.symbol} (TTM {self.ttm_total})"
+
+class DividendEvent(models.Model):
+    series = models.ForeignKey(DividendSeries, on_delete=models.CASCADE, related_name='events')
+    date = models.DateTimeField()  # Ex-dividend date
+    amount = models.FloatField()
+
+    class Meta:
+        unique_together = ('series', 'date')
+        ordering = ['date']
+
+    def __str__(self):
+        return f"{self.series.symbol} {self.date:%Y-%m-%d} {self.amount}"
+
+class StockProfile(models.Model):
+    """
+    Company profile and fundamental indicators of a Yahoo symbol, refreshed at most daily
+    (see services.get_fundamentals).
+    """
+    symbol = models.CharField(max_length=20, unique=True)
+    name = models.CharField(max_length=200, blank=True)
+    description = models.TextField(blank=True)
+    sector = models.CharField(max_length=100, blank=True)
+    industry = models.CharField(max_length=100, blank=True)
+    pe_ratio = models.FloatField(null=True)
+    price_to_book = models.FloatField(null=True)
+    eps = models.FloatField(null=True)
+    book_value = models.FloatField(null=True)
+    market_cap = models.FloatField(null=True)
+    fifty_two_week_high = models.FloatField(null=True)
+    fifty_two_week_low = models.FloatField(null=True)
+    average_volume = models.FloatField(null=True)
+    dividend_yield = models.FloatField(null=True)  # As reported by the provider, only a fallback
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.symbol} - {self.name}"
+
+class TickerSymbol(models.Model):
+    """
+    Entry of the local ticker index (see stocks/tickers.py), loaded with `manage.py load_tickers`.
+    """
+    symbol = models.CharField(max_length=20, unique=True)  # As users type it (e.g. PETR4)
+    yahoo_symbol = models.CharField(max_length=20, db_index=True)  # As Yahoo serves it (e.g. PETR4.SA)
+    name = models.CharField(max_length=200)
+    exchange = models.CharField(max_length=20, blank=True)
+
+    class Meta:
+        ordering = ['symbol']
+
+    def __str__(self):
+        return f"{self.symbol} - {self.name}"
+
+class UpstreamCounter(models.Model):
+    """
+    Counter of the upstream rate limiter and circuit breaker (see stocks/upstream.py) for cache
+    backends without an atomic incr(). One row per counter (per slice of the rate limiter's window),
+    reset when a new window starts.
+    """
+    key = models.CharField(max_length=200, unique=True)
+    window = models.BigIntegerField()
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key} {self.window}: {self.count}"
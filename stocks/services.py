@@ -1,32 +1,463 @@
 import os
-import random
-import certifi
+import json
+import asyncio
+import copy
+import hashlib
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 import yfinance as yf
 import pandas as pd
-from curl_cffi.requests import Session as CurlSession
+import numpy as np
 from django.core.cache import cache
-
-USER_AGENTS = [
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.1 Safari/605.1.15',
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/110.0',
-    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36',
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36 Edg/122.0.0.0'
-]
-
-def get_session():
-    # Use impersonate="chrome110" to handle TLS fingerprinting and Cloudflare blocks natively
-    return CurlSession(
-        impersonate="chrome110",
-        verify=False,
-        headers={
-            'User-Agent': random.choice(USER_AGENTS)
-        }
-    )
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .models import PriceSeries, PriceBar, DividendSeries, DividendEvent, StockProfile
+from . import metrics, upstream
+from .db import db_sync_to_async
+from .tickers import ayahoo_symbols, yahoo_symbols
+from .upstream import get_session
 
 # Mantém uma sessão global que pode ser reutilizada
+# yfinance keeps a single session with its cookie/crumb for all threads, so quote calls share this one
 session = get_session()
 
+# Direct history downloads (see _fetch_bars)
+YAHOO_CHART_URL = f'https://{upstream.YAHOO_HOST}/v8/finance/chart/{{}}'
+
+# Upper bound on concurrent upstream calls when fetching several tickers at once
+MAX_FETCH_WORKERS = 8
+
+# Tickers whose history get_close_matrix loads per pass, so a long list of favorites is read and
+# fetched in bounded slices instead of all at once
+HISTORY_BATCH_SIZE = 30
+
+# Cache lifetimes (seconds). Entries older than the soft TTL are still served while a background
+# refresh runs, and are only dropped after the stale TTL, which covers upstream outages.
+# Failures are cached under a separate key so they never replace a good stale value.
+QUOTE_TTL = 60
+HIST_TTL = 600
+STALE_TTL = 60 * 60 * 24
+FAILURE_TTL = 60
+
+# zlib level for the cached history JSON, which is mostly repetitive digits
+HIST_COMPRESS_LEVEL = 6
+
+# Historical bar store
+INTRADAY_INTERVALS = ['15m']
+INTRADAY_PERIOD_DAYS = {'1d': 1, '5d': 5}
+INTRADAY_RETENTION = timedelta(days=59)  # Yahoo only serves 60 days of intraday bars
+PERIOD_OFFSETS = {
+    '1mo': pd.DateOffset(months=1),
+    '3mo': pd.DateOffset(months=3),
+    '6mo': pd.DateOffset(months=6),
+    '1y': pd.DateOffset(years=1),
+    '5y': pd.DateOffset(years=5),
+}
+BAR_SYNC_INTERVAL = 60  # Minimum seconds between two delta downloads of the same series
+
+# Dividend store: events rarely change, so they are synced at most once a day per symbol
+DIVIDEND_SYNC_INTERVAL = timedelta(days=1)
+
+# Company profile and fundamentals barely change intraday
+FUNDAMENTALS_TTL = timedelta(days=1)
+# yfinance's info call blocks its thread for up to retries x timeout. The async views run it on
+# this many threads of their own, so cold detail pages never hold the default executor's threads
+FUNDAMENTALS_WORKERS = 4
+
+# Single-flight: how long a cross-process fetch lease lives and how long other callers wait for it
+FETCH_LEASE_TTL = 30
+FETCH_LEASE_WAIT = 15
+
+# Sentinel to tell a cache miss apart from a cached None
+_MISSING = object()
+
+_inflight_locks = {}
+_inflight_guard = threading.Lock()
+
+# Background revalidation of stale entries
+_refresh_executor = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS)
+
+_fundamentals_executor = ThreadPoolExecutor(max_workers=FUNDAMENTALS_WORKERS, thread_name_prefix='fundamentals')
+
+# In-process L1 for quotes, in front of the shared cache (L2). Writers append the keys they stored
+# to a shared change log (a version counter plus one short-lived key list per version), and every
+# process reads the log at most once per L1_LOG_CHECK seconds, dropping only the listed keys. When
+# the log has expired or the process fell too far behind, the whole L1 is dropped instead.
+L1_MAX_ENTRIES = 512
+L1_TTL = 10
+L1_LOG_CHECK = 1
+L1_LOG_KEY = 'quote_changes'
+L1_LOG_TTL = 60
+L1_LOG_MAX_READ = 100
+
+class LocalCache:
+    """
+    Small thread-safe LRU with a TTL, holding cache entries ({'value', 'fetched_at'}) of this process.
+    Values are deep-copied in and out, callers may mutate what they get back.
+    """
+    def __init__(self, max_entries=L1_MAX_ENTRIES, ttl=L1_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, entry)
+        self.lock = threading.Lock()
+        self.version = None  # Last change log version applied
+        self.next_log_check = 0.0
+    
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return {**item[1], 'value': copy.deepcopy(item[1]['value'])}
+    
+    def set(self, key, entry):
+        entry = {**entry, 'value': copy.deepcopy(entry['value'])}
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def discard(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def log_due(self):
+        return time.monotonic() >= self.next_log_check
+    
+    def log_range(self, version):
+        """
+        Versions of the change log this process still has to apply, or None when it must start over.
+        """
+        self.next_log_check = time.monotonic() + L1_LOG_CHECK
+        if version == self.version:
+            return range(0)
+        if self.version is None or not 0 < version - self.version <= L1_LOG_MAX_READ:
+            return None
+        return range(self.version + 1, version + 1)
+    
+    def apply_log(self, version, changes):
+        """
+        changes is {log key: [cache keys]} for the versions returned by log_range, None to start over.
+        """
+        if changes is None:
+            self.clear()
+        else:
+            self.discard([key for keys in changes.values() for key in keys])
+        self.version = version
+    
+    def advance_version(self, version):
+        # Our own write: if nobody else wrote in between, our entries are still current
+        with self.lock:
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+
+_quotes_l1 = LocalCache()
+
+def _log_key(version):
+    return f"{L1_LOG_KEY}_{version}"
+
+def _complete_log(versions, found):
+    # An expired (or not yet written) entry means unknown changes
+    if len(found) < len(versions):
+        return None
+    return found
+
+def _sync_l1():
+    if not _quotes_l1.log_due():
+        return
+    version = cache.get(L1_LOG_KEY, 0)
+    versions = _quotes_l1.log_range(version)
+    changes = None
+    if versions:
+        changes = _complete_log(versions, cache.get_many([_log_key(v) for v in versions]))
+    elif versions is not None:
+        return
+    _quotes_l1.apply_log(version, changes)
+
+async def _async_l1():
+    if not _quotes_l1.log_due():
+        return
+    version = await cache.aget(L1_LOG_KEY, 0)
+    versions = _quotes_l1.log_range(version)
+    changes = None
+    if versions:
+        changes = _complete_log(versions, await cache.aget_many([_log_key(v) for v in versions]))
+    elif versions is not None:
+        return
+    _quotes_l1.apply_log(version, changes)
+
+def _publish_quote_keys(keys):
+    """
+    Append the quote keys this process has just stored to the change log, so other processes drop them.
+    """
+    cache.add(L1_LOG_KEY, 0, timeout=None)
+    try:
+        version = cache.incr(L1_LOG_KEY)
+    except ValueError:
+        # Evicted between add and incr
+        version = 1
+        cache.set(L1_LOG_KEY, version, timeout=None)
+    cache.set(_log_key(version), sorted(keys), timeout=L1_LOG_TTL)
+    _quotes_l1.advance_version(version)
+
+# Canonical symbols. User input (petr4, PETR4, PETR4.SA) is resolved to its Yahoo symbol (PETR4.SA)
+# through the ticker index or, for tickers outside it, through the first successful probe, which is
+# remembered for ALIAS_TTL. Cache keys and stored bars use the canonical symbol, so every spelling
+# shares one entry and a resolved B3 ticker never costs a failed bare lookup again.
+ALIAS_TTL = 60 * 60 * 24 * 30
+ALIAS_L1_TTL = 60 * 60
+B3_TICKER_RE = re.compile(r'^[A-Z]{4}[0-9]{1,2}$')
+
+_aliases_l1 = LocalCache(max_entries=4096, ttl=ALIAS_L1_TTL)
+
+def normalize_ticker(ticker):
+    return ticker.upper().strip()
+
+def resolve_symbol(ticker):
+    """
+    Canonical Yahoo symbol of a ticker, or None while it is unknown (not indexed, never fetched).
+    """
+    return resolve_symbols([ticker]).get(normalize_ticker(ticker))
+
+def resolve_symbols(tickers):
+    """
+    Batch version of resolve_symbol: {normalized ticker: symbol or None}.
+    L1 first, then one get_many, then one index query for the rest.
+    """
+    resolved, missing = _resolve_local(tickers)
+    if missing:
+        found = cache.get_many([f"symbol_{ticker}" for ticker in missing])
+        remembered = {ticker: found.get(f"symbol_{ticker}") for ticker in missing}
+        unknown = [ticker for ticker, symbol in remembered.items() if symbol is None]
+        indexed = yahoo_symbols(unknown) if unknown else {}
+        _remember_symbols(indexed, [ticker for ticker in unknown if ticker not in indexed])
+        resolved.update(_merge_resolved(remembered, indexed))
+    return resolved
+
+def _resolve_local(tickers):
+    resolved, missing = {}, []
+    for ticker in dict.fromkeys(normalize_ticker(t) for t in tickers if t):
+        entry = _aliases_l1.get(ticker)
+        if entry is not None:
+            resolved[ticker] = entry['value']
+        else:
+            missing.append(ticker)
+    return resolved, missing
+
+def _merge_resolved(remembered, indexed):
+    resolved = {}
+    for ticker, symbol in remembered.items():
+        symbol = indexed.get(ticker, symbol) or None  # '' marks a ticker known to be unresolved
+        resolved[ticker] = symbol
+        if symbol is not None:
+            _aliases_l1.set(ticker, {'value': symbol, 'fetched_at': time.time()})
+    return resolved
+
+def _remember_symbols(resolved, unresolved=()):
+    """
+    Store resolutions ({ticker: symbol}) for every process. Unresolved tickers are remembered
+    briefly so their repeated lookups skip the index query.
+    """
+    entries = {}
+    for ticker, symbol in resolved.items():
+        entries[f"symbol_{ticker}"] = entries[f"symbol_{symbol}"] = symbol
+        _aliases_l1.set(ticker, {'value': symbol, 'fetched_at': time.time()})
+    if entries:
+        cache.set_many(entries, timeout=ALIAS_TTL)
+    if unresolved:
+        cache.set_many({f"symbol_{ticker}": '' for ticker in unresolved}, timeout=FAILURE_TTL)
+
+def _candidate_symbols(ticker, symbol):
+    """
+    Symbols to try upstream, in order: the canonical one when resolved, otherwise the input and,
+    for B3-looking tickers, the .SA listing first since that is where they almost always are.
+    """
+    if symbol:
+        return [symbol]
+    if B3_TICKER_RE.match(ticker):
+        return [f"{ticker}.SA", ticker]
+    return [ticker]
+
+def _store(cache_key, value):
+    cache.set(cache_key, {'value': value, 'fetched_at': time.time()}, timeout=STALE_TTL)
+
+def _is_stale(entry, ttl):
+    return time.time() - entry['fetched_at'] > ttl
+
+def _lookup(cache_key):
+    """
+    Returns the cached value (fresh or stale), the cached failure, or _MISSING.
+    """
+    entry = cache.get(cache_key)
+    if entry is not None:
+        return entry['value']
+    return cache.get(f"{cache_key}_failed", _MISSING)
+
+def _cached_fetch(cache_key, load, ttl, local=None):
+    """
+    Stale-while-revalidate read: fresh entries are returned as is, stale ones are returned
+    immediately while load() runs in the background, and only a real miss blocks on load().
+    With a LocalCache, hits are served from it and L2 is only read on an L1 miss.
+    """
+    entry = local.get(cache_key) if local is not None else None
+    if entry is None:
+        entry = cache.get(cache_key)
+        if entry is not None and local is not None:
+            local.set(cache_key, entry)
+    if entry is not None:
+        if _is_stale(entry, ttl):
+            metrics.cache_lookup(cache_key, 'stale')
+            _revalidate(cache_key, load)
+        else:
+            metrics.cache_lookup(cache_key, 'hit')
+        return entry['value']
+    
+    failed = cache.get(f"{cache_key}_failed", _MISSING)
+    if failed is not _MISSING:
+        metrics.cache_lookup(cache_key, 'failed')
+        return failed
+    
+    metrics.cache_lookup(cache_key, 'miss')
+    return _single_flight(cache_key, load)
+
+def _cached_fetch_many(loaders, ttl, local=None):
+    """
+    Batched _cached_fetch. loaders maps cache keys to their load() functions. Hits are read with
+    get_many and misses are loaded in parallel; each miss is stored as soon as it arrives so
+    callers coalesced on it are released early.
+    """
+    entries = {}
+    if local is not None:
+        for key in loaders:
+            entry = local.get(key)
+            if entry is not None:
+                entries[key] = entry
+    
+    l2_keys = [key for key in loaders if key not in entries]
+    if l2_keys:
+        found = cache.get_many(l2_keys)
+        if local is not None:
+            for key, entry in found.items():
+                local.set(key, entry)
+        entries.update(found)
+    
+    results = {}
+    for key, entry in entries.items():
+        results[key] = entry['value']
+        if _is_stale(entry, ttl):
+            metrics.cache_lookup(key, 'stale')
+            _revalidate(key, loaders[key])
+        else:
+            metrics.cache_lookup(key, 'hit')
+    
+    failed_keys = {f"{key}_failed": key for key in loaders if key not in results}
+    if failed_keys:
+        for failed_key, value in cache.get_many(list(failed_keys)).items():
+            metrics.cache_lookup(failed_keys[failed_key], 'failed')
+            results[failed_keys[failed_key]] = value
+    
+    missing = [key for key in loaders if key not in results]
+    if missing:
+        for key in missing:
+            metrics.cache_lookup(key, 'miss')
+        
+        @metrics.bind
+        def load(key):
+            try:
+                return _single_flight(key, loaders[key])
+            finally:
+                # Loaders may hit the database from this short-lived thread
+                connection.close()
+        
+        with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(missing))) as executor:
+            results.update(zip(missing, executor.map(load, missing)))
+    
+    return results
+
+def _revalidate(cache_key, load):
+    # A recent failed refresh means upstream is struggling, keep serving stale until it expires
+    if cache.get(f"{cache_key}_failed", _MISSING) is not _MISSING or not upstream.is_available():
+        return
+
+    lease_key = f"lease_{cache_key}"
+    if not cache.add(lease_key, 1, timeout=FETCH_LEASE_TTL):
+        return  # Someone is already refreshing it
+    
+    def run():
+        close_old_connections()
+        try:
+            load()
+        except Exception as e:
+            print(f"Background refresh of {cache_key} failed: {e}")
+        finally:
+            cache.delete(lease_key)
+    
+    _refresh_executor.submit(run)
+
+def _single_flight(cache_key, load):
+    """
+    Coalesce concurrent cache misses so only one load() per key is in flight: in-process through
+    a per-key lock and across gunicorn workers through a lease key in the cache.
+    load() must store its result (or failure) under cache_key, callers that lose the race get that value.
+    """
+    with _inflight_guard:
+        # [lock, callers using it], dropped by the last one so the dict doesn't grow with every key
+        entry = _inflight_locks.setdefault(cache_key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            return _load_once(cache_key, load)
+    finally:
+        with _inflight_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _inflight_locks[cache_key]
+
+def _load_once(cache_key, load):
+    """
+    Body of _single_flight, run while holding the key's in-process lock.
+    """
+    # Another thread may have filled the cache while we were waiting for the lock
+    value = _lookup(cache_key)
+    if value is not _MISSING:
+        return value
+    
+    lease_key = f"lease_{cache_key}"
+    if cache.add(lease_key, 1, timeout=FETCH_LEASE_TTL):
+        try:
+            return load()
+        finally:
+            cache.delete(lease_key)
+    
+    # Another process is fetching this key, wait for its result
+    deadline = time.monotonic() + FETCH_LEASE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        value = _lookup(cache_key)
+        if value is not _MISSING:
+            return value
+        if cache.get(lease_key) is None:
+            break
+    
+    # The other fetch died or is taking too long, do it ourselves
+    return load()
+
 def fmt_large(val, prefix=''):
     if val is None: return None
     try:
@@ -37,152 +468,1095 @@ def fmt_large(val, prefix=''):
     except:
         return val
 
-def get_stock_info(ticker):
+def get_quote(ticker):
     """
-    Fetch basic info for a given ticker. Handles .SA suffix automatically for Brazilian stocks.
+    Fetch the live quote (price, change, currency, dividend yield) of a ticker, the cheap path used by
+    the dashboard, portfolio and stream. Handles .SA suffix automatically for Brazilian stocks.
     """
-    ticker = ticker.upper().strip()
+    ticker = normalize_ticker(ticker)
+    symbol = resolve_symbol(ticker)
+    _sync_l1()
+    return _cached_fetch(f"quote_{symbol or ticker}", lambda: _load_quote(ticker, symbol), QUOTE_TTL, _quotes_l1)
+
+def get_quotes(tickers):
+    """
+    Batch version of get_quote. Returns a dict mapping each normalized ticker to its quote.
+    Cache hits (fresh, stale or failed) are read with get_many and misses are fetched in parallel,
+    so the latency depends on the slowest ticker instead of the number of tickers.
+    """
+    symbols = resolve_symbols(tickers)
+    keys = {ticker: f"quote_{symbol or ticker}" for ticker, symbol in symbols.items()}
+    # Spellings of the same symbol share one key and one fetch
+    loaders = {
+        keys[ticker]: (lambda ticker=ticker, symbol=symbol: _load_quote(ticker, symbol))
+        for ticker, symbol in symbols.items()
+    }
+    _sync_l1()
+    values = _cached_fetch_many(loaders, QUOTE_TTL, _quotes_l1)
+    return {ticker: values[key] for ticker, key in keys.items()}
+
+def refresh_quotes(tickers):
+    """
+    Force an upstream fetch for the given tickers and overwrite their cache entries.
+    Failed fetches are not cached, so a good value keeps being served as stale data.
+    Returns {ticker: quote} for the tickers that were refreshed successfully.
+    """
+    symbols = resolve_symbols(tickers)
+    if not symbols:
+        return {}
     
-    # Attempt to get from cache first
-    cache_key = f"stock_info_{ticker}"
-    cached_info = cache.get(cache_key)
-    if cached_info:
-        return cached_info
+    # One fetch per canonical symbol, whatever spellings were asked for
+    fetched = _fetch_quotes({symbol or ticker: symbol for ticker, symbol in symbols.items()})
+    now = time.time()
+    entries = {}
+    for key, quote in fetched.items():
+        if quote['valid']:
+            entry = {'value': quote, 'fetched_at': now}
+            entries[f"quote_{key}"] = entries[f"quote_{quote['ticker']}"] = entry
+    if not entries:
+        return {}
+    previous = cache.get_many(list(entries))
+    cache.set_many(entries, timeout=STALE_TTL)
+    for key, entry in entries.items():
+        _quotes_l1.set(key, entry)
+    _publish_quote_keys(entries)
     
-    # Try the original ticker first
-    info = _fetch_from_yf(ticker)
+    refreshed = {ticker: fetched[symbol or ticker] for ticker, symbol in symbols.items() if fetched[symbol or ticker]['valid']}
+    # The rendered cards of everyone watching a ticker whose price moved now show old prices
+    moved = set()
+    for ticker, quote in refreshed.items():
+        if _quote_moved(previous, [f"quote_{symbols[ticker] or ticker}", f"quote_{quote['ticker']}"], quote):
+            moved.update((ticker, quote['ticker']))
+    if moved:
+        from .fragments import invalidate_tickers  # fragments imports this module
+        invalidate_tickers(moved)
+    return refreshed
+
+def _load_quote(ticker, symbol):
+    quote = _fetch_quote(ticker, symbol)
+    _store_quote(symbol or ticker, quote)
+    return quote
+
+def _store_quote(key_symbol, quote):
+    cache_key = f"quote_{key_symbol}"
+    if quote['valid']:
+        entry = {'value': quote, 'fetched_at': time.time()}
+        # A first lookup by input is also stored under the symbol it resolved to
+        entries = {cache_key: entry, f"quote_{quote['ticker']}": entry}
+        previous = cache.get_many(list(entries))
+        cache.set_many(entries, timeout=STALE_TTL)
+        for key in entries:
+            _quotes_l1.set(key, entry)
+        _publish_quote_keys(entries)
+        # Cards rendered with the previous price are dropped (refresh_quotes does the same in bulk)
+        if _quote_moved(previous, entries, quote):
+            from .fragments import invalidate_tickers  # fragments imports this module
+            invalidate_tickers({key_symbol, quote['ticker']})
+    else:
+        cache.set(f"{cache_key}_failed", quote, timeout=FAILURE_TTL)  # Cache failures for 1 min to avoid spam
+
+def _quote_moved(previous, keys, quote):
+    """
+    Whether the quote shows something else than the entries it replaces ({key: entry} of the
+    shared cache), i.e. whether cards rendered from them are out of date.
+    """
+    for key in keys:
+        entry = previous.get(key)
+        if entry is None or (entry['value']['price'], entry['value']['change_pct']) != (quote['price'], quote['change_pct']):
+            return True
+    return False
+
+def _fetch_quotes(symbols):
+    """
+    {ticker: symbol or None} -> {ticker: quote}, fetched in parallel.
+    """
+    @metrics.bind
+    def fetch(ticker):
+        try:
+            return _fetch_quote(ticker, symbols[ticker])
+        finally:
+            # The dividend store is read from this short-lived thread
+            connection.close()
     
-    # If not found and it looks like a Brazilian ticker (e.g., 4 letters + numbers)
-    # automatically try appending .SA
-    if not info['valid'] and not ticker.endswith('.SA'):
-        import re
-        if re.match(r'^[A-Z]{4}[0-9]{1,2}$', ticker):
-            info = _fetch_from_yf(f"{ticker}.SA")
-            
-    # Store in cache
-    if info['valid']:
-        cache.set(cache_key, info, timeout=300) # Cache success for 5 min
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(symbols))) as executor:
+        return dict(zip(symbols, executor.map(fetch, symbols)))
+
+def _fetch_quote(ticker, symbol):
+    misses = []
+    for candidate in _candidate_symbols(ticker, symbol):
+        quote = _fetch_quote_from_yf(candidate)
+        if quote['valid']:
+            if symbol is None:
+                _remember_symbols({ticker: candidate})
+            break
+        misses.append(quote.get('not_found', False))
     else:
-        cache.set(cache_key, info, timeout=60)  # Cache failures for 1 min to avoid spam
-        
+        # Only a definite answer when upstream said so for every candidate
+        quote['not_found'] = all(misses)
+    return quote
+
+def _fetch_quote_from_yf(symbol):
+    # The chart endpoint's metadata carries the live price, way lighter than the info endpoint
+    try:
+        with metrics.upstream_call('quote', symbol):
+            response = upstream.get(YAHOO_CHART_URL.format(symbol), params={'range': '1d', 'interval': '1d'})
+        quote = _parse_quote(symbol, response.json())
+        if quote['valid']:
+            quote['dividend_yield'] = _dividend_yield(get_ttm_dividends(symbol), quote['price'])
+        return quote
+    except Exception as e:
+        print(f"Error fetching {symbol}: {e}")
+        return {'ticker': symbol, 'valid': False}
+
+def _parse_quote(symbol, payload):
+    results = (payload.get('chart') or {}).get('result') or []
+    meta = results[0].get('meta') or {} if results else {}
+    price = meta.get('regularMarketPrice')
+    if price is None:
+        # Upstream answered without a price: unknown symbol (errors raise and are not flagged)
+        return {'ticker': symbol, 'valid': False, 'not_found': True}
+    
+    previous_close = meta.get('previousClose') or meta.get('chartPreviousClose')
+    return {
+        'ticker': symbol,
+        'name': meta.get('longName', meta.get('shortName', symbol)),
+        'price': price,
+        'currency': meta.get('currency', 'BRL' if symbol.endswith('.SA') else 'USD'),
+        'change_pct': (price / previous_close - 1) * 100 if previous_close else None,
+        'valid': True,
+        'dividend_yield': 0.0,  # Filled in by the caller from the dividend store
+        'fetched_at': time.time(),
+    }
+
+def _dividend_yield(total_last_year, price):
+    # Trailing 12m sum from the dividend store, which also fixes FII bugs (e.g. MXRF11 showing 1200%).
+    # Upstream failures keep the stored sum; database errors propagate and fail the whole quote, a
+    # made-up 0% yield would be cached and written into the snapshots
+    if total_last_year and price:
+        return total_last_year / price
+    return 0.0
+
+def get_fundamentals(symbol):
+    """
+    Company profile and fundamental indicators (Infomoney style) of a Yahoo symbol. They come from
+    the heavy info endpoint, so they are persisted in StockProfile and refreshed at most once per
+    FUNDAMENTALS_TTL; a failed refresh keeps serving the stored ones.
+    """
+    profile = StockProfile.objects.filter(symbol=symbol).first()
+    if _fundamentals_due(profile):
+        profile = _sync_fundamentals(symbol) or profile
+    return _fundamentals_dict(profile)
+
+def _fundamentals_due(profile):
+    return profile is None or timezone.now() - profile.updated_at >= FUNDAMENTALS_TTL
+
+def _fundamentals_dict(profile):
+    if profile is None:
+        return {'description': '', 'sector': 'N/A', 'industry': 'N/A'}
+    return {
+        'description': profile.description,
+        'pe_ratio': profile.pe_ratio,
+        'price_to_book': profile.price_to_book,
+        'eps': profile.eps,  # LPA
+        'book_value': profile.book_value,  # VPA
+        'market_cap': fmt_large(profile.market_cap, 'R$ '),
+        'fifty_two_week_high': profile.fifty_two_week_high,
+        'fifty_two_week_low': profile.fifty_two_week_low,
+        'average_volume': fmt_large(profile.average_volume),
+        'sector': profile.sector,
+        'industry': profile.industry,
+        'info_dividend_yield': profile.dividend_yield,
+    }
+
+def _merge_fundamentals(quote, fundamentals):
+    info = {**quote, **fundamentals}
+    # Only trust the provider's yield when there is no dividend history to compute it from
+    if not info['dividend_yield']:
+        info['dividend_yield'] = info.get('info_dividend_yield') or 0.0
     return info
 
-def _fetch_from_yf(ticker):
+def _sync_fundamentals(symbol):
     try:
         # Pass the curl_cffi session to yfinance
-        stock = yf.Ticker(ticker, session=session)
-        
-        # Using fast_info or checking for regularMarketPrice as yf info can be slow/unreliable
-        details = stock.info
-        if not details or ('regularMarketPrice' not in details and 'currentPrice' not in details):
-            return {'ticker': ticker, 'valid': False}
-            
-        parsed_info = {
-            'ticker': ticker,
-            'name': details.get('longName', details.get('shortName', ticker)),
-            'price': details.get('currentPrice', details.get('regularMarketPrice')),
-            'currency': details.get('currency', 'BRL' if ticker.endswith('.SA') else 'USD'),
-            'change_pct': details.get('regularMarketChangePercent'),
-            'valid': True
-        }
-        
-        # Calculate Dividend Yield precisely for FIIs and unreliable YF Info
-        # Always prioritize manual trailing 12m sum to fix FII bugs (e.g. MXRF11 showing 1200%)
-        dy = None
-        try:
-            dividends = stock.dividends
-            if not dividends.empty and parsed_info['price']:
-                one_year_ago = pd.Timestamp.now(tz=dividends.index.tz) - pd.DateOffset(years=1)
-                last_year_divs = dividends[dividends.index >= one_year_ago]
-                total_last_year = last_year_divs.sum()
-                if total_last_year > 0:
-                    dy = total_last_year / parsed_info['price']
-        except Exception as e:
-            print(f"Fallback dividend error for {ticker}: {e}")
-            pass
-            
-        if dy is None:
-            dy = details.get('dividendYield', details.get('trailingAnnualDividendYield'))
-            
-        parsed_info['dividend_yield'] = dy or 0.0
-        parsed_info['description'] = details.get('longBusinessSummary', details.get('description', ''))
-        
-        # Fundamental Indicators (Infomoney Style)
-        parsed_info['pe_ratio'] = details.get('trailingPE', details.get('forwardPE'))
-        parsed_info['price_to_book'] = details.get('priceToBook')
-        parsed_info['eps'] = details.get('trailingEps') # LPA
-        parsed_info['book_value'] = details.get('bookValue') # VPA
-        parsed_info['market_cap'] = fmt_large(details.get('marketCap'), 'R$ ')
-        parsed_info['fifty_two_week_high'] = details.get('fiftyTwoWeekHigh')
-        parsed_info['fifty_two_week_low'] = details.get('fiftyTwoWeekLow')
-        parsed_info['average_volume'] = fmt_large(details.get('averageVolume', details.get('regularMarketVolume')))
-        parsed_info['sector'] = details.get('sector', 'N/A')
-        parsed_info['industry'] = details.get('industry', 'N/A')
-
-        return parsed_info
-        
+        stock = yf.Ticker(symbol, session=session)
+        with metrics.upstream_call('fundamentals', symbol):
+            details = upstream.call(lambda: stock.info)
     except Exception as e:
-        print(f"Error fetching {ticker}: {e}")
-        return {'ticker': ticker, 'valid': False}
+        print(f"Error fetching fundamentals for {symbol}: {e}")
+        return None
+    if not details:
+        return None
+    
+    profile, _ = StockProfile.objects.update_or_create(symbol=symbol, defaults={
+        'name': details.get('longName', details.get('shortName', symbol)) or symbol,
+        'description': details.get('longBusinessSummary', details.get('description', '')) or '',
+        'sector': details.get('sector', 'N/A'),
+        'industry': details.get('industry', 'N/A'),
+        'pe_ratio': details.get('trailingPE', details.get('forwardPE')),
+        'price_to_book': details.get('priceToBook'),
+        'eps': details.get('trailingEps'),
+        'book_value': details.get('bookValue'),
+        'market_cap': details.get('marketCap'),
+        'fifty_two_week_high': details.get('fiftyTwoWeekHigh'),
+        'fifty_two_week_low': details.get('fiftyTwoWeekLow'),
+        'average_volume': details.get('averageVolume', details.get('regularMarketVolume')),
+        'dividend_yield': details.get('dividendYield', details.get('trailingAnnualDividendYield')),
+        'updated_at': timezone.now(),
+    })
+    return profile
 
-def get_historical_data(ticker, period='1mo', interval=None):
+def get_historical_payload(ticker, period='1mo', interval=None, points=None):
     """
-    Fetch historical data for a given ticker. Handles .SA suffix automatically for Brazilian stocks.
+    Fetch the history of a ticker as parallel 'dates'/'timestamps'/'close' arrays, returned as its
+    cached JSON encoding ({'json': bytes, 'etag': str}) so views can send it without decoding and
+    re-encoding it. Handles .SA suffix automatically for Brazilian stocks.
+    With points, the series is downsampled to at most that many points (LTTB), cached per resolution.
+    """
+    ticker = normalize_ticker(ticker)
+    symbol = resolve_symbol(ticker)
+    interval = interval or default_interval(period)
+    cache_key = f"hist_{symbol or ticker}_{period}_{interval}"
+    if points:
+        return _cached_fetch(
+            f"{cache_key}_p{points}",
+            lambda: _load_downsampled_history(symbol or ticker, period, interval, points),
+            HIST_TTL
+        )
+    return _cached_fetch(cache_key, lambda: _load_historical_data(ticker, symbol, period, interval), HIST_TTL)
+
+def get_historical_payloads(tickers, period='1mo', interval=None):
     """
-    ticker = ticker.upper().strip()
+    Batch version of get_historical_payload. Returns a dict mapping each normalized ticker to its
+    payload (or None), reading hits with get_many and fetching misses in parallel.
+    """
+    symbols = resolve_symbols(tickers)
+    interval = interval or default_interval(period)
+    keys = {ticker: f"hist_{symbol or ticker}_{period}_{interval}" for ticker, symbol in symbols.items()}
+    loaders = {
+        keys[ticker]: (lambda ticker=ticker, symbol=symbol: _load_historical_data(ticker, symbol, period, interval))
+        for ticker, symbol in symbols.items()
+    }
+    values = _cached_fetch_many(loaders, HIST_TTL)
+    return {ticker: values[key] for ticker, key in keys.items()}
+
+def get_aligned_history(tickers, period='1mo'):
+    """
+    History of several tickers aligned on one shared axis, for multi-series charts.
+    Returns {'period', 'dates', 'series': {ticker: [close or None, ...]}, 'missing': [...], 'etag',
+    'fetched_at'}, fetched_at being that of the oldest series (None if unknown).
+    Daily/weekly bars are matched by date (exchanges label them in local time), intraday bars by timestamp.
+    """
+    df, payloads = get_close_matrix(tickers, period)
     
-    # Se o intervalo não for fornecido, determinar baseado no período
-    if not interval:
-        if period in ['1d', '5d']:
-            interval = '15m'
-        elif period in ['1mo', '3mo']:
-            interval = '1d'
-        elif period in ['6mo', 'ytd', '1y']:
-            interval = '1d'
-        elif period in ['5y', 'max']:
-            interval = '1wk'
+    etag = hashlib.md5(
+        '|'.join(f"{t}:{p['etag'] if p else ''}" for t, p in payloads.items()).encode()
+    ).hexdigest()
+    missing = [t for t, p in payloads.items() if p is None]
+    fetched = [p['fetched_at'] for p in payloads.values() if p is not None and 'fetched_at' in p]
+    fetched_at = min(fetched) if fetched else None
+    
+    if df is None:
+        return {'period': period, 'dates': [], 'series': {}, 'missing': missing, 'etag': etag, 'fetched_at': fetched_at}
+    
+    series = {
+        ticker: [None if np.isnan(v) else v for v in df[ticker].to_numpy()]
+        for ticker in df.columns
+    }
+    return {
+        'period': period,
+        'dates': df.index.tolist(),
+        'series': series,
+        'missing': missing,
+        'etag': etag,
+        'fetched_at': fetched_at,
+    }
+
+def get_close_matrix(tickers, period='1mo'):
+    """
+    Close prices of several tickers as one DataFrame on the axis described in get_aligned_history:
+    one column per ticker, NaN where a ticker has no bar, indexed by date labels.
+    Returns (df or None if nothing could be fetched, {ticker: payload or None}).
+    """
+    interval = default_interval(period)
+    tickers = list(tickers)
+    payloads = {}
+    for start in range(0, len(tickers), HISTORY_BATCH_SIZE):
+        payloads.update(get_historical_payloads(tickers[start:start + HISTORY_BATCH_SIZE], period, interval))
+    
+    columns = {}
+    labels = {}
+    for ticker, payload in payloads.items():
+        if payload is None:
+            continue
+        data = json.loads(payload['json'])
+        if interval in INTRADAY_INTERVALS:
+            columns[ticker] = pd.Series(data['close'], index=data['timestamps'])
+            labels.update(zip(data['timestamps'], data['dates']))
         else:
-            interval = '1d'
-            
-    # Attempt to get from cache first
-    cache_key = f"hist_{ticker}_{period}_{interval}"
-    cached_data = cache.get(cache_key)
-    if cached_data is not None:
-        return cached_data
-            
-    # Try fetching as is
-    data = _fetch_hist_from_yf(ticker, period, interval)
-    
-    # If failed and it looks like a B3 ticker, try with .SA
-    if data is None and not ticker.endswith('.SA'):
-        import re
-        if re.match(r'^[A-Z]{4}[0-9]{1,2}$', ticker):
-            data = _fetch_hist_from_yf(f"{ticker}.SA", period, interval)
+            columns[ticker] = pd.Series(data['close'], index=data['dates'])
+    
+    if not columns:
+        return None, payloads
+    
+    df = pd.DataFrame(columns).sort_index()
+    if labels:
+        df.index = [labels[ts] for ts in df.index]
+    return df, payloads
+
+def default_interval(period):
+    # Se o intervalo não for fornecido, determinar baseado no período
+    if period in ['1d', '5d']:
+        return '15m'
+    elif period in ['1mo', '3mo']:
+        return '1d'
+    elif period in ['6mo', 'ytd', '1y']:
+        return '1d'
+    elif period in ['5y', 'max']:
+        return '1wk'
+    return '1d'
+
+def _load_historical_data(ticker, symbol, period, interval):
+    data, series = None, None
+    try:
+        series = _sync_price_series(ticker, symbol, period, interval)
+        data = _build_history_payload(series, period, interval)
+    except Exception as e:
+        print(f"Error loading historical data for {ticker}: {e}")
     
     # Store in cache
+    cache_key = f"hist_{symbol or ticker}_{period}_{interval}"
     if data is not None:
-        cache.set(cache_key, data, timeout=600) # Cache success for 10 min
+        data = _store_history(cache_key, data)
+        if series.ticker != (symbol or ticker):
+            _store_history(f"hist_{series.ticker}_{period}_{interval}", data)
     else:
-        cache.set(cache_key, data, timeout=60)  # Cache failures for 1 min
+        cache.set(f"{cache_key}_failed", data, timeout=FAILURE_TTL)  # Cache failures for 1 min
         
     return data
 
-def _fetch_hist_from_yf(ticker, period, interval):
-    try:
-        # Pass the curl_cffi session to yf.Ticker
-        stock = yf.Ticker(ticker, session=session)
-        df = stock.history(period=period, interval=interval)
-        if df.empty:
-            return None
+def _store_history(cache_key, data):
+    """
+    Store a history payload, stamped with its fetch time, along with its validators (ETag and
+    fetch time) under their own small key, so conditional requests are answered without reading
+    the payload. Returns the stored payload.
+    """
+    data, entries = _history_entries(cache_key, data)
+    cache.set_many(entries, timeout=STALE_TTL)
+    return data
+
+def _history_entries(cache_key, data):
+    now = time.time()
+    data = {**data, 'fetched_at': now}
+    return data, {
+        cache_key: {'value': data, 'fetched_at': now},
+        f"{cache_key}_validators": {'etag': data['etag'], 'fetched_at': now},
+    }
+
+def _build_history_payload(series, period, interval):
+    columns = _slice_price_series(series, period) if series is not None else None
+    if columns is None:
+        return None
+    return _encode_history(period, interval, columns)
+
+def _load_downsampled_history(ticker, period, interval, points):
+    data = _downsample_payload(get_historical_payload(ticker, period, interval), period, interval, points)
+    
+    cache_key = f"hist_{ticker}_{period}_{interval}_p{points}"
+    if data is not None:
+        data = _store_history(cache_key, data)
+    else:
+        cache.set(f"{cache_key}_failed", data, timeout=FAILURE_TTL)
+    
+    return data
+
+def _downsample_payload(payload, period, interval, points):
+    if payload is None:
+        return None
+    columns = json.loads(payload['json'])
+    if len(columns['close']) <= points:
+        return payload
+    keep = lttb_indices(np.asarray(columns['timestamps'], dtype='float64'), np.asarray(columns['close']), points)
+    columns = {key: [columns[key][i] for i in keep] for key in ('dates', 'timestamps', 'close')}
+    return _encode_history(period, interval, columns)
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of `threshold` points that
+    keep the visual shape of the (x, y) series; the first and last points are always kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    
+    # threshold - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # The third vertex is the average of the next bucket (the last point for the last bucket)
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
         
-        # Reset index to get Date as a column
-        df = df.reset_index()
-        # Convert Date to string for JSON serialization
-        # Ensure 'Date' column exists (sometimes it's 'Datetime' for small intervals)
-        date_col = 'Date' if 'Date' in df.columns else 'Datetime'
-        df[date_col] = df[date_col].dt.strftime('%Y-%m-%d')
+        # Triangle areas for every candidate of the bucket at once
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    
+    return selected
+
+# Escaped like json_script does: the payload is also embedded in a <script> tag of the detail page
+_SCRIPT_SAFE_JSON = {ord('<'): '\\u003C', ord('>'): '\\u003E', ord('&'): '\\u0026'}
+
+def _encode_history(period, interval, columns):
+    encoded = json.dumps(
+        {'period': period, 'interval': interval, **columns}, separators=(',', ':')
+    ).translate(_SCRIPT_SAFE_JSON).encode()
+    return {'json': _CompressedBytes(encoded), 'etag': hashlib.md5(encoded).hexdigest()}
+
+class _CompressedBytes(bytes):
+    """
+    bytes that are zlib-compressed when pickled. Every cache backend pickles its values, so history
+    payloads take a fraction of the space (and of the network round trip to a shared cache)
+    and come back as plain bytes on read.
+    """
+    def __reduce__(self):
+        return (_decompress_bytes, (zlib.compress(self, HIST_COMPRESS_LEVEL),))
+
+def _decompress_bytes(data):
+    return _CompressedBytes(zlib.decompress(data))
+
+def _period_start(period, now):
+    """
+    Start of the window covered by a period, or None for 'max'. Intraday periods are padded so
+    weekends and holidays are covered; _slice_price_series trims them to trading days.
+    """
+    if period == 'max':
+        return None
+    if period == 'ytd':
+        return now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    if period in INTRADAY_PERIOD_DAYS:
+        return now - timedelta(days=INTRADAY_PERIOD_DAYS[period] + 5)
+    offset = PERIOD_OFFSETS.get(period, PERIOD_OFFSETS['1mo'])
+    return (pd.Timestamp(now) - offset).to_pydatetime()
+
+def _sync_price_series(ticker, symbol, period, interval):
+    """
+    Make sure the bar store covers the requested period. A covered series only downloads the bars
+    after its last stored one; otherwise the whole period is downloaded once and merged in.
+    Returns the series, or None if nothing could be fetched.
+    """
+    plan = _plan_price_sync(ticker, symbol, period, interval)
+    df, fetched_symbol = None, None
+    for fetched_symbol, params in plan['fetches']:
+        df = _fetch_bars(fetched_symbol, interval, **params)
+        if df is not None:
+            break
+    refetch = _readjust_fetch(plan, df, fetched_symbol)
+    if refetch is not None:
+        # Without the new download the delta is dropped as well, so the next sync tries again
+        df = _fetch_bars(refetch[0], interval, **refetch[1])
+        plan['readjusted'] = df is not None
+    if df is not None and symbol is None:
+        _remember_symbols({ticker: fetched_symbol})
+    return _apply_price_sync(plan, df, fetched_symbol)
+
+def _plan_price_sync(ticker, symbol, period, interval):
+    """
+    Decide which download (if any) the bar store needs for a period. 'fetches' lists the
+    (symbol, params) candidates to try in order, the first one that returns bars wins.
+    Series are stored under their canonical symbol.
+    """
+    now = timezone.now()
+    start = _period_start(period, now)
+    series = PriceSeries.objects.filter(ticker=symbol or ticker, interval=interval).first()
+    
+    covered = series is not None and (
+        series.full_history or
+        (start is not None and series.covered_from is not None and series.covered_from <= start)
+    )
+    plan = {'interval': interval, 'now': now, 'start': start, 'series': series,
+            'covered': covered, 'fetches': [], 'last_bar': None, 'readjusted': False}
+    
+    if covered:
+        if (now - series.synced_at).total_seconds() >= BAR_SYNC_INTERVAL:
+            last_bar = series.bars.order_by('-timestamp').first()
+            if last_bar is not None:
+                plan['last_bar'] = last_bar.timestamp
+            # Re-fetch the last stored bar too, it may still have been in progress
+            plan['fetches'] = [(series.symbol, {'start': last_bar.timestamp if last_bar else start})]
+    else:
+        symbols = [series.symbol] if series else _candidate_symbols(ticker, symbol)
+        plan['fetches'] = [(candidate, {'period': period}) for candidate in symbols]
+    
+    return plan
+
+def _readjust_fetch(plan, df, symbol):
+    """
+    Stored bars are adjusted for the dividends and splits known when they were downloaded. A delta
+    bringing a new one changes the adjustment of every older bar, so the whole covered window is
+    downloaded again. Returns that (symbol, params) fetch, or None if the delta can be merged as is.
+    """
+    if df is None or plan['last_bar'] is None:
+        return None
+    new_bars = df[df.index > plan['last_bar']]
+    if not ((new_bars['Dividends'] > 0) | (new_bars['Stock Splits'] > 0)).any():
+        return None
+    series = plan['series']
+    return symbol, {'period': 'max'} if series.full_history else {'start': series.covered_from}
+
+def _apply_price_sync(plan, df, symbol):
+    """
+    Merge downloaded bars into the store. Without bars (nothing to download, or upstream failing)
+    the existing series is served as is.
+    """
+    series = plan['series']
+    if df is None:
+        return series
+    
+    now, start, interval = plan['now'], plan['start'], plan['interval']
+    with transaction.atomic():
+        if series is None:
+            series, _ = PriceSeries.objects.get_or_create(
+                ticker=symbol, interval=interval,
+                defaults={'symbol': symbol, 'synced_at': now}
+            )
+        if not plan['covered']:
+            series.full_history = series.full_history or start is None
+            if start is not None and (series.covered_from is None or start < series.covered_from):
+                series.covered_from = start
+        if df.index.tz is not None:
+            series.timezone = str(df.index.tz)
+        series.symbol = symbol
+        series.synced_at = now
+        
+        if plan['readjusted']:
+            # Replaced as a whole, no bar may keep the previous adjustment
+            series.bars.all().delete()
+        _save_bars(series, df)
+        
+        # Yahoo only serves intraday bars for a few weeks, older ones are never requested again
+        if interval in INTRADAY_INTERVALS:
+            cutoff = now - INTRADAY_RETENTION
+            series.bars.filter(timestamp__lt=cutoff).delete()
+            if series.covered_from is None or series.covered_from < cutoff:
+                series.covered_from = cutoff
         
-        return df[[date_col, 'Close']].rename(columns={date_col: 'Date'}).to_dict(orient='records')
+        series.save()
+    
+    return series
+
+def _save_bars(series, df):
+    index = df.index.tz_convert('UTC') if df.index.tz is not None else df.index.tz_localize('UTC')
+    df = df.set_axis(index)
+    df = df[df['Close'].notna()]
+    
+    bars = [
+        PriceBar(
+            series=series,
+            timestamp=ts.to_pydatetime(),
+            open=_float_or_none(row.Open),
+            high=_float_or_none(row.High),
+            low=_float_or_none(row.Low),
+            close=float(row.Close),
+            volume=int(row.Volume) if pd.notna(row.Volume) else None,
+        )
+        for ts, row in zip(df.index, df.itertuples())
+    ]
+    PriceBar.objects.bulk_create(
+        bars,
+        update_conflicts=True,
+        unique_fields=['series', 'timestamp'],
+        update_fields=['open', 'high', 'low', 'close', 'volume'],
+    )
+
+def _float_or_none(val):
+    return float(val) if pd.notna(val) else None
+
+def _slice_price_series(series, period):
+    """
+    Serve a period as a slice of the stored bars, as parallel 'dates'/'close' columns.
+    Returns None if the slice is empty.
+    """
+    bars = series.bars.order_by('timestamp')
+    start = _period_start(period, timezone.now())
+    if start is not None:
+        bars = bars.filter(timestamp__gte=start)
+    
+    rows = list(bars.values_list('timestamp', 'close'))
+    if not rows:
+        return None
+    
+    timestamps, closes = zip(*rows)
+    index = pd.DatetimeIndex(timestamps).tz_convert(series.timezone or 'UTC')
+    close = np.asarray(closes, dtype='float64')
+    
+    # '1d'/'5d' mean the last trading days, not calendar days
+    if period in INTRADAY_PERIOD_DAYS:
+        days = index.normalize()
+        trading_days = days.unique()
+        mask = days >= trading_days[max(0, len(trading_days) - INTRADAY_PERIOD_DAYS[period])]
+        index, close = index[mask], close[mask]
+    
+    return {
+        'dates': index.strftime('%Y-%m-%d').tolist(),
+        'timestamps': index.as_unit('s').asi8.tolist(),
+        'close': np.round(close, 4).tolist(),
+    }
+
+def _fetch_bars(symbol, interval, period=None, start=None):
+    """
+    Downloads bars from Yahoo's chart endpoint. Returns a DataFrame shaped like yfinance's history()
+    (adjusted OHLC plus Dividends and Stock Splits, indexed in the exchange timezone), or None.
+    """
+    try:
+        with metrics.upstream_call('history', symbol):
+            response = upstream.get(YAHOO_CHART_URL.format(symbol), params=_chart_params(interval, period, start))
+        return _chart_frame(response.json(), interval)
+    except Exception as e:
+        print(f"Error fetching historical data for {symbol}: {e}")
+        return None
+
+def _chart_params(interval, period, start):
+    params = {'interval': interval, 'events': 'div,splits', 'includePrePost': 'false'}
+    if start is not None:
+        params.update(period1=int(start.timestamp()), period2=int(time.time()))
+    else:
+        params['range'] = period
+    return params
+
+def _chart_frame(payload, interval):
+    results = (payload.get('chart') or {}).get('result') or []
+    if not results or not results[0].get('timestamp'):
+        return None
+    result = results[0]
+    
+    quote = result['indicators']['quote'][0]
+    index = pd.to_datetime(result['timestamp'], unit='s', utc=True)
+    index = index.tz_convert(result['meta'].get('exchangeTimezoneName') or 'UTC')
+    df = pd.DataFrame(
+        {col.capitalize(): quote.get(col) for col in ('open', 'high', 'low', 'close', 'volume')},
+        index=index, dtype='float64'
+    )
+    
+    # Same auto_adjust yfinance applies by default
+    adjclose = (result['indicators'].get('adjclose') or [{}])[0].get('adjclose')
+    if adjclose is not None:
+        adjclose = np.asarray(adjclose, dtype='float64')
+        ratio = adjclose / df['Close'].to_numpy()
+        for col in ('Open', 'High', 'Low'):
+            df[col] = df[col] * ratio
+        df['Close'] = adjclose
+    
+    # Events go on the bar they fall in, 0 elsewhere
+    events = result.get('events') or {}
+    for column, kind in (('Dividends', 'dividends'), ('Stock Splits', 'splits')):
+        values = np.zeros(len(df))
+        for event in (events.get(kind) or {}).values():
+            position = index.searchsorted(pd.Timestamp(event['date'], unit='s', tz='UTC'), side='right') - 1
+            if position >= 0:
+                values[position] = event['amount'] if kind == 'dividends' else event['numerator'] / event['denominator']
+        df[column] = values
+    
+    # yfinance labels daily/weekly bars with the session date at local midnight
+    if interval not in INTRADAY_INTERVALS:
+        df.index = df.index.normalize()
+    
+    df = df[df['Close'].notna()]
+    return df if not df.empty else None
+
+def get_ttm_dividends(symbol):
+    """
+    Dividends per share paid by a Yahoo symbol in the last 12 months, precomputed by the dividend
+    store, which is synced first when it has no data yet or its last sync is over a day old.
+    Returns None if nothing is known about the symbol.
+    """
+    series, params = _dividend_state(symbol)
+    if params is not None:
+        series = _sync_dividends(symbol, series, params) or series
+    return series.ttm_total if series is not None else None
+
+def _dividend_state(symbol):
+    """
+    The symbol's DividendSeries (or None) and the chart params of the sync it is due for, None
+    when it was synced less than DIVIDEND_SYNC_INTERVAL ago.
+    """
+    series = DividendSeries.objects.filter(symbol=symbol).first()
+    if series is not None and timezone.now() - series.synced_at < DIVIDEND_SYNC_INTERVAL:
+        return series, None
+    
+    # Download the dividends paid since the last stored one (the whole history on the first sync).
+    # They come as chart events, monthly bars keep the response small
+    last_event = series.events.order_by('-date').first() if series is not None else None
+    params = {'interval': '1mo', 'events': 'div'}
+    if last_event is not None:
+        params.update(period1=int(last_event.date.timestamp()), period2=int(time.time()))
+    else:
+        params['range'] = 'max'
+    return series, params
+
+def _sync_dividends(symbol, series, params):
+    """
+    Download the dividends (see _dividend_state) and recompute the TTM sum. Returns the series,
+    or None if upstream failed.
+    """
+    try:
+        with metrics.upstream_call('dividends', symbol):
+            response = upstream.get(YAHOO_CHART_URL.format(symbol), params=params)
+        payload = response.json()
+    except Exception as e:
+        print(f"Error fetching dividends for {symbol}: {e}")
+        return None
+    return _save_dividends(symbol, series, payload)
+
+def _save_dividends(symbol, series, payload):
+    results = (payload.get('chart') or {}).get('result') or []
+    if not results:
+        return None
+    dividends = (results[0].get('events') or {}).get('dividends') or {}
+    
+    now = timezone.now()
+    with transaction.atomic():
+        if series is None:
+            series, _ = DividendSeries.objects.get_or_create(symbol=symbol, defaults={'synced_at': now})
+        DividendEvent.objects.bulk_create(
+            [
+                DividendEvent(
+                    series=series,
+                    date=pd.Timestamp(event['date'], unit='s', tz='UTC').to_pydatetime(),
+                    amount=event['amount']
+                )
+                for event in dividends.values()
+            ],
+            update_conflicts=True,
+            unique_fields=['series', 'date'],
+            update_fields=['amount'],
+        )
+        one_year_ago = now - timedelta(days=365)
+        series.ttm_total = series.events.filter(date__gte=one_year_ago).aggregate(total=Sum('amount'))['total'] or 0.0
+        series.synced_at = now
+        series.save()
+    
+    return series
+
+# ---------------------------------------------------------------------------
+# Async path, used by the ASGI views. History is downloaded with curl_cffi's AsyncSession, so slow
+# upstream calls only cost a pending coroutine instead of a blocked worker. Cache layout,
+# single-flight leases and the bar store are shared with the sync path.
+# ---------------------------------------------------------------------------
+
+_async_inflight = {}
+_background_tasks = set()
+
+async def _alookup(cache_key):
+    entry = await cache.aget(cache_key)
+    if entry is not None:
+        return entry['value']
+    return await cache.aget(f"{cache_key}_failed", _MISSING)
+
+async def _acached_fetch(cache_key, aload, ttl, local=None):
+    """
+    Async version of _cached_fetch, aload is a coroutine function.
+    """
+    entry = local.get(cache_key) if local is not None else None
+    if entry is None:
+        entry = await cache.aget(cache_key)
+        if entry is not None and local is not None:
+            local.set(cache_key, entry)
+    if entry is not None:
+        if _is_stale(entry, ttl):
+            metrics.cache_lookup(cache_key, 'stale')
+            await _arevalidate(cache_key, aload)
+        else:
+            metrics.cache_lookup(cache_key, 'hit')
+        return entry['value']
+    
+    failed = await cache.aget(f"{cache_key}_failed", _MISSING)
+    if failed is not _MISSING:
+        metrics.cache_lookup(cache_key, 'failed')
+        return failed
+    
+    metrics.cache_lookup(cache_key, 'miss')
+    return await _asingle_flight(cache_key, aload)
+
+async def _arevalidate(cache_key, aload):
+    if await cache.aget(f"{cache_key}_failed", _MISSING) is not _MISSING or not await upstream.ais_available():
+        return
+    
+    lease_key = f"lease_{cache_key}"
+    if not await cache.aadd(lease_key, 1, timeout=FETCH_LEASE_TTL):
+        return
+    
+    async def run():
+        try:
+            await aload()
+        except Exception as e:
+            print(f"Background refresh of {cache_key} failed: {e}")
+        finally:
+            await cache.adelete(lease_key)
+    
+    # Keep a reference so the task isn't garbage collected while running
+    task = asyncio.create_task(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def _asingle_flight(cache_key, aload):
+    """
+    Async version of _single_flight: coroutines of this process share one task per key, and
+    other processes are coordinated through the same lease key as the sync path.
+    """
+    task = _async_inflight.get(cache_key)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.ensure_future(_alead(cache_key, aload))
+        _async_inflight[cache_key] = task
+        task.add_done_callback(lambda _: _async_inflight.pop(cache_key, None))
+    # A cancelled caller must not cancel the fetch the others are waiting for
+    return await asyncio.shield(task)
+
+async def _alead(cache_key, aload):
+    value = await _alookup(cache_key)
+    if value is not _MISSING:
+        return value
+    
+    lease_key = f"lease_{cache_key}"
+    if await cache.aadd(lease_key, 1, timeout=FETCH_LEASE_TTL):
+        try:
+            return await aload()
+        finally:
+            await cache.adelete(lease_key)
+    
+    # Another process is fetching this key, wait for its result
+    deadline = time.monotonic() + FETCH_LEASE_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+        value = await _alookup(cache_key)
+        if value is not _MISSING:
+            return value
+        if await cache.aget(lease_key) is None:
+            break
+    
+    return await aload()
+
+async def aresolve_symbols(tickers):
+    """
+    Async version of resolve_symbols.
+    """
+    resolved, missing = _resolve_local(tickers)
+    if missing:
+        found = await cache.aget_many([f"symbol_{ticker}" for ticker in missing])
+        remembered = {ticker: found.get(f"symbol_{ticker}") for ticker in missing}
+        unknown = [ticker for ticker, symbol in remembered.items() if symbol is None]
+        indexed = await ayahoo_symbols(unknown) if unknown else {}
+        await _aremember_symbols(indexed, [ticker for ticker in unknown if ticker not in indexed])
+        resolved.update(_merge_resolved(remembered, indexed))
+    return resolved
+
+_aremember_symbols = db_sync_to_async(_remember_symbols)
+
+async def _astore_history(cache_key, data):
+    """
+    Async version of _store_history, failures included.
+    """
+    if data is None:
+        await cache.aset(f"{cache_key}_failed", data, timeout=FAILURE_TTL)
+        return None
+    data, entries = _history_entries(cache_key, data)
+    await cache.aset_many(entries, timeout=STALE_TTL)
+    return data
+
+async def aget_quote(ticker):
+    """
+    Async version of get_quote.
+    """
+    ticker = normalize_ticker(ticker)
+    symbol = (await aresolve_symbols([ticker])).get(ticker)
+    await _async_l1()
+    return await _acached_fetch(f"quote_{symbol or ticker}", lambda: _aload_quote(ticker, symbol), QUOTE_TTL, _quotes_l1)
+
+async def aget_quotes(tickers):
+    """
+    Async version of get_quotes: one get_many for the hits, concurrent fetches for the misses.
+    """
+    symbols = await aresolve_symbols(tickers)
+    if not symbols:
+        return {}
+    
+    keys = {}
+    for ticker, symbol in symbols.items():
+        keys.setdefault(f"quote_{symbol or ticker}", []).append(ticker)
+    await _async_l1()
+    entries = {}
+    for key in keys:
+        entry = _quotes_l1.get(key)
+        if entry is not None:
+            entries[key] = entry
+    l2_keys = [key for key in keys if key not in entries]
+    if l2_keys:
+        found = await cache.aget_many(l2_keys)
+        for key, entry in found.items():
+            _quotes_l1.set(key, entry)
+        entries.update(found)
+    
+    results = {}
+    for key, entry in entries.items():
+        for ticker in keys[key]:
+            results[ticker] = entry['value']
+        if _is_stale(entry, QUOTE_TTL):
+            metrics.cache_lookup(key, 'stale')
+            ticker = keys[key][0]
+            await _arevalidate(key, lambda ticker=ticker: _aload_quote(ticker, symbols[ticker]))
+        else:
+            metrics.cache_lookup(key, 'hit')
+    
+    missing = [ticker for ticker in symbols if ticker not in results]
+    if missing:
+        quotes = await asyncio.gather(*(aget_quote(ticker) for ticker in missing))
+        results.update(zip(missing, quotes))
+    
+    return results
+
+async def aget_stock_info(ticker):
+    """
+    Fetch the quote plus the company profile and fundamental indicators of a ticker, for the detail page.
+    """
+    quote = await aget_quote(ticker)
+    if not quote['valid']:
+        return quote
+    return _merge_fundamentals(quote, await aget_fundamentals(quote['ticker']))
+
+async def aget_fundamentals(symbol):
+    """
+    Async version of get_fundamentals. The blocking yfinance info call runs on the bounded
+    fundamentals executor.
+    """
+    profile = await StockProfile.objects.filter(symbol=symbol).afirst()
+    if _fundamentals_due(profile):
+        profile = await _async_fundamentals(symbol) or profile
+    return _fundamentals_dict(profile)
+
+_async_fundamentals = db_sync_to_async(_sync_fundamentals, executor=_fundamentals_executor)
+
+async def aget_ttm_dividends(symbol):
+    """
+    Async version of get_ttm_dividends, downloading through the async upstream client.
+    """
+    series, params = await db_sync_to_async(_dividend_state)(symbol)
+    if params is not None:
+        series = await _async_dividends(symbol, series, params) or series
+    return series.ttm_total if series is not None else None
+
+async def _async_dividends(symbol, series, params):
+    """
+    Async version of _sync_dividends.
+    """
+    try:
+        with metrics.upstream_call('dividends', symbol):
+            response = await upstream.aget(YAHOO_CHART_URL.format(symbol), params=params)
+        payload = response.json()
+    except Exception as e:
+        print(f"Error fetching dividends for {symbol}: {e}")
+        return None
+    return await db_sync_to_async(_save_dividends)(symbol, series, payload)
+
+async def _aload_quote(ticker, symbol):
+    misses = []
+    for candidate in _candidate_symbols(ticker, symbol):
+        quote = await _afetch_quote_from_yf(candidate)
+        if quote['valid']:
+            if symbol is None:
+                await _aremember_symbols({ticker: candidate})
+            break
+        misses.append(quote.get('not_found', False))
+    else:
+        quote['not_found'] = all(misses)
+    await db_sync_to_async(_store_quote)(symbol or ticker, quote)
+    return quote
+
+async def _afetch_quote_from_yf(symbol):
+    try:
+        with metrics.upstream_call('quote', symbol):
+            response = await upstream.aget(YAHOO_CHART_URL.format(symbol), params={'range': '1d', 'interval': '1d'})
+        quote = _parse_quote(symbol, response.json())
+        if quote['valid']:
+            # From the dividend store (DB, synced daily)
+            quote['dividend_yield'] = _dividend_yield(await aget_ttm_dividends(symbol), quote['price'])
+        return quote
+    except Exception as e:
+        print(f"Error fetching {symbol}: {e}")
+        return {'ticker': symbol, 'valid': False}
+
+async def aget_historical_payload(ticker, period='1mo', interval=None, points=None):
+    """
+    Async version of get_historical_payload.
+    """
+    ticker = normalize_ticker(ticker)
+    symbol = (await aresolve_symbols([ticker])).get(ticker)
+    interval = interval or default_interval(period)
+    cache_key = f"hist_{symbol or ticker}_{period}_{interval}"
+    if points:
+        return await _acached_fetch(
+            f"{cache_key}_p{points}",
+            lambda: _aload_downsampled_history(symbol or ticker, period, interval, points),
+            HIST_TTL
+        )
+    return await _acached_fetch(cache_key, lambda: _aload_historical_data(ticker, symbol, period, interval), HIST_TTL)
+
+async def aget_history_validators(ticker, period='1mo', interval=None, points=None):
+    """
+    {'etag', 'fetched_at'} of the payload aget_historical_payload would return, read without the
+    payload itself. None when it isn't cached or is stale (the payload then has to be read, which
+    revalidates it).
+    """
+    ticker = normalize_ticker(ticker)
+    symbol = (await aresolve_symbols([ticker])).get(ticker)
+    interval = interval or default_interval(period)
+    cache_key = f"hist_{symbol or ticker}_{period}_{interval}" + (f"_p{points}" if points else '')
+    validators = await cache.aget(f"{cache_key}_validators")
+    if validators is None or _is_stale(validators, HIST_TTL):
+        return None
+    return validators
+
+async def _aload_historical_data(ticker, symbol, period, interval):
+    data, series = None, None
+    try:
+        plan = await db_sync_to_async(_plan_price_sync)(ticker, symbol, period, interval)
+        df, fetched_symbol = None, None
+        for fetched_symbol, params in plan['fetches']:
+            df = await _afetch_bars(fetched_symbol, interval, **params)
+            if df is not None:
+                break
+        refetch = _readjust_fetch(plan, df, fetched_symbol)
+        if refetch is not None:
+            df = await _afetch_bars(refetch[0], interval, **refetch[1])
+            plan['readjusted'] = df is not None
+        if df is not None and symbol is None:
+            await _aremember_symbols({ticker: fetched_symbol})
+        series = await db_sync_to_async(_apply_price_sync)(plan, df, fetched_symbol)
+        data = await db_sync_to_async(_build_history_payload)(series, period, interval)
+    except Exception as e:
+        print(f"Error loading historical data for {ticker}: {e}")
+    
+    data = await _astore_history(f"hist_{symbol or ticker}_{period}_{interval}", data)
+    if data is not None and series.ticker != (symbol or ticker):
+        await _astore_history(f"hist_{series.ticker}_{period}_{interval}", data)
+    return data
+
+async def _aload_downsampled_history(ticker, period, interval, points):
+    payload = await aget_historical_payload(ticker, period, interval)
+    data = _downsample_payload(payload, period, interval, points)
+    return await _astore_history(f"hist_{ticker}_{period}_{interval}_p{points}", data)
+
+async def _afetch_bars(symbol, interval, period=None, start=None):
+    """
+    Async version of _fetch_bars.
+    """
+    try:
+        with metrics.upstream_call('history', symbol):
+            response = await upstream.aget(YAHOO_CHART_URL.format(symbol), params=_chart_params(interval, period, start))
+        return _chart_frame(response.json(), interval)
     except Exception as e:
-        print(f"Error fetching historical data for {ticker}: {e}")
+        print(f"Error fetching historical data for {symbol}: {e}")
         return None
@@ -94,3 +94,107 @@ async function toggleFavorite(button) {
         showToast('Erro de conexão.', 'error');
     }
 }
+
+// Live quotes: every element with data-quote-ticker gets its price/change refreshed from the SSE stream.
+// A stream takes at most QUOTE_STREAM_MAX_TICKERS tickers (views.MAX_STREAM_TICKERS), larger pages
+// open one per slice. A stream the server refuses or drops for good falls back to polling the quote API.
+const QUOTE_STREAM_MAX_TICKERS = 30;
+const QUOTE_POLL_INTERVAL = 60000;
+
+function applyQuote(quote) {
+    document.querySelectorAll(`[data-quote-ticker="${quote.ticker}"]`).forEach(el => {
+        const priceEl = el.querySelector('[data-quote-price]');
+        if (priceEl && quote.price != null) {
+            const label = el.getAttribute('data-quote-currency-label') || quote.currency;
+            priceEl.textContent = `${label} ${Number(quote.price).toFixed(2)}`;
+        }
+
+        const changeEl = el.querySelector('[data-quote-change]');
+        if (changeEl && quote.change_pct != null) {
+            const up = quote.change_pct >= 0;
+            changeEl.textContent = `${up ? '+' : ''}${Number(quote.change_pct).toFixed(2)}%`;
+            changeEl.classList.toggle('change-up', up);
+            changeEl.classList.toggle('change-down', !up);
+        }
+    });
+}
+
+function pollQuotes(tickers) {
+    const poll = () => tickers.forEach(async ticker => {
+        try {
+            const response = await fetch(`/api/stock/${encodeURIComponent(ticker)}/quote/`);
+            if (!response.ok) return;
+            // Elements are keyed by the ticker as the page spells it, the API answers with the Yahoo symbol
+            applyQuote({ ...(await response.json()), ticker });
+        } catch (error) {
+            console.error('Quote poll failed:', error);
+        }
+    });
+    poll();
+    setInterval(poll, QUOTE_POLL_INTERVAL);
+}
+
+function openQuoteStream(tickers) {
+    const source = new EventSource(`/api/stream/quotes/?tickers=${encodeURIComponent(tickers.join(','))}`);
+
+    source.onmessage = event => JSON.parse(event.data).forEach(applyQuote);
+
+    source.onerror = () => {
+        // CONNECTING means the browser is already retrying, CLOSED that it gave up (e.g. a 400)
+        if (source.readyState !== EventSource.CLOSED) return;
+        console.error(`Quote stream closed for ${tickers.join(',')}, polling instead.`);
+        pollQuotes(tickers);
+    };
+}
+
+function startQuoteStream() {
+    const elements = document.querySelectorAll('[data-quote-ticker]');
+    if (elements.length === 0) return;
+
+    const tickers = [...new Set([...elements].map(el => el.getAttribute('data-quote-ticker')))];
+    for (let start = 0; start < tickers.length; start += QUOTE_STREAM_MAX_TICKERS) {
+        const slice = tickers.slice(start, start + QUOTE_STREAM_MAX_TICKERS);
+        if ('EventSource' in window) {
+            openQuoteStream(slice);
+        } else {
+            pollQuotes(slice);
+        }
+    }
+}
+
+document.addEventListener('DOMContentLoaded', startQuoteStream);
+
+// Ticker autocomplete: fills the search box's datalist from the local ticker index
+function startTickerSuggest() {
+    const input = document.querySelector('[data-suggest-url]');
+    if (!input) return;
+
+    const list = document.getElementById(input.getAttribute('list'));
+    let timer = null;
+    let controller = null;
+
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        const query = input.value.trim();
+        if (query.length < 2) return;
+
+        timer = setTimeout(async () => {
+            if (controller) controller.abort();
+            controller = new AbortController();
+            try {
+                const response = await fetch(`${input.getAttribute('data-suggest-url')}?q=${encodeURIComponent(query)}`, { signal: controller.signal });
+                const data = await response.json();
+                list.replaceChildren(...data.results.map(result => {
+                    const option = document.createElement('option');
+                    option.value = result.symbol;
+                    option.label = result.name;
+                    return option;
+                }));
+            } catch (error) {
+                if (error.name !== 'AbortError') console.error('Error:', error);
+            }
+        }, 150);
+    });
+}
+
+document.addEventListener('DOMContentLoaded', startTickerSuggest);
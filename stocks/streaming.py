@@ -0,0 +1,99 @@
+"""
+Live quote streaming over Server-Sent Events (served through stock_system/asgi.py).
+
+A single QuoteHub per process polls every ticker that somebody is subscribed to once per tick and
+fans the changed quotes out to all connected clients, so the polling load grows with the number of
+distinct tickers instead of users x tickers.
+"""
+import asyncio
+import json
+from .db import db_sync_to_async
+from .services import get_quotes
+
+STREAM_TICK = 15  # Seconds between two polls of the subscribed tickers
+STREAM_KEEPALIVE = 25  # Idle clients get a comment line so proxies keep the connection open
+STREAM_QUEUE_SIZE = 20  # Pending updates per client before the oldest ones are dropped
+
+
+class QuoteHub:
+    def __init__(self):
+        self.subscribers = {}  # queue -> set of tickers it watches
+        self.last_quotes = {}  # ticker -> last published quote
+        self.task = None
+
+    async def events(self, tickers):
+        """
+        Async generator of SSE frames for one client. Unsubscribes when the client goes away.
+        """
+        queue = self.subscribe(tickers)
+        try:
+            yield "retry: 10000\n\n"
+            while True:
+                try:
+                    quotes = await asyncio.wait_for(queue.get(), timeout=STREAM_KEEPALIVE)
+                    yield f"data: {json.dumps(quotes)}\n\n"
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+    def subscribe(self, tickers):
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.subscribers[queue] = set(tickers)
+
+        # Late subscribers get the quotes we already know right away
+        known = [self.last_quotes[t] for t in tickers if t in self.last_quotes]
+        if known:
+            queue.put_nowait(known)
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.pop(queue, None)
+
+    async def run(self):
+        while self.subscribers:
+            tickers = set().union(*self.subscribers.values())
+            try:
+                infos = await db_sync_to_async(get_quotes)(sorted(tickers))
+            except Exception as e:
+                print(f"Quote stream poll failed: {e}")
+                infos = {}
+
+            changed = {}
+            for ticker, info in infos.items():
+                if not info.get('valid'):
+                    continue
+                quote = {
+                    'ticker': ticker,
+                    'price': info.get('price'),
+                    'change_pct': info.get('change_pct'),
+                    'currency': info.get('currency'),
+                }
+                if self.last_quotes.get(ticker) != quote:
+                    self.last_quotes[ticker] = quote
+                    changed[ticker] = quote
+
+            # Forget tickers nobody watches anymore
+            for ticker in list(self.last_quotes):
+                if ticker not in tickers:
+                    del self.last_quotes[ticker]
+
+            for queue, watched in list(self.subscribers.items()):
+                quotes = [changed[t] for t in watched if t in changed]
+                if quotes:
+                    self._offer(queue, quotes)
+
+            await asyncio.sleep(STREAM_TICK)
+
+    @staticmethod
+    def _offer(queue, quotes):
+        # Slow clients only need the latest prices, drop the oldest pending update
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(quotes)
+
+
+hub = QuoteHub()
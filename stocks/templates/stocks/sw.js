@@ -1,12 +1,19 @@
-const CACHE_NAME = 'marketpro-v1';
-const ASSETS_TO_CACHE = [
-    '/',
-    '/static/stocks/css/style.css',
-    '/static/stocks/js/main.js',
-    '/search/',
-    '/portfolio/',
+// Rendered by stocks.views.service_worker: the version and precache list follow the static files manifest
+const CACHE_VERSION = '{{ cache_version }}';
+const CACHE_NAME = `marketpro-${CACHE_VERSION}`;
+// Chart data outlives deploys, bump this when the history payload format changes
+const DATA_CACHE_NAME = 'marketpro-data-v1';
+const ASSETS_TO_CACHE = {{ precache_urls|safe }}.concat([
     'https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap'
-];
+]);
+const STATIC_URL = {{ static_url|safe }};
+
+// Seconds a cached history response is served as is, per period. Past that it is served stale
+// while a fresh copy is fetched, for up to HISTORY_STALE_FACTOR times as long.
+const HISTORY_MAX_AGE = {{ history_max_age|safe }};
+const HISTORY_STALE_FACTOR = 24;
+const HISTORY_MAX_ENTRIES = 100;
+const HISTORY_PATH = /^\/api\/stock\/[^/]+\/history\/$/;
 
 // Install Event
 self.addEventListener('install', event => {
@@ -15,12 +22,13 @@ self.addEventListener('install', event => {
             .then(cache => {
                 return cache.addAll(ASSETS_TO_CACHE);
             })
+            .then(() => self.skipWaiting())
     );
 });
 
 // Activate Event
 self.addEventListener('activate', event => {
-    const cacheWhitelist = [CACHE_NAME];
+    const cacheWhitelist = [CACHE_NAME, DATA_CACHE_NAME];
     event.waitUntil(
         caches.keys().then(cacheNames => {
             return Promise.all(
@@ -30,29 +38,100 @@ self.addEventListener('activate', event => {
                     }
                 })
             );
-        })
+        }).then(() => self.clients.claim())
     );
 });
 
-// Fetch Event (Network First, fallback to cache)
+// Fetch Event
 self.addEventListener('fetch', event => {
     // Only cache GET requests
     if (event.request.method !== 'GET') return;
 
-    // Ignore API and admin routes for caching
-    if (event.request.url.includes('/api/') || event.request.url.includes('/admin/')) return;
+    const url = new URL(event.request.url);
+    const sameOrigin = url.origin === self.location.origin;
+
+    // Chart data: cache with per-period max-age and stale-while-revalidate
+    if (sameOrigin && HISTORY_PATH.test(url.pathname)) {
+        event.respondWith(historyResponse(event, url));
+        return;
+    }
+
+    // Ignore the other API and admin routes
+    if (url.pathname.startsWith('/api/') || url.pathname.startsWith('/admin/')) return;
 
+    // Hashed static files never change: cache first
+    if (sameOrigin && url.pathname.startsWith(STATIC_URL)) {
+        event.respondWith(
+            caches.match(event.request).then(cached => cached || fetchAndCache(CACHE_NAME, event.request))
+        );
+        return;
+    }
+
+    // Pages: network first, fallback to cache
     event.respondWith(
-        fetch(event.request)
-            .then(networkResponse => {
-                const responseClone = networkResponse.clone();
-                caches.open(CACHE_NAME).then(cache => {
-                    cache.put(event.request, responseClone);
-                });
-                return networkResponse;
-            })
+        fetchAndCache(CACHE_NAME, event.request)
             .catch(() => {
                 return caches.match(event.request);
             })
     );
 });
+
+async function fetchAndCache(cacheName, request) {
+    const networkResponse = await fetch(request);
+    if (networkResponse.ok) {
+        const responseClone = networkResponse.clone();
+        caches.open(cacheName).then(cache => {
+            cache.put(request, responseClone);
+        });
+    }
+    return networkResponse;
+}
+
+async function historyResponse(event, url) {
+    const period = url.searchParams.get('period') || '1mo';
+    const maxAge = (HISTORY_MAX_AGE[period] || HISTORY_MAX_AGE['1mo']) * 1000;
+    const cache = await caches.open(DATA_CACHE_NAME);
+    const cached = await cache.match(event.request);
+
+    if (cached) {
+        const age = Date.now() - Number(cached.headers.get('sw-fetched-at') || 0);
+        if (age < maxAge) {
+            return cached;
+        }
+        if (age < maxAge * HISTORY_STALE_FACTOR) {
+            event.waitUntil(refreshHistory(cache, event.request).catch(() => {}));
+            return cached;
+        }
+    }
+
+    try {
+        return await refreshHistory(cache, event.request);
+    } catch (error) {
+        // Offline: an old chart beats no chart
+        if (cached) return cached;
+        throw error;
+    }
+}
+
+async function refreshHistory(cache, request) {
+    const networkResponse = await fetch(request);
+    if (networkResponse.ok) {
+        // Cached copies carry their fetch time, the Cache API doesn't keep one
+        const headers = new Headers(networkResponse.headers);
+        headers.set('sw-fetched-at', Date.now().toString());
+        const body = await networkResponse.clone().blob();
+        await cache.put(request, new Response(body, {
+            status: networkResponse.status,
+            statusText: networkResponse.statusText,
+            headers: headers
+        }));
+        await trimCache(cache, HISTORY_MAX_ENTRIES);
+    }
+    return networkResponse;
+}
+
+async function trimCache(cache, maxEntries) {
+    // Keys come back in insertion order, the oldest go first
+    const keys = await cache.keys();
+    await Promise.all(keys.slice(0, Math.max(0, keys.length - maxEntries)).map(key => cache.delete(key)));
+}
@@ -0,0 +1,30 @@
+"""
+Test runner (settings.TEST_RUNNER).
+"""
+import os
+import shutil
+import tempfile
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    DiscoverRunner whose SQLite test databases are files in a private temporary directory, removed
+    afterwards. The default in-memory database answers concurrent writers with "table is locked"
+    right away, only a file makes them wait for the lock (see settings.DATABASES), like the
+    concurrency tests expect.
+    """
+    def setup_databases(self, **kwargs):
+        self.test_dir = tempfile.mkdtemp(prefix='stocks_test_')
+        for alias in connections:
+            settings_dict = connections[alias].settings_dict
+            if settings_dict['ENGINE'] == 'django.db.backends.sqlite3' and not settings_dict['TEST'].get('NAME'):
+                settings_dict['TEST']['NAME'] = os.path.join(self.test_dir, f"{alias}.sqlite3")
+        return super().setup_databases(**kwargs)
+
+    def teardown_databases(self, old_config, **kwargs):
+        try:
+            super().teardown_databases(old_config, **kwargs)
+        finally:
+            shutil.rmtree(self.test_dir, ignore_errors=True)
@@ -1,3 +1,1303 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import pickle
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from . import analytics, benchmark, fragments, imports, metrics, services, streaming, tickers, upstream, views
+from .ledger import MAX_QUANTITY, apply_transactions
+from .management.commands.refresh_market_data import Command as RefreshCommand, get_hot_tickers
+from .models import DividendSeries, Favorite, PortfolioItem, PortfolioSnapshot, PortfolioTransaction, PriceBar, PriceSeries, StockProfile, TickerSymbol, UpstreamCounter
+from .valuation import apply_quotes, save_snapshot, set_item_quantities, set_item_quantity, value_item
 
-# Create your tests here.
+
+# Pages render without running collectstatic
+PLAIN_STATIC = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
+
+
+def quote(ticker, price, dividend_yield=0.0):
+    return {
+        'ticker': ticker, 'name': f"{ticker} S.A.", 'price': price, 'currency': 'BRL',
+        'change_pct': 0.0, 'valid': True, 'dividend_yield': dividend_yield, 'fetched_at': time.time(),
+    }
+
+
+def clear_caches():
+    cache.clear()
+    services._quotes_l1.clear()
+    services._aliases_l1.clear()
+
+
+class BatchQuoteTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        services._remember_symbols({'PETR4': 'PETR4.SA', 'VALE3': 'VALE3.SA'})
+
+    def test_hits_are_read_and_misses_fetched_once(self):
+        services._store('quote_VALE3.SA', quote('VALE3.SA', 60.0))
+
+        with mock.patch('stocks.services._fetch_quote', side_effect=lambda ticker, symbol: quote(symbol, 30.0)) as fetch:
+            quotes = services.get_quotes(['petr4', 'PETR4.SA', 'VALE3'])
+
+        # Both spellings of PETR4 share one fetch
+        fetch.assert_called_once()
+        self.assertEqual(fetch.call_args.args[1], 'PETR4.SA')
+        self.assertEqual({ticker: info['price'] for ticker, info in quotes.items()}, {'PETR4': 30.0, 'PETR4.SA': 30.0, 'VALE3': 60.0})
+        # Stored for the next batch
+        self.assertEqual(cache.get('quote_PETR4.SA')['value']['price'], 30.0)
+
+    def test_failures_are_cached(self):
+        with mock.patch('stocks.services._fetch_quote', return_value={'ticker': 'XXXX11', 'valid': False}) as fetch:
+            services.get_quotes(['XXXX11'])
+            quotes = services.get_quotes(['XXXX11'])
+
+        fetch.assert_called_once()
+        self.assertFalse(quotes['XXXX11']['valid'])
+
+
+class RefresherTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        for number, tickers in enumerate([['PETR4.SA', 'vale3.sa'], ['VALE3.SA'], ['VALE3.SA', 'ITUB4.SA']]):
+            user = User.objects.create_user(f"holder{number}")
+            for ticker in tickers:
+                Favorite.objects.create(user=user, ticker=ticker)
+        # Favorite and holding of the same user count once
+        PortfolioItem.objects.create(user=user, ticker='VALE3.SA', quantity=1)
+
+    def test_hot_tickers_by_holders(self):
+        tickers = get_hot_tickers()
+
+        self.assertEqual(tickers[0], 'VALE3.SA')
+        self.assertEqual(sorted(tickers[1:]), ['ITUB4.SA', 'PETR4.SA'])
+
+    def test_cycle_overwrites_quotes(self):
+        services._store('quote_VALE3.SA', quote('VALE3.SA', 60.0))
+        fetched = lambda symbols: {ticker: quote(ticker, 70.0) for ticker in symbols}
+
+        with mock.patch('stocks.services._fetch_quotes', side_effect=fetched), mock.patch('stocks.services.resolve_symbols', side_effect=lambda tickers: {t: t for t in tickers}):
+            RefreshCommand(stdout=io.StringIO()).refresh_cycle(batch_size=2)
+
+        self.assertEqual(services.get_quote('VALE3.SA')['price'], 70.0)
+        self.assertIsNotNone(cache.get('quote_ITUB4.SA'))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_concurrent_misses_load_once(self):
+        loads = []
+        started = threading.Event()
+
+        def load():
+            loads.append(1)
+            started.set()
+            time.sleep(0.1)
+            services._store('quote_TEST', 42)
+            return 42
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(services._single_flight('quote_TEST', load))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(results, [42] * 8)
+        # The per-key lock is dropped by its last user
+        self.assertEqual(services._inflight_locks, {})
+
+    def test_waits_for_another_process(self):
+        cache.add('lease_quote_TEST', 1)
+        threading.Timer(0.2, lambda: services._store('quote_TEST', 7)).start()
+        load = mock.Mock()
+
+        self.assertEqual(services._single_flight('quote_TEST', load), 7)
+        load.assert_not_called()
+
+    def test_loads_itself_when_the_other_fetch_died(self):
+        cache.add('lease_quote_TEST', 1)
+        threading.Timer(0.2, lambda: cache.delete('lease_quote_TEST')).start()
+
+        self.assertEqual(services._single_flight('quote_TEST', lambda: 3), 3)
+
+
+class StaleWhileRevalidateTests(SimpleTestCase):
+    def setUp(self):
+        clear_caches()
+        # Background refreshes run inline
+        patcher = mock.patch.object(services._refresh_executor, 'submit', side_effect=lambda fn: fn())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def store(self, value, age):
+        cache.set('quote_TEST', {'value': value, 'fetched_at': time.time() - age})
+
+    def test_fresh_entry_is_served_without_loading(self):
+        self.store('cached', 0)
+        load = mock.Mock()
+
+        self.assertEqual(services._cached_fetch('quote_TEST', load, ttl=60), 'cached')
+        load.assert_not_called()
+
+    def test_stale_entry_is_served_and_revalidated(self):
+        self.store('stale', 120)
+
+        def load():
+            services._store('quote_TEST', 'new')
+
+        self.assertEqual(services._cached_fetch('quote_TEST', load, ttl=60), 'stale')
+        self.assertEqual(services._cached_fetch('quote_TEST', load, ttl=60), 'new')
+        self.assertIsNone(cache.get('lease_quote_TEST'))
+
+    def test_failed_refresh_keeps_the_stale_value(self):
+        self.store('stale', 120)
+        cache.set('quote_TEST_failed', None)
+        load = mock.Mock()
+
+        self.assertEqual(services._cached_fetch('quote_TEST', load, ttl=60), 'stale')
+        load.assert_not_called()
+
+    def test_one_refresh_at_a_time(self):
+        self.store('stale', 120)
+        cache.add('lease_quote_TEST', 1)
+        load = mock.Mock()
+
+        services._cached_fetch('quote_TEST', load, ttl=60)
+        load.assert_not_called()
+
+
+class LocalCacheTests(SimpleTestCase):
+    def setUp(self):
+        clear_caches()
+        services._quotes_l1.version = None
+        services._quotes_l1.next_log_check = 0.0
+        self.addCleanup(clear_caches)
+
+    def fill(self):
+        services._sync_l1()
+        for ticker in ('PETR4.SA', 'VALE3.SA'):
+            services._quotes_l1.set(f"quote_{ticker}", {'value': quote(ticker, 10.0), 'fetched_at': time.time()})
+
+    def publish_from_another_process(self, keys):
+        with mock.patch.object(services, '_quotes_l1', services.LocalCache()):
+            services._publish_quote_keys(keys)
+        services._quotes_l1.next_log_check = 0.0
+
+    def test_values_are_copied_in_and_out(self):
+        value = quote('PETR4.SA', 10.0)
+        services._quotes_l1.set('quote_PETR4.SA', {'value': value, 'fetched_at': time.time()})
+        value['price'] = 1.0
+        services._quotes_l1.get('quote_PETR4.SA')['value']['color'] = 'red'
+
+        cached = services._quotes_l1.get('quote_PETR4.SA')['value']
+        self.assertEqual(cached['price'], 10.0)
+        self.assertNotIn('color', cached)
+
+    def test_other_writes_drop_only_their_keys(self):
+        self.fill()
+        self.publish_from_another_process(['quote_PETR4.SA'])
+
+        services._sync_l1()
+        self.assertIsNone(services._quotes_l1.get('quote_PETR4.SA'))
+        self.assertIsNotNone(services._quotes_l1.get('quote_VALE3.SA'))
+
+    def test_own_writes_keep_the_l1(self):
+        self.fill()
+        services._publish_quote_keys(['quote_PETR4.SA'])
+        services._quotes_l1.next_log_check = 0.0
+
+        services._sync_l1()
+        self.assertIsNotNone(services._quotes_l1.get('quote_PETR4.SA'))
+        self.assertIsNotNone(services._quotes_l1.get('quote_VALE3.SA'))
+
+    def test_expired_log_drops_everything(self):
+        self.fill()
+        self.publish_from_another_process(['quote_PETR4.SA'])
+        cache.delete(services._log_key(cache.get(services.L1_LOG_KEY)))
+
+        services._sync_l1()
+        self.assertIsNone(services._quotes_l1.get('quote_VALE3.SA'))
+
+
+class QuoteStreamTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(streaming, 'STREAM_TICK', 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fans_out_changed_quotes(self):
+        prices = iter([10.0, 10.0, 11.0])
+
+        def get_quotes(tickers):
+            price = next(prices, 11.0)
+            return {ticker: quote(ticker, price) for ticker in tickers}
+
+        async def listen():
+            hub = streaming.QuoteHub()
+            first, second = hub.events(['PETR4.SA']), hub.events(['PETR4.SA', 'VALE3.SA'])
+            self.assertEqual(await anext(first), 'retry: 10000\n\n')
+            await anext(second)
+            frames = [await anext(first), await anext(first), await anext(second)]
+            # Both subscriptions are served by the same polls
+            self.assertEqual(hub.last_quotes.keys(), {'PETR4.SA', 'VALE3.SA'})
+            await first.aclose()
+            await second.aclose()
+            await asyncio.wait_for(hub.task, 1)
+            return frames
+
+        with mock.patch('stocks.streaming.get_quotes', side_effect=get_quotes) as poll:
+            frames = asyncio.run(listen())
+
+        updates = [json.loads(frame.removeprefix('data: ')) for frame in frames]
+        # The unchanged second poll sends nothing
+        self.assertEqual([[q['price'] for q in update] for update in updates[:2]], [[10.0], [11.0]])
+        self.assertEqual({q['ticker'] for q in updates[2]}, {'PETR4.SA', 'VALE3.SA'})
+        self.assertEqual(poll.call_args_list[0].args, (['PETR4.SA', 'VALE3.SA'],))
+
+    def test_late_subscribers_get_the_known_quotes(self):
+        async def subscribe():
+            hub = streaming.QuoteHub()
+            hub.last_quotes['PETR4.SA'] = {'ticker': 'PETR4.SA', 'price': 10.0}
+            queue = hub.subscribe(['PETR4.SA'])
+            hub.unsubscribe(queue)
+            await hub.task
+            return queue.get_nowait()
+
+        with mock.patch('stocks.streaming.get_quotes', return_value={}):
+            self.assertEqual(asyncio.run(subscribe()), [{'ticker': 'PETR4.SA', 'price': 10.0}])
+
+    def test_view_limits(self):
+        self.assertEqual(self.client.get('/api/stream/quotes/').status_code, 400)
+        tickers = ','.join(f"T{i}" for i in range(views.MAX_STREAM_TICKERS + 1))
+        self.assertEqual(self.client.get(f'/api/stream/quotes/?tickers={tickers}').status_code, 400)
+
+    def test_view_streams_events(self):
+        with mock.patch.object(streaming.hub, 'events', return_value=iter(['retry: 10000\n\n'])) as events:
+            response = self.client.get('/api/stream/quotes/?tickers=petr4.sa,PETR4.SA,vale3.sa')
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        events.assert_called_once_with(['PETR4.SA', 'VALE3.SA'])
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+
+def chart(price, dividends=()):
+    result = {'meta': {'regularMarketPrice': price, 'previousClose': price, 'currency': 'BRL'}}
+    if dividends:
+        result['events'] = {'dividends': {str(date): {'date': date, 'amount': amount} for date, amount in dividends}}
+    return {'chart': {'result': [result], 'error': None}}
+
+
+class DividendStoreTests(TestCase):
+    def setUp(self):
+        self.recent = int(time.time()) - 30 * 86400
+        self.old = int(time.time()) - 400 * 86400
+
+    def sync(self, *dividends):
+        with mock.patch('stocks.upstream.get', return_value=FakeResponse(chart(20.0, dividends))) as get:
+            total = services.get_ttm_dividends('PETR4.SA')
+        return total, get
+
+    def test_first_sync_downloads_the_whole_history(self):
+        total, get = self.sync((self.recent, 0.5), (self.old, 2.0))
+
+        self.assertEqual(total, 0.5)
+        self.assertEqual(get.call_args.kwargs['params']['range'], 'max')
+        self.assertEqual(DividendSeries.objects.get(symbol='PETR4.SA').events.count(), 2)
+
+    def test_synced_series_is_read_without_upstream(self):
+        self.sync((self.recent, 0.5))
+
+        total, get = self.sync()
+        self.assertEqual(total, 0.5)
+        get.assert_not_called()
+
+    def test_due_series_downloads_only_new_events(self):
+        self.sync((self.old, 2.0), (self.recent, 0.5))
+        DividendSeries.objects.update(synced_at=timezone.now() - services.DIVIDEND_SYNC_INTERVAL)
+
+        total, get = self.sync((self.recent + 86400, 0.25))
+        self.assertEqual(total, 0.75)
+        self.assertEqual(get.call_args.kwargs['params']['period1'], self.recent)
+        self.assertNotIn('range', get.call_args.kwargs['params'])
+
+    def test_failed_sync_keeps_the_stored_total(self):
+        self.sync((self.recent, 0.5))
+        DividendSeries.objects.update(synced_at=timezone.now() - services.DIVIDEND_SYNC_INTERVAL)
+
+        with mock.patch('stocks.upstream.get', side_effect=ConnectionError):
+            self.assertEqual(services.get_ttm_dividends('PETR4.SA'), 0.5)
+            # Nothing known about the symbol
+            self.assertIsNone(services.get_ttm_dividends('VALE3.SA'))
+
+
+class FundamentalsTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.info = {'longName': 'Petrobras', 'sector': 'Energy', 'trailingPE': 4.5, 'marketCap': 5e11, 'dividendYield': 0.12}
+        patcher = mock.patch('stocks.services.yf.Ticker')
+        self.ticker = patcher.start()
+        self.addCleanup(patcher.stop)
+        type(self.ticker.return_value).info = mock.PropertyMock(side_effect=lambda: self.info)
+
+    def test_persisted_and_refreshed_once_per_ttl(self):
+        self.assertEqual(services.get_fundamentals('PETR4.SA')['pe_ratio'], 4.5)
+        self.assertEqual(services.get_fundamentals('PETR4.SA')['sector'], 'Energy')
+        self.ticker.assert_called_once()
+
+        StockProfile.objects.update(updated_at=timezone.now() - services.FUNDAMENTALS_TTL)
+        self.info = {**self.info, 'trailingPE': 5.0}
+        self.assertEqual(services.get_fundamentals('PETR4.SA')['pe_ratio'], 5.0)
+
+    def test_failed_refresh_keeps_the_stored_profile(self):
+        services.get_fundamentals('PETR4.SA')
+        StockProfile.objects.update(updated_at=timezone.now() - services.FUNDAMENTALS_TTL)
+        self.info = None
+
+        self.assertEqual(services.get_fundamentals('PETR4.SA')['pe_ratio'], 4.5)
+
+    def test_quotes_do_not_load_fundamentals(self):
+        with mock.patch('stocks.upstream.get', return_value=FakeResponse(chart(20.0))):
+            info = services._fetch_quote_from_yf('PETR4.SA')
+
+        self.assertEqual(info['price'], 20.0)
+        self.ticker.assert_not_called()
+
+    def test_provider_yield_only_without_dividend_history(self):
+        fundamentals = services.get_fundamentals('PETR4.SA')
+
+        self.assertEqual(services._merge_fundamentals(quote('PETR4.SA', 20.0), fundamentals)['dividend_yield'], 0.12)
+        self.assertEqual(services._merge_fundamentals(quote('PETR4.SA', 20.0, 0.05), fundamentals)['dividend_yield'], 0.05)
+
+
+class FragmentInvalidationTests(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_stored_quote_with_the_same_price_keeps_the_cards(self):
+        with mock.patch('stocks.fragments.invalidate_tickers') as invalidate:
+            services._store_quote('PETR4.SA', quote('PETR4.SA', 30.0))
+            invalidate.assert_called_once_with({'PETR4.SA'})
+            invalidate.reset_mock()
+
+            with self.assertNumQueries(0):
+                services._store_quote('PETR4.SA', quote('PETR4.SA', 30.0))
+            invalidate.assert_not_called()
+
+            services._store_quote('PETR4.SA', {**quote('PETR4.SA', 30.0), 'change_pct': 1.5})
+            invalidate.assert_called_once_with({'PETR4.SA'})
+
+    def test_refresh_drops_only_moved_tickers(self):
+        services._store('quote_PETR4.SA', quote('PETR4.SA', 30.0))
+        services._store('quote_VALE3.SA', quote('VALE3.SA', 60.0))
+        fetched = {'PETR4.SA': quote('PETR4.SA', 30.0), 'VALE3.SA': quote('VALE3.SA', 61.0)}
+
+        with mock.patch('stocks.services._fetch_quotes', return_value=fetched), \
+                mock.patch('stocks.services.resolve_symbols', side_effect=lambda tickers: {t: t for t in tickers}), \
+                mock.patch('stocks.fragments.invalidate_tickers') as invalidate:
+            self.assertEqual(set(services.refresh_quotes(['PETR4.SA', 'VALE3.SA'])), {'PETR4.SA', 'VALE3.SA'})
+
+        invalidate.assert_called_once_with({'VALE3.SA'})
+
+    def test_holders_are_found_by_any_spelling(self):
+        user = User.objects.create_user('holder')
+        Favorite.objects.create(user=user, ticker='PETR4')
+
+        with mock.patch('stocks.fragments.invalidate') as invalidate:
+            fragments.invalidate_tickers({'PETR4.SA'})
+
+        invalidate.assert_called_once_with({user.id})
+
+
+class AsyncUpstreamTests(TransactionTestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_quote_syncs_dividends_with_the_async_client(self):
+        recent = int(time.time()) - 30 * 86400
+
+        async def aget(url, params=None, host=None):
+            return FakeResponse(chart(20.0, [(recent, 0.5), (recent - 60 * 86400, 0.5)] if 'events' in params else ()))
+
+        with mock.patch('stocks.upstream.aget', side_effect=aget), mock.patch('stocks.upstream.get') as get:
+            info = asyncio.run(services._afetch_quote_from_yf('PETR4.SA'))
+
+        get.assert_not_called()
+        self.assertAlmostEqual(info['dividend_yield'], 0.05)
+        self.assertEqual(DividendSeries.objects.get(symbol='PETR4.SA').ttm_total, 1.0)
+
+    def test_fundamentals_run_on_their_own_executor(self):
+        threads = []
+
+        class Ticker:
+            def __init__(self, symbol, session=None):
+                pass
+
+            @property
+            def info(self):
+                threads.append(threading.current_thread().name)
+                return {'longName': 'Petrobras', 'sector': 'Energy'}
+
+        with mock.patch('stocks.services.yf.Ticker', Ticker):
+            fundamentals = asyncio.run(services.aget_fundamentals('PETR4.SA'))
+            # Stored, the next read doesn't call upstream
+            asyncio.run(services.aget_fundamentals('PETR4.SA'))
+
+        self.assertEqual(fundamentals['sector'], 'Energy')
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('fundamentals'))
+
+    def test_history_loads_reach_the_database_concurrently(self):
+        barrier = threading.Barrier(2, timeout=2)
+        planned = []
+
+        def plan(ticker, symbol, period, interval):
+            # Breaks when the loads are serialized onto one thread
+            barrier.wait()
+            planned.append(ticker)
+            raise RuntimeError('stop here')
+
+        async def load_both():
+            await asyncio.gather(
+                services._aload_historical_data('AAA', 'AAA', '1mo', '1d'),
+                services._aload_historical_data('BBB', 'BBB', '1mo', '1d'),
+            )
+
+        with mock.patch('stocks.services._plan_price_sync', side_effect=plan):
+            asyncio.run(load_both())
+
+        self.assertEqual(sorted(planned), ['AAA', 'BBB'])
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ledger')
+
+    def holdings(self):
+        return dict(PortfolioItem.objects.filter(user=self.user).values_list('ticker', 'quantity'))
+
+    def entries(self, ticker):
+        return list(PortfolioTransaction.objects.filter(user=self.user, ticker=ticker).values_list('quantity', flat=True))
+
+    def test_sale_of_more_than_held_sells_what_is_held(self):
+        apply_transactions(self.user, [('PETR4.SA', Decimal('10'))])
+        result = apply_transactions(self.user, [('PETR4.SA', Decimal('-15'))])
+
+        self.assertEqual(result, {'PETR4.SA': Decimal('0')})
+        self.assertEqual(self.holdings(), {})
+        self.assertEqual(self.entries('PETR4.SA'), [Decimal('10'), Decimal('-10')])
+
+    def test_rows_are_replayed_in_order(self):
+        result = apply_transactions(self.user, [
+            ('VALE3.SA', Decimal('5')), ('VALE3.SA', Decimal('-8')), ('VALE3.SA', Decimal('3')),
+        ])
+
+        self.assertEqual(result, {'VALE3.SA': Decimal('3')})
+        self.assertEqual(self.holdings(), {'VALE3.SA': Decimal('3')})
+        # The sale is clamped at what was held at that point
+        self.assertEqual(self.entries('VALE3.SA'), [Decimal('5'), Decimal('-5'), Decimal('3')])
+
+    def test_quantity_above_max_rolls_everything_back(self):
+        apply_transactions(self.user, [('ITUB4.SA', MAX_QUANTITY - 1)])
+
+        with self.assertRaises(ValueError):
+            apply_transactions(self.user, [('BBAS3.SA', Decimal('1')), ('ITUB4.SA', Decimal('2'))])
+
+        self.assertEqual(self.holdings(), {'ITUB4.SA': MAX_QUANTITY - 1})
+        self.assertEqual(self.entries('BBAS3.SA'), [])
+        self.assertEqual(len(self.entries('ITUB4.SA')), 1)
+
+
+class ConcurrentLedgerTests(TransactionTestCase):
+    def test_concurrent_changes_add_up(self):
+        user = User.objects.create_user('concurrent')
+        apply_transactions(user, [('PETR4.SA', Decimal('1'))])
+        save_snapshot(user, [])
+        errors = []
+
+        def buy():
+            try:
+                for _ in range(5):
+                    apply_transactions(user, [('PETR4.SA', Decimal('1'))])
+                    set_item_quantity(user, 'PETR4.SA', quote('PETR4.SA', 10.0))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(PortfolioItem.objects.get(user=user, ticker='PETR4.SA').quantity, Decimal('21'))
+        self.assertEqual(PortfolioTransaction.objects.filter(user=user).count(), 21)
+        # Whichever change wrote the snapshot last wrote the final quantity
+        self.assertEqual(PortfolioSnapshot.objects.get(user=user).items[0]['quantity'], 21.0)
+
+
+class ImportParseTests(SimpleTestCase):
+    def parse(self, body, content_type, filename=''):
+        return imports.parse(io.BytesIO(body.encode()), content_type, filename)
+
+    def test_pt_br_csv(self):
+        rows, errors = self.parse('\ufeffTicker;Quantity\npetr4;1.234,5\n\nVALE3;-10\nITUB4;2.5\n', 'text/csv')
+
+        self.assertEqual(errors, [])
+        self.assertEqual(rows, [
+            (2, 'PETR4', Decimal('1234.5000')),
+            (4, 'VALE3', Decimal('-10.0000')),
+            (5, 'ITUB4', Decimal('2.5000')),
+        ])
+
+    def test_csv_without_header(self):
+        rows, errors = self.parse('AAPL,0.1\nMSFT,3\n', 'application/octet-stream', 'carteira.csv')
+
+        self.assertEqual(errors, [])
+        self.assertEqual([(ticker, quantity) for _, ticker, quantity in rows], [('AAPL', Decimal('0.1000')), ('MSFT', Decimal('3.0000'))])
+
+    def test_ndjson_reports_bad_lines(self):
+        body = '{"ticker": "PETR4", "quantity": 10}\nnot json\n["PETR4", 1]\n{"ticker": "VALE3", "quantity": 0}\n'
+        rows, errors = self.parse(body, 'application/x-ndjson')
+
+        self.assertEqual(rows, [(1, 'PETR4', Decimal('10.0000'))])
+        self.assertEqual([error['line'] for error in errors], [2, 3, 4])
+
+    def test_json_document(self):
+        body = json.dumps({'transactions': [{'ticker': 'petr4', 'quantity': 0.1}, {'ticker': 'VALE3', 'quantity': '-2'}]})
+        rows, errors = self.parse(body, 'application/json')
+
+        self.assertEqual(errors, [])
+        self.assertEqual(rows, [(1, 'PETR4', Decimal('0.1000')), (2, 'VALE3', Decimal('-2.0000'))])
+
+    def test_invalid_quantities(self):
+        body = json.dumps([{'ticker': 'PETR4', 'quantity': 'abc'}, {'ticker': 'VALE3', 'quantity': 'NaN'}, {'ticker': 'ITUB4', 'quantity': 10 ** 7}])
+        rows, errors = self.parse(body, 'application/json')
+
+        self.assertEqual(rows, [])
+        self.assertEqual([error['line'] for error in errors], [1, 2, 3])
+
+    def test_limits(self):
+        rows, errors = self.parse(''.join(f'T{i},1\n' for i in range(imports.MAX_IMPORT_ROWS + 1)), 'text/csv')
+        self.assertEqual(errors[-1]['line'], imports.MAX_IMPORT_ROWS + 1)
+
+        rows, errors = self.parse('', 'text/csv')
+        self.assertEqual(len(errors), 1)
+
+        rows, errors = self.parse('PETR4 10', 'application/pdf', 'carteira.pdf')
+        self.assertEqual(rows, [])
+        self.assertEqual(errors[0]['line'], 0)
+
+
+class HistoryPayloadTests(TestCase):
+    def test_columns_from_the_bar_store(self):
+        now = timezone.now()
+        series = PriceSeries.objects.create(ticker='PETR4.SA', interval='1d', symbol='PETR4.SA', timezone='America/Sao_Paulo', synced_at=now)
+        for days, close in ((3, 10.123456), (2, 11.0), (1, 12.5)):
+            PriceBar.objects.create(series=series, timestamp=now - timedelta(days=days), close=close)
+
+        payload = services._build_history_payload(series, '1mo', '1d')
+        columns = json.loads(payload['json'])
+
+        self.assertEqual((columns['period'], columns['interval']), ('1mo', '1d'))
+        self.assertEqual(columns['close'], [10.1235, 11.0, 12.5])
+        self.assertEqual(len(columns['dates']), 3)
+        self.assertEqual(columns['timestamps'], sorted(columns['timestamps']))
+        # Same bytes, same ETag
+        self.assertEqual(payload['etag'], services._build_history_payload(series, '1mo', '1d')['etag'])
+
+    def test_empty_slice(self):
+        series = PriceSeries.objects.create(ticker='PETR4.SA', interval='1d', symbol='PETR4.SA', synced_at=timezone.now())
+
+        self.assertIsNone(services._build_history_payload(series, '1mo', '1d'))
+
+    def test_safe_inside_a_script_tag(self):
+        payload = services._encode_history('1mo', '1d', {'dates': ['</script><b>&'], 'close': [1.0]})
+
+        self.assertNotIn(b'<', payload['json'])
+        self.assertNotIn(b'&', payload['json'])
+        self.assertEqual(json.loads(payload['json'])['dates'], ['</script><b>&'])
+
+
+class HistoryBatchTests(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def store_history(self, ticker, closes):
+        dates = ['2026-10-14', '2026-10-15', '2026-10-16'][-len(closes):]
+        payload = services._encode_history('1mo', '1d', {'dates': dates, 'timestamps': list(range(len(closes))), 'close': closes})
+        services._store_history(f"hist_{ticker}_1mo_1d", payload)
+
+    def test_series_are_aligned_on_one_axis(self):
+        self.store_history('AAA', [1.0, 2.0, 3.0])
+        self.store_history('BBB', [5.0, 6.0])
+
+        with mock.patch('stocks.services._load_historical_data', return_value=None):
+            response = self.client.get('/api/history/?tickers=aaa,BBB,AAA,CCC&period=1mo')
+        history = json.loads(response.content)
+        self.assertEqual(history['dates'], ['2026-10-14', '2026-10-15', '2026-10-16'])
+        self.assertEqual(history['series'], {'AAA': [1.0, 2.0, 3.0], 'BBB': [None, 5.0, 6.0]})
+        self.assertEqual(history['missing'], ['CCC'])
+
+    def test_more_tickers_than_one_batch(self):
+        tickers = [f"T{i:03d}" for i in range(services.HISTORY_BATCH_SIZE * 2 + 5)]
+        for ticker in tickers:
+            self.store_history(ticker, [1.0, 2.0, 3.0])
+
+        with mock.patch('stocks.services.get_historical_payloads', wraps=services.get_historical_payloads) as load:
+            df, _ = services.get_close_matrix(tickers, '1mo')
+
+        self.assertEqual(sorted(df.columns), tickers)
+        self.assertEqual(load.call_count, 3)
+
+    def test_view_limits_tickers(self):
+        tickers = [f"T{i:03d}" for i in range(views.MAX_HISTORY_TICKERS + 1)]
+
+        with mock.patch('stocks.services.get_historical_payloads') as load:
+            response = self.client.get(f"/api/history/?tickers={','.join(tickers)}&period=1mo")
+
+        self.assertEqual(response.status_code, 400)
+        load.assert_not_called()
+
+
+class CompressedPayloadTests(TestCase):
+    def payload(self):
+        closes = [round(10 + i / 100, 4) for i in range(2000)]
+        return services._encode_history('5y', '1wk', {'dates': ['2026-10-16'] * 2000, 'timestamps': list(range(2000)), 'close': closes})
+
+    def test_pickled_compressed(self):
+        payload = self.payload()
+        pickled = pickle.dumps(payload['json'])
+
+        self.assertLess(len(pickled), len(payload['json']) / 2)
+        restored = pickle.loads(pickled)
+        self.assertIsInstance(restored, services._CompressedBytes)
+        self.assertEqual(restored, payload['json'])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'test_stocks_cache'}})
+    def test_database_cache_round_trip(self):
+        call_command('createcachetable', verbosity=0)
+        payload = self.payload()
+
+        services._store_history('hist_TEST_5y_1wk', payload)
+
+        entry = caches['default'].get('hist_TEST_5y_1wk')
+        self.assertEqual(entry['value']['json'], payload['json'])
+        self.assertEqual(json.loads(entry['value']['json'])['period'], '5y')
+        self.assertEqual(caches['default'].get('hist_TEST_5y_1wk_validators')['etag'], payload['etag'])
+
+
+class AnalyticsTests(SimpleTestCase):
+    holdings = [
+        {'ticker': 'PETR4.SA', 'quantity': 10, 'dividend_yield': 0.1},
+        {'ticker': 'VALE3.SA', 'quantity': 5, 'dividend_yield': 0.0},
+    ]
+
+    def setUp(self):
+        clear_caches()
+
+    def closes(self, missing=()):
+        df = pd.DataFrame({'PETR4.SA': [10.0, 11.0, 12.1], 'VALE3.SA': [20.0, 20.0, 18.0]}, index=['2026-10-14', '2026-10-15', '2026-10-16'])
+        payloads = {'PETR4.SA': {}, 'VALE3.SA': {}}
+        for ticker in missing:
+            del df[ticker]
+            payloads[ticker] = None
+        return df, payloads
+
+    def test_metrics_of_all_assets_at_once(self):
+        with mock.patch('stocks.analytics.get_close_matrix', return_value=self.closes()):
+            result = analytics.portfolio_analytics(self.holdings)
+
+        self.assertEqual(result['observations'], 3)
+        self.assertEqual(result['missing'], [])
+        self.assertEqual(result['portfolio']['value'], 211.0)
+        self.assertAlmostEqual(result['portfolio']['total_return'], 0.055)
+        self.assertAlmostEqual(result['assets']['PETR4.SA']['total_return'], 0.21)
+        self.assertAlmostEqual(result['assets']['VALE3.SA']['max_drawdown'], -0.1)
+        self.assertAlmostEqual(result['income']['annual'], 12.1)
+        self.assertIsNone(result['portfolio']['annualized_return'])
+
+    def test_complete_results_are_cached_for_hist_ttl(self):
+        with mock.patch('stocks.analytics.get_close_matrix', return_value=self.closes()) as closes, \
+                mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            analytics.get_portfolio_analytics(1, self.holdings)
+            analytics.get_portfolio_analytics(1, list(reversed(self.holdings)))
+
+        closes.assert_called_once()
+        self.assertEqual(cache_set.call_args.kwargs['timeout'], services.HIST_TTL)
+
+    def test_missing_assets_are_cached_for_failure_ttl(self):
+        with mock.patch('stocks.analytics.get_close_matrix', return_value=self.closes(missing=['VALE3.SA'])), \
+                mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            result = analytics.get_portfolio_analytics(1, self.holdings)
+
+        self.assertEqual(result['missing'], ['VALE3.SA'])
+        self.assertEqual(result['tickers'], ['PETR4.SA'])
+        self.assertEqual(cache_set.call_args.kwargs['timeout'], services.FAILURE_TTL)
+
+
+class SymbolResolutionTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        TickerSymbol.objects.create(symbol='PETR4', yahoo_symbol='PETR4.SA', name='Petrobras PN', exchange='B3')
+
+    def test_spellings_resolve_through_the_index(self):
+        self.assertEqual(services.resolve_symbols(['petr4', 'PETR4.SA ', 'XXXX11']), {'PETR4': 'PETR4.SA', 'PETR4.SA': 'PETR4.SA', 'XXXX11': None})
+        self.assertEqual(cache.get('symbol_PETR4'), 'PETR4.SA')
+
+    def test_resolutions_are_served_without_the_index(self):
+        services.resolve_symbols(['PETR4', 'XXXX11'])
+        services._aliases_l1.clear()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(services.resolve_symbols(['PETR4', 'XXXX11']), {'PETR4': 'PETR4.SA', 'XXXX11': None})
+
+    def test_unresolved_tickers_are_remembered_briefly(self):
+        with mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            services.resolve_symbols(['XXXX11'])
+
+        set_many.assert_called_once_with({'symbol_XXXX11': ''}, timeout=services.FAILURE_TTL)
+
+    def test_first_successful_probe_is_remembered(self):
+        fetched = lambda symbol: quote(symbol, 10.0) if symbol == 'TAEE11.SA' else {'ticker': symbol, 'valid': False}
+
+        with mock.patch('stocks.services._fetch_quote_from_yf', side_effect=fetched) as fetch:
+            services.get_quote('taee11')
+            cache.delete('quote_TAEE11.SA')
+            services._quotes_l1.clear()
+            services.get_quote('TAEE11')
+
+        self.assertEqual([c.args[0] for c in fetch.call_args_list], ['TAEE11.SA', 'TAEE11.SA'])
+        self.assertEqual(services.resolve_symbol('taee11'), 'TAEE11.SA')
+        self.assertIsNotNone(cache.get('quote_TAEE11.SA'))
+
+    def test_candidates(self):
+        self.assertEqual(services._candidate_symbols('PETR4', None), ['PETR4.SA', 'PETR4'])
+        self.assertEqual(services._candidate_symbols('AAPL', None), ['AAPL'])
+        self.assertEqual(services._candidate_symbols('PETR4', 'PETR4.SA'), ['PETR4.SA'])
+
+
+@override_settings(STORAGES=PLAIN_STATIC)
+class TickerSearchTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        TickerSymbol.objects.create(symbol='PETR4', yahoo_symbol='PETR4.SA', name='Petrobras PN', exchange='B3')
+
+    def search(self, query, result):
+        with mock.patch('stocks.views.aget_quote', return_value=result) as aget_quote:
+            response = self.client.get('/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return aget_quote
+
+    def test_is_probeable(self):
+        for query in ('aapl', 'PETR4.SA', 'BTC-USD', '^BVSP', 'BRL=X'):
+            self.assertTrue(tickers.is_probeable(query), query)
+        for query in ('', 'banco do brasil', 'PETR4;DROP', 'A' * 21):
+            self.assertFalse(tickers.is_probeable(query), query)
+
+    def test_indexed_query_uses_the_yahoo_symbol(self):
+        aget_quote = self.search('petr4', quote('PETR4.SA', 30.0))
+
+        aget_quote.assert_called_once_with('PETR4.SA')
+
+    def test_found_probe_is_indexed(self):
+        self.search('aapl', {**quote('AAPL', 200.0), 'name': 'Apple Inc.'})
+
+        self.assertEqual(TickerSymbol.objects.get(symbol='AAPL').name, 'Apple Inc.')
+
+    def test_unknown_symbol_is_not_probed_again(self):
+        self.search('zzzz9', {'ticker': 'ZZZZ9', 'valid': False, 'not_found': True})
+
+        self.search('ZZZZ9 ', {'valid': False}).assert_not_called()
+
+    def test_upstream_errors_are_not_remembered(self):
+        self.search('zzzz9', {'ticker': 'ZZZZ9', 'valid': False})
+
+        self.search('zzzz9', {'valid': False}).assert_called_once_with('ZZZZ9')
+
+    def test_names_are_not_probed(self):
+        self.search('petrobras pn', {'valid': False}).assert_not_called()
+
+    def test_not_found_only_when_every_candidate_was_missing(self):
+        missing = FakeResponse({'chart': {'result': None, 'error': {'code': 'Not Found'}}}, status_code=404)
+
+        with mock.patch('stocks.upstream.get', return_value=missing):
+            self.assertTrue(services._fetch_quote('ZZZZ9', None)['not_found'])
+        with mock.patch('stocks.upstream.get', side_effect=[ConnectionError(), missing]):
+            self.assertFalse(services._fetch_quote('ZZZZ9', None)['not_found'])
+
+
+class BenchmarkHarnessTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.fake = benchmark.FakeYahoo(['PETR4.SA'], latency=0)
+
+    def test_fake_serves_known_symbols_only(self):
+        self.assertEqual(self.fake.chart('https://x/PETR4.SA', {'range': '1mo', 'interval': '1d'}).status_code, 200)
+        self.assertEqual(self.fake.chart('https://x/XXXX11.SA', {}).status_code, 404)
+        self.assertEqual(self.fake.info('XXXX11.SA'), {})
+
+    def test_services_go_through_the_fake(self):
+        with benchmark.fake_upstream(self.fake, upstream_rate=1000), benchmark.Probe().installed() as probe:
+            info = services.get_quote('PETR4.SA')
+            services.get_quote('PETR4.SA')
+
+        self.assertTrue(info['valid'])
+        self.assertEqual(info['name'], 'PETR4.SA Fake Corp')
+        # Quote and dividends once, the second lookup is a hit
+        self.assertEqual(self.fake.take_calls(), {'chart': 2})
+        self.assertEqual(probe.reset()['l1_hits'], 1)
+
+    def test_summary(self):
+        counts = {'l1_hits': 3, 'l2_hits': 1, 'misses': 4, 'queries': 8, 'cache_queries': 0}
+        summary = benchmark.summarize('history', 'cold', [(0.01, 200), (0.03, 503)], {'chart': 4}, counts, 1)
+
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['latency_ms']['max'], 30.0)
+        self.assertEqual(summary['upstream_calls']['per_request'], 2.0)
+        self.assertEqual(summary['cache']['hit_ratio'], 0.5)
+        self.assertEqual(summary['queries_per_request'], 4.0)
+
+
+@override_settings(STORAGES=PLAIN_STATIC)
+class ServiceWorkerTests(SimpleTestCase):
+    def setUp(self):
+        views._sw_precache.cache_clear()
+        self.addCleanup(views._sw_precache.cache_clear)
+
+    def test_script_is_revalidated_on_every_load(self):
+        response = self.client.get('/sw.js')
+
+        self.assertEqual(response['Content-Type'], 'application/javascript')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertContains(response, '"/static/stocks/js/main.js"')
+        self.assertNotContains(response, '/static/admin/')
+
+    def test_precache_follows_the_manifest(self):
+        storage = mock.Mock(hashed_files={'stocks/js/main.js': 'stocks/js/main.1.js', 'admin/js/core.js': 'admin/js/core.1.js'})
+        storage.url.side_effect = lambda name: f"/static/{storage.hashed_files[name]}"
+
+        with mock.patch.object(views, 'staticfiles_storage', storage):
+            urls, version = views._sw_precache()
+            views._sw_precache.cache_clear()
+            storage.hashed_files['stocks/js/main.js'] = 'stocks/js/main.2.js'
+            new_urls, new_version = views._sw_precache()
+
+        self.assertEqual(urls, ['/static/stocks/js/main.1.js'])
+        self.assertEqual(new_urls, ['/static/stocks/js/main.2.js'])
+        self.assertNotEqual(version, new_version)
+
+
+class MetricsTests(TransactionTestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_symbols_stay_out_of_header_names(self):
+        stats = metrics.RequestStats()
+        stats.upstream_symbols = {'AB\r\nCD': 0.2, 'X"Y\\': 0.1}
+
+        header = stats.server_timing()
+        self.assertIn('upstream-1;dur=200.0;desc="ABCD"', header)
+        self.assertIn('upstream-2;dur=100.0;desc="X\\"Y\\\\"', header)
+
+    def test_middleware_with_a_control_character_in_the_url(self):
+        async def aget(url, params=None, host=None):
+            return FakeResponse(chart(20.0))
+
+        with mock.patch('stocks.upstream.aget', side_effect=aget):
+            response = self.client.get('/api/stock/AB%0ACD/quote/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'upstream-1;dur=[0-9.]+;desc="ABCD"')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'test_stocks_cache'}})
+    async def test_async_requests_publish_to_the_database_cache(self):
+        await asyncio.to_thread(call_command, 'createcachetable', verbosity=0)
+        metrics._next_publish = 0.0
+
+        async def aget(url, params=None, host=None):
+            return FakeResponse(chart(20.0))
+
+        with mock.patch('stocks.upstream.aget', side_effect=aget), mock.patch('builtins.print') as printed:
+            response = await self.async_client.get('/api/stock/PETR4/quote/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(printed.called)
+        published = await caches['default'].aget(f"metrics_{metrics._process_id}")
+        self.assertIn(
+            ('stocks_requests_total', (('status', '200'), ('view', 'stocks:api_stock_quote'))),
+            published['counters'],
+        )
+
+    def test_registry_renders_prometheus_text(self):
+        registry = metrics.Registry()
+        registry.inc('stocks_requests_total', {'view': 'a"b', 'status': '200'}, 2)
+        registry.observe('stocks_upstream_duration_seconds', {'operation': 'quote'}, 0.03)
+
+        text = metrics.render(registry.snapshot())
+        self.assertIn('# TYPE stocks_requests_total counter', text)
+        self.assertIn('stocks_requests_total{status="200",view="a\\"b"} 2', text)
+        self.assertIn('stocks_upstream_duration_seconds_bucket{operation="quote",le="0.025"} 0', text)
+        self.assertIn('stocks_upstream_duration_seconds_bucket{operation="quote",le="0.05"} 1', text)
+        self.assertIn('stocks_upstream_duration_seconds_count{operation="quote"} 1', text)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint_needs_the_token_or_staff(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'stocks_requests_total', response.content)
+        self.assertNotIn(b'symbol=', response.content)
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class LttbTests(SimpleTestCase):
+    def test_keeps_endpoints_and_threshold(self):
+        x = np.arange(1000, dtype='float64')
+        y = np.sin(x / 50)
+        indices = services.lttb_indices(x, y, 100)
+
+        self.assertEqual(len(indices), 100)
+        self.assertEqual((indices[0], indices[-1]), (0, 999))
+        self.assertTrue(np.all(np.diff(indices) > 0))
+
+    def test_keeps_spikes(self):
+        x = np.arange(500, dtype='float64')
+        y = np.zeros(500)
+        y[123] = 10.0
+        y[321] = -10.0
+
+        indices = services.lttb_indices(x, y, 20)
+
+        self.assertIn(123, indices)
+        self.assertIn(321, indices)
+
+    def test_short_series_are_kept_whole(self):
+        x = np.arange(10, dtype='float64')
+        self.assertEqual(services.lttb_indices(x, x, 10).tolist(), list(range(10)))
+        self.assertEqual(services.lttb_indices(x, x, 2).tolist(), list(range(10)))
+
+
+class BreakerTests(TestCase):
+    host = 'breaker.test'
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('stocks.upstream.time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fail(self):
+        raise upstream.UpstreamHTTPError(503)
+
+    def test_opens_after_threshold_and_fails_fast(self):
+        fn = mock.Mock(side_effect=self.fail)
+        for _ in range(upstream.BREAKER_THRESHOLD - 1):
+            with self.assertRaises(upstream.UpstreamHTTPError):
+                upstream.call(fn, self.host)
+        # Failed attempts that were retried don't count, only calls do
+        self.assertTrue(upstream.is_available(self.host))
+        self.assertEqual(fn.call_count, (upstream.BREAKER_THRESHOLD - 1) * (upstream.UPSTREAM_RETRIES + 1))
+
+        with self.assertRaises(upstream.UpstreamHTTPError):
+            upstream.call(fn, self.host)
+        self.assertFalse(upstream.is_available(self.host))
+
+        fn = mock.Mock()
+        with self.assertRaises(upstream.UpstreamUnavailable):
+            upstream.call(fn, self.host)
+        fn.assert_not_called()
+
+    def test_retry_success_resets_the_count(self):
+        upstream._record_failure(self.host, upstream.UpstreamHTTPError(503))
+        fn = mock.Mock(side_effect=[upstream.UpstreamHTTPError(503), 'ok'])
+
+        self.assertEqual(upstream.call(fn, self.host), 'ok')
+        self.assertEqual(upstream._count(f"upstream_failures_{self.host}", upstream.BREAKER_FAILURE_WINDOW), 0)
+
+    def open_and_cool_down(self):
+        for _ in range(upstream.BREAKER_THRESHOLD):
+            upstream._record_failure(self.host, upstream.UpstreamHTTPError(503))
+        # The cooldown is over
+        cache.delete(f"upstream_open_{self.host}")
+
+    def test_half_open_lets_one_probe_through(self):
+        self.open_and_cool_down()
+
+        self.assertTrue(upstream._enter_breaker(self.host))  # The probe
+        with self.assertRaises(upstream.UpstreamUnavailable):
+            upstream._enter_breaker(self.host)
+
+        upstream._record_success(self.host)
+        self.assertFalse(upstream._enter_breaker(self.host))
+        self.assertFalse(upstream._enter_breaker(self.host))
+        self.assertEqual(upstream._count(f"upstream_failures_{self.host}", upstream.BREAKER_FAILURE_WINDOW), 0)
+
+    def test_failed_probe_reopens_without_retrying(self):
+        self.open_and_cool_down()
+        fn = mock.Mock(side_effect=self.fail)
+
+        with self.assertRaises(upstream.UpstreamHTTPError):
+            upstream.call(fn, self.host)
+
+        fn.assert_called_once()
+        self.assertFalse(upstream.is_available(self.host))
+        # The next cooldown gets its own probe
+        cache.delete(f"upstream_open_{self.host}")
+        self.assertTrue(upstream._enter_breaker(self.host))
+
+    def test_rate_limit_window(self):
+        with mock.patch('stocks.upstream.time.time', return_value=1000.25):
+            waits = [upstream._slot_wait(self.host) for _ in range(upstream.UPSTREAM_RATE + 1)]
+        self.assertEqual(waits[:-1], [0] * upstream.UPSTREAM_RATE)
+        # Until the burst's slice has left the window
+        self.assertAlmostEqual(waits[-1], 1.05)
+
+        with mock.patch('stocks.upstream.time.time', return_value=1001.0):
+            self.assertGreater(upstream._slot_wait(self.host), 0)
+        with mock.patch('stocks.upstream.time.time', return_value=1001.3):
+            self.assertEqual(upstream._slot_wait(self.host), 0)
+
+    def test_rate_limit_across_window_edges(self):
+        for backends in (upstream.ATOMIC_INCR_BACKENDS, ()):
+            cache.clear()
+            admitted = []
+            # Bursts of calls every 10 ms for 3 seconds, starting right before a window edge
+            with mock.patch('stocks.upstream.ATOMIC_INCR_BACKENDS', backends):
+                for step in range(300):
+                    now = 1000.9 + step * 0.01
+                    with mock.patch('stocks.upstream.time.time', return_value=now):
+                        admitted += [now for _ in range(4) if upstream._slot_wait(self.host) == 0]
+
+            with self.subTest(database=not backends):
+                self.assertGreaterEqual(len(admitted), upstream.UPSTREAM_RATE * 2)
+                window = upstream.UPSTREAM_RATE_WINDOW
+                busiest = max(sum(1 for other in admitted if at - window < other <= at) for at in admitted)
+                self.assertLessEqual(busiest, upstream.UPSTREAM_RATE)
+
+    def test_rate_limited_answer_pauses_every_caller(self):
+        with mock.patch('stocks.upstream._backoff', return_value=2.0):
+            upstream._retry_delay(self.host, upstream.UpstreamHTTPError(429), 0)
+
+        self.assertGreater(upstream._slot_wait(self.host), 1.5)
+        with self.assertRaises(upstream.UpstreamUnavailable):
+            with mock.patch('stocks.upstream.UPSTREAM_MAX_WAIT', 1):
+                upstream._acquire_slot(self.host)
+
+    def test_database_counters(self):
+        key = f"upstream_calls_{self.host}"
+        self.assertEqual([upstream._incr_row(key, 7) for _ in range(3)], [1, 2, 3])
+        # A new window starts over
+        self.assertEqual(upstream._incr_row(key, 8), 1)
+        self.assertEqual(UpstreamCounter.objects.filter(key=key).count(), 1)
+
+
+class PlanPriceSyncTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def series(self, covered_from, synced_at, full_history=False):
+        series = PriceSeries.objects.create(
+            ticker='PETR4.SA', interval='1d', symbol='PETR4.SA', timezone='America/Sao_Paulo',
+            covered_from=covered_from, full_history=full_history, synced_at=synced_at,
+        )
+        for days in (3, 2, 1):
+            PriceBar.objects.create(series=series, timestamp=self.now - timedelta(days=days), close=10.0 + days)
+        return series
+
+    def test_unknown_series_downloads_the_period_from_every_candidate(self):
+        plan = services._plan_price_sync('PETR4', None, '1mo', '1d')
+
+        self.assertFalse(plan['covered'])
+        self.assertEqual(plan['fetches'], [('PETR4.SA', {'period': '1mo'}), ('PETR4', {'period': '1mo'})])
+
+    def test_covered_series_downloads_from_its_last_bar(self):
+        series = self.series(self.now - timedelta(days=400), self.now - timedelta(hours=1))
+        last_bar = series.bars.order_by('-timestamp').first().timestamp
+
+        plan = services._plan_price_sync('PETR4', 'PETR4.SA', '1y', '1d')
+
+        self.assertTrue(plan['covered'])
+        self.assertEqual(plan['fetches'], [('PETR4.SA', {'start': last_bar})])
+
+    def test_recently_synced_series_downloads_nothing(self):
+        self.series(self.now - timedelta(days=400), self.now)
+
+        plan = services._plan_price_sync('PETR4', 'PETR4.SA', '1y', '1d')
+
+        self.assertTrue(plan['covered'])
+        self.assertEqual(plan['fetches'], [])
+
+    def test_longer_period_downloads_the_whole_period(self):
+        self.series(self.now - timedelta(days=40), self.now - timedelta(hours=1))
+
+        plan = services._plan_price_sync('PETR4', 'PETR4.SA', '1y', '1d')
+
+        self.assertFalse(plan['covered'])
+        self.assertEqual(plan['fetches'], [('PETR4.SA', {'period': '1y'})])
+
+    def test_full_history_covers_max(self):
+        self.series(None, self.now, full_history=True)
+
+        self.assertTrue(services._plan_price_sync('PETR4', 'PETR4.SA', 'max', '1d')['covered'])
+
+    def test_new_dividend_downloads_the_covered_window_again(self):
+        covered_from = self.now - timedelta(days=400)
+        self.series(covered_from, self.now - timedelta(hours=1))
+        plan = services._plan_price_sync('PETR4', 'PETR4.SA', '1y', '1d')
+        index = pd.DatetimeIndex([plan['last_bar'], self.now])
+        delta = pd.DataFrame({'Close': [11.0, 12.0], 'Dividends': [0.0, 0.0], 'Stock Splits': [0.0, 0.0]}, index=index)
+
+        self.assertIsNone(services._readjust_fetch(plan, delta, 'PETR4.SA'))
+        delta.loc[delta.index[-1], 'Dividends'] = 0.5
+        self.assertEqual(services._readjust_fetch(plan, delta, 'PETR4.SA'), ('PETR4.SA', {'start': covered_from}))
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('snapshot')
+        self.snapshot = save_snapshot(self.user, [
+            value_item('PETR4.SA', 'Petrobras', 10.0, quote('PETR4.SA', 30.0, 0.1)),
+            value_item('VALE3.SA', 'Vale', 5.0, quote('VALE3.SA', 60.0)),
+        ])
+        for entry in self.snapshot.items:
+            PortfolioItem.objects.create(user=self.user, ticker=entry['ticker'], quantity=entry['quantity'])
+
+    def test_totals(self):
+        self.assertEqual(self.snapshot.total_value, 600.0)
+        self.assertAlmostEqual(self.snapshot.annual_income, 30.0)
+
+    def test_set_item_quantities(self):
+        PortfolioItem.objects.filter(ticker='PETR4.SA').delete()
+        PortfolioItem.objects.create(user=self.user, ticker='ITUB4.SA', quantity=2)
+
+        snapshot = set_item_quantities(self.user, {'PETR4.SA': quote('PETR4.SA', 30.0), 'ITUB4.SA': quote('ITUB4.SA', 25.0)})
+
+        self.assertEqual([entry['ticker'] for entry in snapshot.items], ['ITUB4.SA', 'VALE3.SA'])
+        self.assertEqual(snapshot.total_value, 350.0)
+
+    def test_apply_quotes_reprices_holders(self):
+        self.assertEqual(apply_quotes({'PETR4.SA': quote('PETR4.SA', 40.0, 0.1)}), 1)
+
+        snapshot = PortfolioSnapshot.objects.get(user=self.user)
+        self.assertEqual(snapshot.total_value, 700.0)
+        self.assertGreater(snapshot.updated_at, self.snapshot.updated_at)
+
+    def test_apply_quotes_keeps_unchanged_snapshots_age(self):
+        self.assertEqual(apply_quotes({'VALE3.SA': quote('VALE3.SA', 60.0)}), 0)
+
+        self.assertEqual(PortfolioSnapshot.objects.get(user=self.user).updated_at, self.snapshot.updated_at)
+
+    def test_apply_quotes_keeps_quantities_changed_meanwhile(self):
+        PortfolioItem.objects.filter(ticker='PETR4.SA').update(quantity=20)
+        set_item_quantities(self.user, {'PETR4.SA': quote('PETR4.SA', 30.0, 0.1)})
+        apply_quotes({'PETR4.SA': quote('PETR4.SA', 40.0, 0.1)})
+
+        entries = {entry['ticker']: entry for entry in PortfolioSnapshot.objects.get(user=self.user).items}
+        self.assertEqual(entries['PETR4.SA']['quantity'], 20.0)
+        self.assertEqual(entries['PETR4.SA']['total_value'], 800.0)
+
+
+class SnapshotRebuildTests(TransactionTestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create_user('rebuild')
+        PortfolioItem.objects.create(user=self.user, ticker='PETR4.SA', quantity=10)
+        PortfolioItem.objects.create(user=self.user, ticker='VALE3.SA', quantity=5)
+
+    def test_first_change_fetches_quotes_outside_the_lock(self):
+        # The fetch threads store dividends and symbols: under the snapshot lock they would give
+        # up after the timeout ("database is locked") and the holdings would be saved invalid
+        with mock.patch.dict(connection.settings_dict['OPTIONS'], {'timeout': 1}), \
+                mock.patch('stocks.upstream.get', return_value=FakeResponse(chart(20.0))):
+            snapshot = set_item_quantity(self.user, 'VALE3.SA', quote('VALE3.SA', 20.0))
+
+        self.assertEqual(sorted(entry['ticker'] for entry in snapshot.items), ['PETR4.SA', 'VALE3.SA'])
+        self.assertTrue(all(entry['valid'] for entry in snapshot.items))
+        self.assertEqual(snapshot.total_value, 300.0)
+        self.assertEqual(PortfolioSnapshot.objects.get(user=self.user).total_value, 300.0)
+        self.assertTrue(DividendSeries.objects.filter(symbol='VALE3.SA').exists())
+
+
+class ConditionalRequestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        services._quotes_l1.clear()
+        # Resolved without the ticker index
+        cache.set('symbol_AAPL', 'AAPL')
+
+    def store_history(self, fetched_at=None):
+        payload = services._encode_history('1mo', '1d', {'dates': ['2026-10-15', '2026-10-16'], 'timestamps': [1, 2], 'close': [1.0, 2.0]})
+        stored = services._store_history('hist_AAPL_1mo_1d', payload)
+        if fetched_at is not None:
+            cache.set('hist_AAPL_1mo_1d_validators', {'etag': stored['etag'], 'fetched_at': fetched_at})
+        return stored
+
+    def test_history_sends_validators(self):
+        stored = self.store_history()
+
+        response = self.client.get('/api/stock/AAPL/history/?period=1mo')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{stored["etag"]}"')
+        self.assertIn('Last-Modified', response)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertEqual(json.loads(response.content)['close'], [1.0, 2.0])
+
+    def test_fresh_history_revalidates_without_reading_the_payload(self):
+        stored = self.store_history()
+
+        with mock.patch('stocks.views.aget_historical_payload') as read_payload:
+            response = self.client.get('/api/stock/AAPL/history/?period=1mo', HTTP_IF_NONE_MATCH=f'"{stored["etag"]}"')
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], f'"{stored["etag"]}"')
+        read_payload.assert_not_called()
+
+    def test_stale_validators_are_not_trusted(self):
+        stored = self.store_history(fetched_at=time.time() - services.HIST_TTL - 1)
+
+        with mock.patch('stocks.views.aget_historical_payload', return_value=stored) as read_payload:
+            response = self.client.get('/api/stock/AAPL/history/?period=1mo', HTTP_IF_NONE_MATCH='"other"')
+
+        self.assertEqual(response.status_code, 200)
+        read_payload.assert_called_once()
+
+    def test_quote(self):
+        services._store('quote_AAPL', quote('AAPL', 200.0))
+
+        response = self.client.get('/api/stock/AAPL/quote/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['price'], 200.0)
+
+        response = self.client.get('/api/stock/AAPL/quote/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
@@ -0,0 +1,135 @@
+"""
+Local ticker index. Tradable symbols are stored in TickerSymbol (loaded with
+`manage.py load_tickers`), so search and autocomplete resolve user input (PETR4 -> PETR4.SA)
+with a database lookup. Symbols outside the index are probed upstream once by search and indexed
+when found (see add).
+"""
+import difflib
+import re
+from django.core.cache import cache
+from django.db.models import Q
+from .models import TickerSymbol
+
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 25
+FUZZY_CUTOFF = 0.6  # Minimum difflib similarity of a fuzzy match
+
+# The symbol list used for fuzzy matching, rebuilt after each load_tickers run
+INDEX_CACHE_KEY = 'ticker_index'
+INDEX_TTL = 60 * 60 * 24
+
+# Queries probed upstream when not indexed, anything else is not a symbol (e.g. a company name)
+PROBE_RE = re.compile(r'^[A-Z0-9^][A-Z0-9.=^-]{0,19}$')
+# Queries upstream does not know are not probed again for this long. Upstream errors are not
+# remembered, they only get the usual FAILURE_TTL of a failed quote
+PROBE_MISS_TTL = 60 * 60 * 6
+
+
+def normalize(query):
+    return (query or '').upper().strip()
+
+
+async def aresolve(query):
+    """
+    TickerSymbol matching the query by symbol (PETR4) or Yahoo symbol (PETR4.SA), or None.
+    """
+    query = normalize(query)
+    if not query:
+        return None
+    return await TickerSymbol.objects.filter(Q(symbol=query) | Q(yahoo_symbol=query)).afirst()
+
+
+def yahoo_symbols(queries):
+    """
+    Batched aresolve: {query: Yahoo symbol} for the (normalized) queries found in the index.
+    """
+    queries = [normalize(query) for query in queries if query]
+    found = {}
+    for entry in TickerSymbol.objects.filter(Q(symbol__in=queries) | Q(yahoo_symbol__in=queries)):
+        found[entry.symbol] = found[entry.yahoo_symbol] = entry.yahoo_symbol
+    return {query: found[query] for query in queries if query in found}
+
+
+async def ayahoo_symbols(queries):
+    queries = [normalize(query) for query in queries if query]
+    found = {}
+    async for entry in TickerSymbol.objects.filter(Q(symbol__in=queries) | Q(yahoo_symbol__in=queries)):
+        found[entry.symbol] = found[entry.yahoo_symbol] = entry.yahoo_symbol
+    return {query: found[query] for query in queries if query in found}
+
+
+def is_probeable(query):
+    return bool(PROBE_RE.match(normalize(query)))
+
+
+async def aprobe_missed(query):
+    return await cache.aget(_probe_miss_key(query)) is not None
+
+
+async def aremember_probe_miss(query):
+    await cache.aset(_probe_miss_key(query), True, timeout=PROBE_MISS_TTL)
+
+
+def _probe_miss_key(query):
+    return f"probe_miss_{normalize(query)}"
+
+
+def add(quote):
+    """
+    Index a symbol found upstream from its (valid) quote. B3 listings are indexed without .SA,
+    like the seed list.
+    """
+    yahoo_symbol = quote['ticker']
+    is_b3 = yahoo_symbol.endswith('.SA')
+    TickerSymbol.objects.bulk_create(
+        [TickerSymbol(
+            symbol=yahoo_symbol[:-3] if is_b3 else yahoo_symbol,
+            yahoo_symbol=yahoo_symbol,
+            name=(quote.get('name') or yahoo_symbol)[:200],
+            exchange='B3' if is_b3 else '',
+        )],
+        ignore_conflicts=True,
+    )
+    invalidate_index()
+
+
+def suggest(query, limit=SUGGEST_LIMIT):
+    """
+    Autocomplete: symbols starting with the query first, then names containing it, then (only
+    when nothing matched, e.g. a typo) the closest symbols.
+    """
+    query = normalize(query)
+    if not query:
+        return []
+
+    matches = list(TickerSymbol.objects.filter(symbol__startswith=query)[:limit])
+    if len(matches) < limit:
+        matches += TickerSymbol.objects.filter(name__icontains=query).exclude(
+            pk__in=[entry.pk for entry in matches]
+        )[:limit - len(matches)]
+    if not matches and len(query) >= 3:
+        close = difflib.get_close_matches(query, _symbol_index(), n=limit, cutoff=FUZZY_CUTOFF)
+        by_symbol = {entry.symbol: entry for entry in TickerSymbol.objects.filter(symbol__in=close)}
+        matches = [by_symbol[symbol] for symbol in close if symbol in by_symbol]
+    return [as_dict(entry) for entry in matches]
+
+
+def as_dict(entry):
+    return {
+        'symbol': entry.symbol,
+        'yahoo_symbol': entry.yahoo_symbol,
+        'name': entry.name,
+        'exchange': entry.exchange,
+    }
+
+
+def invalidate_index():
+    cache.delete(INDEX_CACHE_KEY)
+
+
+def _symbol_index():
+    symbols = cache.get(INDEX_CACHE_KEY)
+    if symbols is None:
+        symbols = list(TickerSymbol.objects.values_list('symbol', flat=True))
+        cache.set(INDEX_CACHE_KEY, symbols, timeout=INDEX_TTL)
+    return symbols
@@ -0,0 +1,441 @@
+"""
+Client side of every call to Yahoo Finance.
+
+- Sessions: a thread-safe pool of curl_cffi sessions for the sync path, one AsyncSession per
+  event loop for the async path.
+- Rate limiting: a sliding window per host, at most UPSTREAM_RATE calls within any
+  UPSTREAM_RATE_WINDOW seconds. Calls are counted per slice of the window and a call checks every
+  slice that overlaps the last window, so bursts across slice or window edges stay within the
+  rate (at worst a call waits one slice longer than needed). Its state lives in the cache, so
+  every gunicorn worker (and the refresher) draws from the same budget.
+  Counters need an atomic increment: Redis and locmem have one, with other cache backends
+  (database, file) they are kept in UpstreamCounter rows instead.
+- Retries: transient failures (429, 5xx, network errors) are retried with exponential backoff and
+  full jitter. A 429 also pauses the host for every worker for the duration of the backoff.
+- Circuit breaker: after BREAKER_THRESHOLD consecutive failed calls (a call fails once its retries
+  are used up, failed attempts in between don't count) the host is considered down for
+  BREAKER_COOLDOWN seconds and calls fail immediately with UpstreamUnavailable, so callers fall
+  back to cached/stale data instead of waiting for timeouts. Then a single probe call is let
+  through (half-open), without retries, and its result closes or re-opens the breaker.
+"""
+import asyncio
+import os
+import queue
+import random
+import time
+import weakref
+from contextlib import contextmanager
+import certifi
+from curl_cffi.requests import AsyncSession as CurlAsyncSession, Session as CurlSession
+from curl_cffi.requests.exceptions import RequestException
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from yfinance.exceptions import YFRateLimitError
+from .db import db_sync_to_async
+from .models import UpstreamCounter
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.1 Safari/605.1.15',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/110.0',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36 Edg/122.0.0.0'
+]
+
+# Every endpoint we use (quote summary, chart, dividends) is served from this host
+YAHOO_HOST = 'query2.finance.yahoo.com'
+
+# Only turn certificate checks off behind an intercepting proxy
+VERIFY_SSL = os.environ.get('UPSTREAM_VERIFY_SSL', 'True').lower() == 'true'
+
+SESSION_POOL_SIZE = 8
+MAX_ASYNC_CLIENTS = 200  # Concurrent upstream connections per event loop
+REQUEST_TIMEOUT = 20
+
+# Rate limiting, shared by all workers
+UPSTREAM_RATE = 10  # Requests per window per host
+UPSTREAM_RATE_WINDOW = 1
+UPSTREAM_RATE_SLICES = 10  # Counters per window
+UPSTREAM_MAX_WAIT = 5  # A call gives up if it can't get a slot within this many seconds
+
+# Retries
+UPSTREAM_RETRIES = 2
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8
+
+# Circuit breaker
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+BREAKER_PROBE_TTL = REQUEST_TIMEOUT + 5
+BREAKER_FAILURE_WINDOW = BREAKER_COOLDOWN * 4  # Failures further apart than this don't add up
+
+# Backends whose incr() is atomic, the others read and write back
+ATOMIC_INCR_BACKENDS = (RedisCache, LocMemCache)
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised without calling upstream: the circuit is open or the rate budget is exhausted.
+    """
+
+
+class UpstreamHTTPError(Exception):
+    """
+    Raised for retryable HTTP statuses (429 and 5xx) of direct requests.
+    """
+    def __init__(self, status):
+        super().__init__(f"Upstream answered HTTP {status}")
+        self.status = status
+
+
+# Failures that count towards the breaker and are worth retrying
+RETRYABLE_ERRORS = (YFRateLimitError, UpstreamHTTPError, RequestException)
+
+
+def get_session(session_class=CurlSession, **kwargs):
+    # Use impersonate="chrome110" to handle TLS fingerprinting and Cloudflare blocks natively
+    return session_class(
+        impersonate="chrome110",
+        verify=certifi.where() if VERIFY_SSL else False,
+        headers={
+            'User-Agent': random.choice(USER_AGENTS)
+        },
+        **kwargs
+    )
+
+
+class SessionPool:
+    """
+    Hands out one session per thread at a time, each with its own User-Agent and cookie jar.
+    Sessions are created on demand and at most `size` idle ones are kept.
+    """
+    def __init__(self, size=SESSION_POOL_SIZE, factory=get_session):
+        self.factory = factory
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    @contextmanager
+    def session(self):
+        try:
+            session = self.idle.get_nowait()
+        except queue.Empty:
+            session = self.factory()
+        try:
+            yield session
+        finally:
+            try:
+                self.idle.put_nowait(session)
+            except queue.Full:
+                session.close()
+
+
+pool = SessionPool()
+_async_sessions = weakref.WeakKeyDictionary()
+
+
+def get_async_session():
+    # AsyncSession is bound to the event loop it was created on
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None:
+        session = get_session(CurlAsyncSession, max_clients=MAX_ASYNC_CLIENTS)
+        _async_sessions[loop] = session
+    return session
+
+
+def is_available(host=YAHOO_HOST):
+    """
+    False while the host's circuit is open. Cheap enough to check before scheduling background work.
+    """
+    return cache.get(f"upstream_open_{host}") is None
+
+
+async def ais_available(host=YAHOO_HOST):
+    return await cache.aget(f"upstream_open_{host}") is None
+
+
+def call(fn, host=YAHOO_HOST):
+    """
+    Runs fn() under the host's breaker, rate limit and retry policy. fn does the actual request
+    (e.g. lambda: stock.info) and may raise any of RETRYABLE_ERRORS for transient failures.
+    """
+    probe = _enter_breaker(host)
+    for attempt in range(UPSTREAM_RETRIES + 1):
+        if attempt and not is_available(host):
+            raise UpstreamUnavailable(f"{host} circuit opened while retrying")
+        _acquire_slot(host)
+        try:
+            result = fn()
+        except RETRYABLE_ERRORS as e:
+            delay = _retry_delay(host, e, attempt)
+            if probe or attempt == UPSTREAM_RETRIES:
+                _record_failure(host, e)
+                raise
+            time.sleep(delay)
+            continue
+        _record_success(host)
+        return result
+
+
+async def acall(afn, host=YAHOO_HOST):
+    """
+    Async version of call(), afn is a coroutine function.
+    """
+    probe = await _aenter_breaker(host)
+    for attempt in range(UPSTREAM_RETRIES + 1):
+        if attempt and not await ais_available(host):
+            raise UpstreamUnavailable(f"{host} circuit opened while retrying")
+        await _aacquire_slot(host)
+        try:
+            result = await afn()
+        except RETRYABLE_ERRORS as e:
+            delay = await _aretry_delay(host, e, attempt)
+            if probe or attempt == UPSTREAM_RETRIES:
+                await _arecord_failure(host, e)
+                raise
+            await asyncio.sleep(delay)
+            continue
+        await _arecord_success(host)
+        return result
+
+
+def get(url, params=None, host=YAHOO_HOST):
+    """
+    GET through the session pool with the full upstream policy. Returns the response.
+    """
+    def request():
+        with pool.session() as session:
+            return _check_status(session.get(url, params=params, timeout=REQUEST_TIMEOUT))
+    return call(request, host)
+
+
+async def aget(url, params=None, host=YAHOO_HOST):
+    """
+    Async version of get().
+    """
+    async def request():
+        return _check_status(await get_async_session().get(url, params=params, timeout=REQUEST_TIMEOUT))
+    return await acall(request, host)
+
+
+def _check_status(response):
+    if response.status_code == 429 or response.status_code >= 500:
+        raise UpstreamHTTPError(response.status_code)
+    return response
+
+
+def _backoff(attempt):
+    # Full jitter: spreads the retries of all workers instead of having them hit upstream in lockstep
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def _is_rate_limit(error):
+    return isinstance(error, YFRateLimitError) or getattr(error, 'status', None) == 429
+
+
+# Windowed counters, shared by all workers
+
+def _window(seconds):
+    return int(time.time() // seconds)
+
+
+def _incr(key, seconds):
+    """
+    Count one event in the current window of `seconds`. Returns the window's count so far.
+    """
+    window = _window(seconds)
+    if not isinstance(caches['default'], ATOMIC_INCR_BACKENDS):
+        return _incr_row(key, window)
+    window_key = f"{key}_{window}"
+    cache.add(window_key, 0, timeout=seconds * 2)
+    try:
+        return cache.incr(window_key)
+    except ValueError:
+        # The window expired between add() and incr()
+        return 1
+
+
+def _incr_row(key, window):
+    counters = UpstreamCounter.objects.filter(key=key)
+    with transaction.atomic():
+        for _ in range(2):
+            # The updated row stays locked until commit, so the count read back is ours
+            if counters.update(count=Case(When(window=window, then=F('count') + 1), default=Value(1)), window=window):
+                return counters.values_list('count', flat=True).get()
+            UpstreamCounter.objects.bulk_create([UpstreamCounter(key=key, window=window)], ignore_conflicts=True)
+
+
+def _count(key, seconds):
+    window = _window(seconds)
+    if not isinstance(caches['default'], ATOMIC_INCR_BACKENDS):
+        return UpstreamCounter.objects.filter(key=key, window=window).values_list('count', flat=True).first() or 0
+    return cache.get(f"{key}_{window}") or 0
+
+
+def _reset(key, seconds):
+    if not isinstance(caches['default'], ATOMIC_INCR_BACKENDS):
+        UpstreamCounter.objects.filter(key=key).delete()
+    else:
+        cache.delete(f"{key}_{_window(seconds)}")
+
+
+# Circuit breaker. upstream_failures_<host> counts consecutive failed calls, upstream_open_<host>
+# exists while the circuit is open and upstream_probe_<host> is the half-open probe's lease.
+
+def _enter_breaker(host):
+    """
+    Raises UpstreamUnavailable unless a call may go through. Returns True if the call is the
+    half-open probe.
+    """
+    if cache.get(f"upstream_open_{host}") is not None:
+        raise UpstreamUnavailable(f"{host} circuit is open")
+    if _count(f"upstream_failures_{host}", BREAKER_FAILURE_WINDOW) >= BREAKER_THRESHOLD:
+        # Half-open: only one caller across all workers gets to probe
+        if not cache.add(f"upstream_probe_{host}", 1, timeout=BREAKER_PROBE_TTL):
+            raise UpstreamUnavailable(f"{host} circuit is half-open")
+        return True
+    return False
+
+
+def _retry_delay(host, error, attempt):
+    """
+    Backoff before the next attempt. A 429 pauses every worker for as long, not only this call.
+    """
+    delay = _backoff(attempt)
+    if _is_rate_limit(error):
+        cache.set(f"upstream_pause_{host}", time.time() + delay, timeout=int(delay) + 1)
+    return delay
+
+
+def _record_failure(host, error):
+    """
+    Count a failed call, once its retries are used up.
+    """
+    failures = _incr(f"upstream_failures_{host}", BREAKER_FAILURE_WINDOW)
+    if failures >= BREAKER_THRESHOLD:
+        print(f"Opening circuit for {host} after {failures} failures: {error}")
+        cache.set(f"upstream_open_{host}", 1, timeout=BREAKER_COOLDOWN)
+        cache.delete(f"upstream_probe_{host}")
+
+
+def _record_success(host):
+    _reset(f"upstream_failures_{host}", BREAKER_FAILURE_WINDOW)
+    cache.delete(f"upstream_probe_{host}")
+
+
+# Rate limit. upstream_calls_<host>_<slice> counts the calls of each slice of the sliding window.
+
+def _acquire_slot(host):
+    deadline = time.monotonic() + UPSTREAM_MAX_WAIT
+    while True:
+        wait = _slot_wait(host)
+        if wait <= 0:
+            return
+        if time.monotonic() + wait > deadline:
+            raise UpstreamUnavailable(f"Rate budget for {host} exhausted")
+        time.sleep(wait)
+
+
+def _slot_wait(host):
+    """
+    Counts a call in the host's sliding window. Returns 0 if it fits in the budget, otherwise how
+    long to wait before trying again (until enough calls left the window, or the end of a pause).
+    """
+    now = time.time()
+    paused_until = cache.get(f"upstream_pause_{host}")
+    if paused_until is not None and paused_until > now:
+        return paused_until - now
+
+    current = int(now * UPSTREAM_RATE_SLICES // UPSTREAM_RATE_WINDOW)
+    if not isinstance(caches['default'], ATOMIC_INCR_BACKENDS):
+        counts = _take_slot_row(f"upstream_calls_{host}", current)
+    else:
+        counts = _take_slot(f"upstream_calls_{host}", current)
+    if counts is None:
+        return 0
+    return _slot_free_at(counts) - now
+
+
+def _take_slot(key, current):
+    """
+    Counts a call in the current slice. Returns None if the window had room for it, otherwise the
+    window's {slice: count} (the call isn't counted).
+    """
+    current_key = f"{key}_{current}"
+    cache.add(current_key, 0, timeout=UPSTREAM_RATE_WINDOW * 2 + 1)
+    try:
+        mine = cache.incr(current_key)
+    except ValueError:
+        # The slice expired between add() and incr()
+        mine = 1
+    older = range(current - UPSTREAM_RATE_SLICES, current)
+    found = cache.get_many([f"{key}_{number}" for number in older])
+    counts = {number: found.get(f"{key}_{number}", 0) for number in older}
+    counts[current] = mine
+    if sum(counts.values()) <= UPSTREAM_RATE:
+        return None
+    try:
+        cache.decr(current_key)
+    except ValueError:
+        pass
+    counts[current] -= 1
+    return counts
+
+
+def _take_slot_row(key, current):
+    """
+    _take_slot on UpstreamCounter rows, one per slice, reused round-robin. Locking them all
+    serializes the callers of the same host.
+    """
+    numbers = {f"{key}_{number % (UPSTREAM_RATE_SLICES + 1)}": number
+               for number in range(current - UPSTREAM_RATE_SLICES, current + 1)}
+    with transaction.atomic():
+        rows = list(UpstreamCounter.objects.select_for_update().filter(key__in=numbers).order_by('key'))
+        if len(rows) < len(numbers):
+            UpstreamCounter.objects.bulk_create(
+                [UpstreamCounter(key=slice_key, window=-1) for slice_key in numbers], ignore_conflicts=True
+            )
+            rows = list(UpstreamCounter.objects.select_for_update().filter(key__in=numbers).order_by('key'))
+        # A row still holding an older slice counts as empty
+        counts = {numbers[row.key]: row.count if row.window == numbers[row.key] else 0 for row in rows}
+        if sum(counts.values()) + 1 > UPSTREAM_RATE:
+            return counts
+        row = next(row for row in rows if numbers[row.key] == current)
+        row.count = counts[current] + 1
+        row.window = current
+        row.save(update_fields=['count', 'window'])
+    return None
+
+
+def _slot_free_at(counts):
+    """
+    When enough of the oldest slices have left the window for one more call to fit.
+    """
+    remaining = sum(counts.values())
+    for number in sorted(counts):
+        remaining -= counts[number]
+        if remaining < UPSTREAM_RATE:
+            return (number + UPSTREAM_RATE_SLICES + 1) * UPSTREAM_RATE_WINDOW / UPSTREAM_RATE_SLICES
+    return 0
+
+
+# Async counterparts. Django's async cache API runs the sync methods in a thread anyway (and
+# the database counters need the ORM), so the same bookkeeping runs in a thread instead.
+_aenter_breaker = db_sync_to_async(_enter_breaker)
+_aretry_delay = db_sync_to_async(_retry_delay)
+_arecord_failure = db_sync_to_async(_record_failure)
+_arecord_success = db_sync_to_async(_record_success)
+_aslot_wait = db_sync_to_async(_slot_wait)
+
+
+async def _aacquire_slot(host):
+    deadline = time.monotonic() + UPSTREAM_MAX_WAIT
+    while True:
+        wait = await _aslot_wait(host)
+        if wait <= 0:
+            return
+        if time.monotonic() + wait > deadline:
+            raise UpstreamUnavailable(f"Rate budget for {host} exhausted")
+        await asyncio.sleep(wait)
@@ -10,10 +10,17 @@ urlpatterns = [
     path('stock/<str:ticker>/', views.stock_detail, name='stock_detail'),
     path('favorite/toggle/', views.toggle_favorite, name='toggle_favorite'),
     path('api/stock/<str:ticker>/history/', views.api_stock_history, name='api_stock_history'),
+    path('api/stock/<str:ticker>/quote/', views.api_stock_quote, name='api_stock_quote'),
+    path('api/tickers/suggest/', views.api_ticker_suggest, name='api_ticker_suggest'),
+    path('api/history/', views.api_history_batch, name='api_history_batch'),
+    path('api/stream/quotes/', views.stream_quotes, name='stream_quotes'),
     path('portfolio/', views.portfolio_view, name='portfolio'),
     path('portfolio/add/', views.add_to_portfolio, name='add_to_portfolio'),
+    path('portfolio/import/', views.import_portfolio, name='import_portfolio'),
+    path('api/portfolio/analytics/', views.api_portfolio_analytics, name='api_portfolio_analytics'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
     
     # PWA files
-    path('sw.js', TemplateView.as_view(template_name='stocks/sw.js', content_type='application/javascript'), name='sw'),
+    path('sw.js', views.service_worker, name='sw'),
     path('manifest.json', TemplateView.as_view(template_name='stocks/manifest.json', content_type='application/json'), name='manifest'),
 ]
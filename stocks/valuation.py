@@ -0,0 +1,204 @@
+"""
+Portfolio valuation engine.
+
+Each user's valuation is materialized in a PortfolioSnapshot (plus one PortfolioDailyValue row per
+day) and only the affected parts are recomputed:
+- apply_quotes(): the refresher reprices the snapshot items of the tickers whose quotes it fetched.
+- set_item_quantity(): add_to_portfolio revalues the one item that changed.
+- rebuild_snapshot(): full recompute, for users without a snapshot or with an outdated one.
+"""
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+from .models import PortfolioItem, PortfolioSnapshot, PortfolioDailyValue
+from .services import get_quotes, aget_quotes, QUOTE_TTL
+
+# Older snapshots are rebuilt from the current quotes when the portfolio page is opened
+SNAPSHOT_MAX_AGE = timedelta(seconds=QUOTE_TTL * 5)
+
+
+def value_item(ticker, name, quantity, info):
+    """
+    Valuation of one holding. Holdings without a valid quote are kept (so a later quote can
+    revalue them) but marked as invalid and left out of the totals.
+    """
+    entry = {'ticker': ticker, 'name': name, 'quantity': quantity, 'valid': bool(info.get('valid'))}
+    if not entry['valid']:
+        return entry
+
+    current_price = float(info.get('price') or 0.0)
+    dy = float(info.get('dividend_yield') or 0.0)  # Decimal (e.g. 0.12 for 12%)
+    value = quantity * current_price
+    # For the annual income prediction, we multiply total value by the annual Yield.
+    annual_income = value * dy
+
+    entry.update({
+        'name': info['name'],
+        'current_price': current_price,
+        'total_value': value,
+        'dy_percent': dy * 100,
+        'annual_income': annual_income,
+        'monthly_income': annual_income / 12.0,
+        'currency': info['currency'],
+    })
+    return entry
+
+
+def snapshot_context(snapshot):
+    """
+    Template context of the portfolio page.
+    """
+    items = [entry for entry in snapshot.items if entry['valid']]
+    items_with_dividends = [entry for entry in items if entry['dy_percent'] > 0]
+    items_without_dividends = [entry for entry in items if entry['dy_percent'] <= 0]
+    income = snapshot.annual_income
+    return {
+        'items_with_dividends': items_with_dividends,
+        'items_without_dividends': items_without_dividends,
+        'has_items': bool(items),
+        'total_value': snapshot.total_value,
+        'income_annual': income,
+        'income_semiannual': income / 2.0,
+        'income_quarterly': income / 4.0,
+        'income_monthly': income / 12.0,
+    }
+
+
+def is_outdated(snapshot):
+    return snapshot is None or snapshot.updated_at < timezone.now() - SNAPSHOT_MAX_AGE
+
+
+def rebuild_snapshot(user):
+    items = list(PortfolioItem.objects.filter(user=user))
+    infos = get_quotes([item.ticker for item in items])
+    return save_snapshot(user, _value_items(items, infos))
+
+
+async def arebuild_snapshot(user):
+    """
+    Async version of rebuild_snapshot.
+    """
+    items = [item async for item in PortfolioItem.objects.filter(user=user)]
+    infos = await aget_quotes([item.ticker for item in items])
+    return await sync_to_async(save_snapshot)(user, _value_items(items, infos))
+
+
+def _value_items(items, infos):
+    return [
+        value_item(_key(item.ticker), item.name, float(item.quantity), infos[_key(item.ticker)])
+        for item in items
+    ]
+
+
+def save_snapshot(user, entries):
+    with transaction.atomic():
+        snapshot = PortfolioSnapshot.objects.select_for_update().filter(user=user).first()
+        if snapshot is None:
+            snapshot = PortfolioSnapshot(user=user)
+        _set_entries(snapshot, entries, timezone.now())
+        snapshot.save()
+        _record_daily_values([snapshot])
+    return snapshot
+
+
+def set_item_quantity(user, ticker, info):
+    """
+    Revalue one holding after its quantity changed (removed when it no longer exists).
+    """
+    return set_item_quantities(user, {ticker: info})
+
+
+def set_item_quantities(user, infos):
+    """
+    Revalue the holdings of the given tickers ({ticker: info}) after their quantities changed.
+    The quantities are read from PortfolioItem while the snapshot is locked, so whichever of two
+    concurrent changes writes the snapshot last writes the quantities both of them produced.
+    """
+    if not PortfolioSnapshot.objects.filter(user=user).exists():
+        # Nothing to patch, every holding is valued. Not under the lock: fetching the quotes
+        # writes to the database from the fetch threads, which would wait for it
+        return rebuild_snapshot(user)
+
+    with transaction.atomic():
+        snapshot = PortfolioSnapshot.objects.select_for_update().get(user=user)
+        items = {_key(item.ticker): item for item in PortfolioItem.objects.filter(user=user, ticker__in=list(infos))}
+        entries = list(snapshot.items)
+        for ticker, info in infos.items():
+            ticker = _key(ticker)
+            position = next((i for i, entry in enumerate(entries) if entry['ticker'] == ticker), None)
+            if position is not None:
+                entries.pop(position)
+            item = items.get(ticker)
+            if item is not None and item.quantity > 0:
+                # New holdings go first, like PortfolioItem's ordering
+                entry = value_item(ticker, info.get('name', ticker), float(item.quantity), info)
+                entries.insert(position if position is not None else 0, entry)
+
+        _set_entries(snapshot, entries, timezone.now())
+        snapshot.save()
+        _record_daily_values([snapshot])
+    return snapshot
+
+
+def apply_quotes(infos):
+    """
+    Reprice the snapshots holding any of the given tickers ({ticker: info}, e.g. from the refresher).
+    Only snapshots whose values actually changed are rewritten. Returns how many were.
+    """
+    if not infos:
+        return 0
+    infos = {_key(ticker): info for ticker, info in infos.items()}
+    user_ids = PortfolioItem.objects.filter(ticker__in=list(infos)).values('user_id')
+    now = timezone.now()
+
+    with transaction.atomic():
+        # Locked, in pk order, so a set_item_quantities committing in between can't have its
+        # quantities overwritten by the ones read here
+        snapshots = PortfolioSnapshot.objects.select_for_update().filter(user_id__in=user_ids).order_by('pk')
+        changed = []
+        for snapshot in snapshots:
+            entries = [
+                value_item(entry['ticker'], entry['name'], entry['quantity'], infos[entry['ticker']])
+                if entry['ticker'] in infos else entry
+                for entry in snapshot.items
+            ]
+            # Unchanged snapshots keep their updated_at, so is_outdated still catches the ones
+            # that drifted from their holdings
+            if entries != snapshot.items:
+                _set_entries(snapshot, entries, now)
+                changed.append(snapshot)
+
+        PortfolioSnapshot.objects.bulk_update(changed, ['total_value', 'annual_income', 'items', 'updated_at'])
+        _record_daily_values(changed)
+    return len(changed)
+
+
+def _key(ticker):
+    return ticker.upper().strip()
+
+
+def _set_entries(snapshot, entries, now):
+    valid = [entry for entry in entries if entry['valid']]
+    snapshot.items = entries
+    snapshot.total_value = sum(entry['total_value'] for entry in valid)
+    snapshot.annual_income = sum(entry['annual_income'] for entry in valid)
+    snapshot.updated_at = now
+
+
+def _record_daily_values(snapshots):
+    if not snapshots:
+        return
+    today = timezone.localdate()
+    PortfolioDailyValue.objects.bulk_create(
+        [
+            PortfolioDailyValue(
+                user_id=snapshot.user_id, date=today,
+                total_value=snapshot.total_value, annual_income=snapshot.annual_income
+            )
+            for snapshot in snapshots
+        ],
+        update_conflicts=True,
+        unique_fields=['user', 'date'],
+        update_fields=['total_value', 'annual_income'],
+    )
@@ -1,88 +1,177 @@
 import json
+import asyncio
+import hashlib
+import hmac
+import time
+from functools import lru_cache
 from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.db import DataError
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
-from .models import Favorite, PortfolioItem
-from .services import get_stock_info, get_historical_data
+from .models import Favorite, PortfolioItem, PortfolioSnapshot
+from .services import (
+    get_quote, get_quotes, get_aligned_history,
+    aget_quote, aget_stock_info, aget_historical_payload, aget_history_validators,
+    FAILURE_TTL, HIST_TTL, QUOTE_TTL,
+)
+from .streaming import hub
+from . import fragments, imports, metrics, tickers
+from .ledger import apply_transactions
+from .valuation import (
+    arebuild_snapshot, is_outdated, rebuild_snapshot, set_item_quantities, set_item_quantity, snapshot_context,
+)
+from .analytics import get_portfolio_analytics
+
+# Valid periods broadly accepted by yfinance
+VALID_PERIODS = ['1d', '5d', '1mo', '3mo', '6mo', 'ytd', '1y', '5y', 'max']
+
+# Upper bound on tickers per quote stream, pages with more open several (see main.js)
+MAX_STREAM_TICKERS = 30
+# Upper bound on tickers per history batch, the dashboard splits longer lists (see dashboard.html).
+# The endpoint is public, every ticker may cost an upstream fetch from the shared rate budget
+MAX_HISTORY_TICKERS = 30
+
+# Chart resolution: a phone-sized chart cannot draw more points than this anyway
+CHART_POINTS = 400
+# Resolutions ?points= is rounded up to (the largest one above them all), each one is a cache entry
+# and a downsampling per series
+CHART_RESOLUTIONS = (100, 200, 400, 800)
+
+# How long a history response is served from a browser, proxy or service worker cache without
+# asking the server, per period, after which it is served stale while revalidated (longer series
+# barely change). HTTP caches also keep it for at least HIST_TTL, the server has nothing newer before.
+HISTORY_MAX_AGE = {
+    '1d': 60, '5d': 5 * 60, '1mo': 15 * 60, '3mo': 60 * 60, '6mo': 60 * 60, 'ytd': 60 * 60,
+    '1y': 6 * 60 * 60, '5y': 24 * 60 * 60, 'max': 24 * 60 * 60,
+}
+SW_PRECACHE_PAGES = ['/', '/search/', '/portfolio/']
+SW_PRECACHE_PREFIX = 'stocks/'  # Static files of this app, the admin's are left out
+
+# Fields of the public quote API
+QUOTE_API_FIELDS = ('ticker', 'name', 'price', 'currency', 'change_pct', 'dividend_yield')
+
+# Template rendering and the session/auth lookups stay sync, the async views hand them to a thread
+arender = sync_to_async(render)
+arender_to_string = sync_to_async(render_to_string)
 
 def dashboard(request):
     """
     Main dashboard showing a search bar and user's favorites.
     """
-    favorites = []
-    if request.user.is_authenticated:
-        # Premium color palette for the charts
-        color_palette = [
-            '#3b82f6', # Blue
-            '#10b981', # Green
-            '#f59e0b', # Yellow/Orange
-            '#ef4444', # Red
-            '#8b5cf6', # Purple
-            '#ec4899', # Pink
-            '#06b6d4'  # Cyan
-        ]
-        
-        fav_objects = Favorite.objects.filter(user=request.user)
-        for i, fav in enumerate(fav_objects):
-            # We could cache this info to avoid multiple yfinance calls
-            info = get_stock_info(fav.ticker)
-            if info['valid']:
-                # Assign a color from the palette based on the index
-                info['color'] = color_palette[i % len(color_palette)]
-                favorites.append(info)
+    if not request.user.is_authenticated:
+        favorites_html = render_to_string('stocks/favorite_cards.html', {'favorites': []})
+    else:
+        # Rendered cards are cached until the favorites or their quotes change (see fragments.py)
+        favorites_html, version = fragments.get('dashboard', request.user.id)
+        if favorites_html is None:
+            favorites_html = render_to_string('stocks/favorite_cards.html', {'favorites': _favorite_cards(request.user)})
+            fragments.store('dashboard', request.user.id, version, favorites_html)
     
     return render(request, 'stocks/dashboard.html', {
-        'favorites': favorites,
+        'favorites_html': favorites_html,
     })
 
-def search_stock(request):
+def _favorite_cards(user):
+    # Premium color palette for the charts
+    color_palette = [
+        '#3b82f6', # Blue
+        '#10b981', # Green
+        '#f59e0b', # Yellow/Orange
+        '#ef4444', # Red
+        '#8b5cf6', # Purple
+        '#ec4899', # Pink
+        '#06b6d4'  # Cyan
+    ]
+    
+    favorites = []
+    fav_objects = list(Favorite.objects.filter(user=user))
+    infos = get_quotes([fav.ticker for fav in fav_objects])
+    for i, fav in enumerate(fav_objects):
+        info = infos[fav.ticker.upper().strip()]
+        if info['valid']:
+            # Assign a color from the palette based on the index
+            info['color'] = color_palette[i % len(color_palette)]
+            favorites.append(info)
+    return favorites
+
+async def search_stock(request):
     """
-    Search for a stock ticker.
+    Search for a stock ticker. The query is resolved through the local ticker index; symbols outside
+    it get one upstream probe and are indexed when found, or not probed again for
+    tickers.PROBE_MISS_TTL when upstream does not know them.
     """
     query = request.GET.get('q', '').upper().strip()
     if not query:
-        return render(request, 'stocks/search_results.html', {'error': 'Por favor, insira um ticker.'})
+        return await arender(request, 'stocks/search_results.html', {'error': 'Por favor, insira um ticker.'})
+    
+    entry = await tickers.aresolve(query)
+    if entry is not None:
+        info = await aget_quote(entry.yahoo_symbol)
+    elif tickers.is_probeable(query) and not await tickers.aprobe_missed(query):
+        # Crypto, a new listing...: resolved and probed like any ticker, see _candidate_symbols
+        info = await aget_quote(query)
+        if info['valid']:
+            await sync_to_async(tickers.add)(info)
+        elif info.get('not_found'):
+            await tickers.aremember_probe_miss(query)
+    else:
+        info = {'valid': False}
     
-    info = get_stock_info(query)
     if not info['valid']:
-        return render(request, 'stocks/search_results.html', {'error': f'Ação "{query}" não encontrada.'})
+        return await arender(request, 'stocks/search_results.html', {
+            'error': f'Ação "{query}" não encontrada.',
+            'suggestions': await sync_to_async(tickers.suggest)(query, 5),
+            'query': query
+        })
     
     is_favorite = False
-    if request.user.is_authenticated:
-        is_favorite = Favorite.objects.filter(user=request.user, ticker=query).exists()
+    user = await request.auser()
+    if user.is_authenticated:
+        is_favorite = await Favorite.objects.filter(user=user, ticker=info['ticker']).aexists()
     
-    return render(request, 'stocks/search_results.html', {
+    return await arender(request, 'stocks/search_results.html', {
         'stock': info,
         'is_favorite': is_favorite,
         'query': query
     })
 
-def stock_detail(request, ticker):
+async def stock_detail(request, ticker):
     """
     Show detailed info and historical chart for a specific stock.
     """
     ticker = ticker.upper()
-    info = get_stock_info(ticker)
+    # Quote and chart come from different upstream calls, wait for both at once
+    info, historical_payload = await asyncio.gather(
+        aget_stock_info(ticker),
+        aget_historical_payload(ticker, points=CHART_POINTS)
+    )
     if not info['valid']:
-        return render(request, 'stocks/detail.html', {'error': f'Ação "{ticker}" não encontrada.'})
+        return await arender(request, 'stocks/detail.html', {'error': f'Ação "{ticker}" não encontrada.'})
     
     info['dividend_yield_display'] = info.get('dividend_yield', 0.0) * 100
     
-    historical_data = get_historical_data(ticker)
-    
     is_favorite = False
     portfolio_quantity = 0.0
-    if request.user.is_authenticated:
-        is_favorite = Favorite.objects.filter(user=request.user, ticker=ticker).exists()
-        portfolio_item = PortfolioItem.objects.filter(user=request.user, ticker=ticker).first()
+    user = await request.auser()
+    if user.is_authenticated:
+        is_favorite = await Favorite.objects.filter(user=user, ticker=ticker).aexists()
+        portfolio_item = await PortfolioItem.objects.filter(user=user, ticker=ticker).afirst()
         if portfolio_item:
             portfolio_quantity = float(portfolio_item.quantity)
     
-    return render(request, 'stocks/detail.html', {
+    return await arender(request, 'stocks/detail.html', {
         'stock': info,
-        'historical_data_json': json.dumps(historical_data),
+        'historical_data_json': historical_payload['json'].decode() if historical_payload else 'null',
+        'chart_points': CHART_POINTS,
         'is_favorite': is_favorite,
         'portfolio_quantity': portfolio_quantity
     })
@@ -110,85 +199,182 @@ def toggle_favorite(request):
         favorite.name = name
         favorite.save()
         action = 'added'
+    fragments.invalidate([request.user.id])
     
     return JsonResponse({'status': 'success', 'action': action})
 
-def api_stock_history(request, ticker):
+async def api_stock_history(request, ticker):
     """
     API endpoint to fetch historical data for the interactive chart.
     """
     period = request.GET.get('period', '1mo')
-    
-    # Valid periods broadly accepted by yfinance
-    valid_periods = ['1d', '5d', '1mo', '3mo', '6mo', 'ytd', '1y', '5y', 'max']
-    if period not in valid_periods:
+    if period not in VALID_PERIODS:
         period = '1mo'
+    
+    # Optional server-side downsampling, e.g. ?points=400
+    try:
+        points = int(request.GET.get('points', 0)) or None
+    except ValueError:
+        points = None
+    if points is not None:
+        points = next((size for size in CHART_RESOLUTIONS if size >= points), CHART_RESOLUTIONS[-1])
         
-    historical_data = get_historical_data(ticker, period=period)
+    # Revalidations of a fresh series are answered from its validators, the payload isn't read
+    lifetime = max(HIST_TTL, HISTORY_MAX_AGE[period])
+    validators = await aget_history_validators(ticker, period=period, points=points)
+    if validators is not None:
+        not_modified = _conditional_response(request, validators['etag'], validators['fetched_at'])
+        if not_modified is not None:
+            return _cache_publicly(not_modified, validators['etag'], validators['fetched_at'], lifetime)
+    
+    payload = await aget_historical_payload(ticker, period=period, points=points)
     
-    if historical_data is None:
+    if payload is None:
         return JsonResponse({'error': 'Failed to fetch data'}, status=400)
-        
-    return JsonResponse({'data': historical_data, 'period': period})
+    
+    # The cached bytes are sent as is
+    fetched_at = payload.get('fetched_at')
+    response = _conditional_response(request, payload['etag'], fetched_at)
+    if response is None:
+        response = HttpResponse(payload['json'], content_type='application/json')
+    return _cache_publicly(response, payload['etag'], fetched_at, lifetime)
+
+async def api_stock_quote(request, ticker):
+    """
+    Public quote API, e.g. /api/stock/PETR4/quote/. The same for every user, so browsers and
+    proxies may cache it for as long as the quote is fresh.
+    """
+    info = await aget_quote(ticker)
+    if not info['valid']:
+        response = JsonResponse({'error': 'Ação não encontrada.'}, status=404)
+        patch_cache_control(response, public=True, max_age=FAILURE_TTL)
+        return response
+    
+    body = json.dumps({field: info.get(field) for field in QUOTE_API_FIELDS}, separators=(',', ':')).encode()
+    etag = hashlib.md5(body).hexdigest()
+    fetched_at = info.get('fetched_at')
+    response = _conditional_response(request, etag, fetched_at)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    return _cache_publicly(response, etag, fetched_at, QUOTE_TTL)
+
+def _conditional_response(request, etag, fetched_at):
+    """
+    A 304 answering the request's If-None-Match/If-Modified-Since, or None.
+    """
+    last_modified = int(fetched_at) if fetched_at is not None else None
+    response = get_conditional_response(request, etag=quote_etag(etag), last_modified=last_modified)
+    # If-Match/If-Unmodified-Since mean nothing for these read-only endpoints
+    return response if response is not None and response.status_code == 304 else None
+
+def _cache_publicly(response, etag, fetched_at, lifetime):
+    """
+    Validators and freshness of a response that is the same for every user: fresh until lifetime
+    seconds after the data was fetched, then served stale while revalidated for as long again.
+    """
+    response['ETag'] = quote_etag(etag)
+    if fetched_at is not None:
+        response['Last-Modified'] = http_date(int(fetched_at))
+        max_age = max(0, int(fetched_at + lifetime - time.time()))
+    else:
+        max_age = 0  # Cached before fetch times were recorded
+    patch_cache_control(response, public=True, max_age=max_age, stale_while_revalidate=lifetime)
+    return response
+
+def api_ticker_suggest(request):
+    """
+    Autocomplete API over the local ticker index, e.g. /api/tickers/suggest/?q=petr
+    """
+    try:
+        limit = min(int(request.GET.get('limit', tickers.SUGGEST_LIMIT)), tickers.SUGGEST_MAX_LIMIT)
+    except ValueError:
+        limit = tickers.SUGGEST_LIMIT
+    return JsonResponse({'results': tickers.suggest(request.GET.get('q', ''), max(limit, 1))})
+
+def api_history_batch(request):
+    """
+    API endpoint returning the history of several tickers aligned on a shared date axis,
+    e.g. /api/history/?tickers=PETR4,VALE3&period=1mo (at most MAX_HISTORY_TICKERS tickers)
+    """
+    period = request.GET.get('period', '1mo')
+    if period not in VALID_PERIODS:
+        period = '1mo'
+    
+    tickers = [t.strip().upper() for t in request.GET.get('tickers', '').split(',') if t.strip()]
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return JsonResponse({'error': 'Nenhum ticker fornecido.'}, status=400)
+    if len(tickers) > MAX_HISTORY_TICKERS:
+        return JsonResponse({'error': f'Máximo de {MAX_HISTORY_TICKERS} tickers por requisição.'}, status=400)
+    
+    history = get_aligned_history(tickers, period=period)
+    
+    etag, fetched_at = history.pop('etag'), history.pop('fetched_at')
+    response = _conditional_response(request, etag, fetched_at)
+    if response is None:
+        response = JsonResponse(history)
+    return _cache_publicly(response, etag, fetched_at, max(HIST_TTL, HISTORY_MAX_AGE[period]))
+
+async def stream_quotes(request):
+    """
+    Server-Sent Events stream of live quotes, e.g. /api/stream/quotes/?tickers=PETR4.SA,VALE3.SA
+    Needs to be served through ASGI.
+    """
+    tickers = [t.strip().upper() for t in request.GET.get('tickers', '').split(',') if t.strip()]
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return JsonResponse({'error': 'Nenhum ticker fornecido.'}, status=400)
+    if len(tickers) > MAX_STREAM_TICKERS:
+        return JsonResponse({'error': f'Máximo de {MAX_STREAM_TICKERS} tickers por requisição.'}, status=400)
+    
+    response = StreamingHttpResponse(hub.events(tickers), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let a reverse proxy buffer the stream
+    return response
 
 @login_required
-def portfolio_view(request):
+async def portfolio_view(request):
     """
     Shows the user's stock portfolio, total value and estimated passive income.
     """
-    portfolio_items = PortfolioItem.objects.filter(user=request.user)
+    user = await request.auser()
+    # The valuation is kept up to date by the refresher and add_to_portfolio (see valuation.py)
+    snapshot = await PortfolioSnapshot.objects.filter(user=user).afirst()
+    if is_outdated(snapshot):
+        snapshot = await arebuild_snapshot(user)
     
-    total_value = 0
-    total_annual_income = 0
-    items_with_dividends = []
-    items_without_dividends = []
+    # Every revaluation moves updated_at, so the cached cards always match the snapshot
+    tag = snapshot.updated_at.isoformat()
+    cards_html, version = await fragments.aget('portfolio', user.id, tag)
+    if cards_html is None:
+        cards_html = await arender_to_string('stocks/portfolio_cards.html', snapshot_context(snapshot))
+        await fragments.astore('portfolio', user.id, version, cards_html, tag)
     
-    for item in portfolio_items:
-        info = get_stock_info(item.ticker)
-        if info['valid']:
-            current_price = info.get('price', 0.0)
-            dy = info.get('dividend_yield', 0.0) # Decimal (e.g. 0.12 for 12%)
-            
-            quantity = float(item.quantity)
-            value = quantity * current_price
-            
-            # For the annual income prediction, we multiply total value by the annual Yield.
-            annual_income = value * dy
-            
-            total_value += value
-            total_annual_income += annual_income
-            
-            item_data = {
-                'ticker': item.ticker,
-                'name': info['name'],
-                'quantity': quantity,
-                'current_price': current_price,
-                'total_value': value,
-                'dy_percent': dy * 100,
-                'annual_income': annual_income,
-                'monthly_income': annual_income / 12.0,
-                'currency': info['currency']
-            }
-            
-            if dy > 0:
-                items_with_dividends.append(item_data)
-            else:
-                items_without_dividends.append(item_data)
-            
-    context = {
-        'items_with_dividends': items_with_dividends,
-        'items_without_dividends': items_without_dividends,
-        'has_items': bool(items_with_dividends or items_without_dividends),
-        'total_value': total_value,
-        'income_annual': total_annual_income,
-        'income_semiannual': total_annual_income / 2.0,
-        'income_quarterly': total_annual_income / 4.0,
-        'income_monthly': total_annual_income / 12.0,
-    }
-            
-
-    
-    return render(request, 'stocks/portfolio.html', context)
+    return await arender(request, 'stocks/portfolio.html', {'cards_html': cards_html})
+
+def api_portfolio_analytics(request):
+    """
+    API endpoint with the risk/return analytics of the user's portfolio, e.g. /api/portfolio/analytics/?period=1y
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Você precisa estar logado.'}, status=403)
+    
+    period = request.GET.get('period', '1y')
+    if period not in VALID_PERIODS:
+        period = '1y'
+    
+    snapshot = PortfolioSnapshot.objects.filter(user=request.user).first()
+    if is_outdated(snapshot):
+        snapshot = rebuild_snapshot(request.user)
+    
+    holdings = [
+        {'ticker': entry['ticker'], 'quantity': entry['quantity'], 'dividend_yield': entry['dy_percent'] / 100}
+        for entry in snapshot.items if entry['valid']
+    ]
+    if not holdings:
+        return JsonResponse({'error': 'Sua carteira está vazia.'}, status=404)
+    
+    return JsonResponse(get_portfolio_analytics(request.user.id, holdings, period))
 
 @require_POST
 def add_to_portfolio(request):
@@ -210,28 +396,115 @@ def add_to_portfolio(request):
     if not ticker:
         return JsonResponse({'error': 'Ticker inválido.'}, status=400)
         
-    info = get_stock_info(ticker)
+    info = get_quote(ticker)
     if not info['valid']:
         return JsonResponse({'error': 'Ação não encontrada.'}, status=404)
         
     if quantity == 0:
         return JsonResponse({'error': 'A quantidade deve ser diferente de zero.'}, status=400)
         
-    portfolio_item, created = PortfolioItem.objects.get_or_create(
-        user=request.user, 
-        ticker=ticker,
-        defaults={'name': info['name'], 'quantity': Decimal('0')}
-    )
-    
-    # Accumulate the quantity instead of overwriting
-    portfolio_item.quantity += quantity
-    
-    # If the user subtracted all shares (or more than they had), remove it entirely
-    if portfolio_item.quantity <= 0:
-        portfolio_item.delete()
+    try:
+        holdings = apply_transactions(request.user, [(ticker, quantity)], names={ticker: info['name']})
+    except (ValueError, DataError):
+        return JsonResponse({'error': 'Quantidade acima do limite.'}, status=400)
+    set_item_quantity(request.user, ticker, info)
+    fragments.invalidate([request.user.id])
+
+    # If the user subtracted all shares (or more than they had), it was removed entirely
+    if not holdings[ticker]:
         return JsonResponse({'status': 'success', 'message': 'Ativo removido da carteira.'})
-        
-    portfolio_item.save()
-    
+
     action_verb = "adicionadas à" if quantity > 0 else "subtraídas da"
     return JsonResponse({'status': 'success', 'message': f'{int(abs(quantity))} cotas {action_verb} carteira.'})
+
+@require_POST
+def import_portfolio(request):
+    """
+    Bulk import of transactions: CSV, NDJSON or JSON, sent as the request body or as a `file` upload.
+    All or nothing, one invalid row or unknown ticker rejects the whole import.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Você precisa estar logado.'}, status=403)
+
+    if request.content_type == 'multipart/form-data':
+        upload = request.FILES.get('file')
+        if upload is None:
+            return JsonResponse({'error': 'Nenhum arquivo enviado.'}, status=400)
+        rows, errors = imports.parse(upload, upload.content_type, upload.name)
+    else:
+        rows, errors = imports.parse(request, request.content_type)
+
+    if not errors:
+        # One batch of quotes validates every ticker and names the new holdings
+        quotes = get_quotes({ticker for _, ticker, _ in rows})
+        errors = [
+            {'line': line, 'error': f'Ação não encontrada: {ticker}.'}
+            for line, ticker, _ in rows if not quotes[ticker]['valid']
+        ][:imports.MAX_ERRORS]
+    if errors:
+        return JsonResponse({'error': 'Importação rejeitada.', 'errors': errors}, status=400)
+
+    try:
+        holdings = apply_transactions(
+            request.user, [(ticker, quantity) for _, ticker, quantity in rows],
+            names={ticker: quote['name'] for ticker, quote in quotes.items()}, source='import',
+        )
+    except (ValueError, DataError):
+        return JsonResponse({'error': 'Quantidade acima do limite.'}, status=400)
+    set_item_quantities(request.user, {ticker: quotes[ticker] for ticker in holdings})
+    fragments.invalidate([request.user.id])
+
+    return JsonResponse({
+        'status': 'success',
+        'imported': len(rows),
+        'holdings': {ticker: float(quantity) for ticker, quantity in holdings.items()},
+    })
+
+def prometheus_metrics(request):
+    """
+    Performance counters and latency histograms of every process, in the Prometheus text format.
+    """
+    expected = f"Bearer {settings.METRICS_TOKEN}"
+    provided = request.headers.get('Authorization', '')
+    if not (settings.METRICS_TOKEN and hmac.compare_digest(provided, expected)) and not request.user.is_staff:
+        return HttpResponse(status=403)
+    return HttpResponse(
+        metrics.render(metrics.collect()), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+def service_worker(request):
+    """
+    The service worker script. Its precache list and cache version come from the static files
+    manifest, so every deploy that changes a static file installs a new worker with the new URLs.
+    """
+    # The manifest only changes with a deploy, but in development files change under a running server
+    static_urls, version = _sw_precache.__wrapped__() if settings.DEBUG else _sw_precache()
+    response = render(request, 'stocks/sw.js', {
+        'cache_version': version,
+        'precache_urls': json.dumps(SW_PRECACHE_PAGES + static_urls),
+        'static_url': json.dumps(settings.STATIC_URL),
+        'history_max_age': json.dumps(HISTORY_MAX_AGE),
+    }, content_type='application/javascript')
+    # Browsers must always check for a new worker
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+@lru_cache(maxsize=1)
+def _sw_precache():
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', None)
+    if hashed_files:
+        # Manifest storage after collectstatic: hashed URLs, which change with the content
+        names = sorted(name for name in hashed_files if name.startswith(SW_PRECACHE_PREFIX))
+        urls = [staticfiles_storage.url(name) for name in names]
+        fingerprint = '|'.join(hashed_files[name] for name in names)
+    else:
+        # No manifest (development): plain URLs, versioned by modification time
+        files = {}
+        for finder in finders.get_finders():
+            for path, storage in finder.list([]):
+                if path.startswith(SW_PRECACHE_PREFIX):
+                    files.setdefault(path, storage)
+        names = sorted(files)
+        urls = [staticfiles_storage.url(name) for name in names]
+        fingerprint = '|'.join(f"{name}:{files[name].get_modified_time(name).timestamp()}" for name in names)
+    return urls, hashlib.md5(fingerprint.encode()).hexdigest()[:12]